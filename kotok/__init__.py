@@ -1,2 +1,3 @@
 from .inference import Analyzer
-__all__ = ['Analyzer']
+from .pool import AnalyzerPool
+__all__ = ['Analyzer', 'AnalyzerPool']
@@ -38,27 +38,91 @@ def make_parser():
     train.add_argument('-o','--output', type=str, default=classification_model_default, help='Output directory for the trained model')
     train.add_argument('-l', '--logs', type=str, default='logs', help='Output directory for the logs')
 
+    def add_analyzer_arguments(subparser):
+        """
+        Options of the Analyzer, shared by the commands that load it.
+        """
+        subparser.add_argument('-cm', '--classification_model', type=str, default=classification_model_default, help='Classification model path, generated by the train command')
+        subparser.add_argument('-m', '--model', type=str, default=model_default, help='Pretrained model name or path for tokenization')
+        subparser.add_argument('-c', '--cache', type=str, default=cache_default, help='Cache directory')
+        subparser.add_argument('-n', '--normalize_mode', type=str, default=None, help='Unicode normalization mode')
+        subparser.add_argument('-u', '--user_dict', type=str, default=None, help='User dictionary file or directory path, or an artifact compiled with the user_dict command')
+        subparser.add_argument('-um', '--user_dict_mode', type=str, default='mask', choices=['mask', 'constrained'], help='How user dictionary entries are applied, "mask" classifies the text again with the entries masked, "constrained" decodes the labels of a single classification pass with the entries as constraints')
+        subparser.add_argument('-uw', '--user_dict_weight', type=float, default=None, help='Bonus to the log probability of the labels of user dictionary entries in the constrained mode, by default the labels are forced')
+        subparser.add_argument('-ld', '--lemma_data', type=str, default=lemma_data_default, help='Lemmatization data directory')
+        subparser.add_argument('-nl', '--no_lemma', action='store_true', default=False, help='Disable lemmatization')
+        subparser.add_argument('-ne', '--no_error_correction', action='store_true', default=False, help='Disable error correction')
+        subparser.add_argument('-ecm', '--error_classification_model', type=str, default=error_classification_model_default, help='Error classification model path, generated by the train command')
+        subparser.add_argument('-em', '--error_model', type=str, default=model_default, help='Pretrained model name or path for error correction')
+        subparser.add_argument('-ek', '--error_candidate_top_k', type=int, default=None, help='Only rescore the best k spelling correction candidates of each span, ranked by frequency and typo cost')
+        subparser.add_argument('-ems', '--error_candidate_mass', type=float, default=None, help='Only rescore the best spelling correction candidates of each span covering this share (0 to 1) of the ranking scores')
+        subparser.add_argument('-ete', '--error_typo_engine', type=str, default='search', choices=['search', 'index', 'trie'], help='Spelling correction candidate generator, "search" generates all typos of a span, "index" looks up known words in the typo index built by `python -m kotok.error typo_index`, "trie" searches typos along a trie of the known words')
+        subparser.add_argument('-etc', '--error_typo_cache', type=str, default=None, help='Sqlite file that keeps the spelling correction candidates across runs, pre-warmed with `python -m kotok.error typo_cache`')
+        subparser.add_argument('-ns', '--no_spacing_correction', action='store_true', default=False, help='Disable spacing correction')
+        subparser.add_argument('-scm', '--spacing_classification_model', type=str, default=spacing_classification_model_default, help='Spacing classification model path, generated by the train command')
+        subparser.add_argument('-sm', '--spacing_model', type=str, default=model_default, help='Pretrained model name or path for spacing correction')
+        subparser.add_argument('-sd', '--spacing_decoder', type=str, default='search', choices=['search', 'global'], help='Spacing correction decoder, "search" tries all insert positions of each flagged token, "global" fixes missing and extra spaces from a single pass')
+        subparser.add_argument('-rc', '--result_cache', type=str, default=None, help='Sqlite file that keeps the analysis results by input text across runs and processes')
+        subparser.add_argument('-rcs', '--result_cache_size', type=int, default=4096, help='Number of analysis results kept in memory when a result cache is used')
+        subparser.add_argument('-b', '--backend', type=str, default='torch', choices=['torch', 'onnx'], help='Run the classification models with torch or with onnxruntime on the CPU, exported with the onnx command')
+        subparser.add_argument('-q', '--quantize', type=str, nargs='*', default=None, choices=['pos', 'error', 'spacing'], help='Stages that run their int8 model, quantized with the quantize command. Needs the onnx backend')
+        subparser.add_argument('-mm', '--multitask_model', type=str, default=None, help='Multi-task model path, generated by the multitask train command. Replaces the classification, error and spacing models')
+
     inference = subparsers.add_parser('inference')
-    inference.add_argument('-cm', '--classification_model', type=str, default=classification_model_default, help='Classification model path, generated by the train command')
-    inference.add_argument('-m', '--model', type=str, default=model_default, help='Pretrained model name or path for tokenization')
-    inference.add_argument('-c', '--cache', type=str, default=cache_default, help='Cache directory')
+    add_analyzer_arguments(inference)
     inference.add_argument('-f', '--format', type=str, default='pretty', help='Output format')
-    inference.add_argument('-n', '--normalize_mode', type=str, default=None, help='Unicode normalization mode')
-    inference.add_argument('-u', '--user_dict', type=str, default=None, help='User dictionary file or directory path')
-    inference.add_argument('-ld', '--lemma_data', type=str, default=lemma_data_default, help='Lemmatization data directory')
-    inference.add_argument('-nl', '--no_lemma', action='store_true', default=False, help='Disable lemmatization')
-    inference.add_argument('-ne', '--no_error_correction', action='store_true', default=False, help='Disable error correction')
-    inference.add_argument('-ecm', '--error_classification_model', type=str, default=error_classification_model_default, help='Error classification model path, generated by the train command')
-    inference.add_argument('-em', '--error_model', type=str, default=model_default, help='Pretrained model name or path for error correction')
-    inference.add_argument('-ns', '--no_spacing_correction', action='store_true', default=False, help='Disable spacing correction')
-    inference.add_argument('-scm', '--spacing_classification_model', type=str, default=spacing_classification_model_default, help='Spacing classification model path, generated by the train command')
-    inference.add_argument('-sm', '--spacing_model', type=str, default=model_default, help='Pretrained model name or path for spacing correction')
+    inference.add_argument('-i', '--input', dest='input_path', type=str, default=None, help='Analyze a txt (one text per line) or jsonl file instead of starting the interactive prompt, - for stdin')
+    inference.add_argument('-o', '--output', type=str, default='-', help='Output JSONL file of the analyzed input, - for stdout')
+    inference.add_argument('-if', '--input_format', type=str, default=None, choices=['txt', 'jsonl'], help='Format of the input, by default jsonl for .jsonl files and txt otherwise')
+    inference.add_argument('-tf', '--text_field', type=str, default='text', help='Field of the jsonl records holding the text, also used for txt lines in the output')
+    inference.add_argument('-bs', '--batch_size', type=int, default=None, help='Number of input records read and analyzed at once')
+    inference.add_argument('-d', '--document', action='store_true', default=False, help='Analyze each input record as a document of any length, see Analyzer.run_document')
+
+    serve = subparsers.add_parser('serve')
+    add_analyzer_arguments(serve)
+    serve.add_argument('-H', '--host', type=str, default='127.0.0.1', help='Host to listen on')
+    serve.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on')
+    serve.add_argument('-w', '--max_wait_ms', type=float, default=5.0, help='Maximum time in milliseconds a request waits for other requests to be batched with')
+    serve.add_argument('-bt', '--batch_tokens', type=int, default=4096, help='Maximum number of characters of a batch')
+    serve.add_argument('-bs', '--batch_size', type=int, default=64, help='Maximum number of texts of a batch')
+    serve.add_argument('-wk', '--workers', type=int, default=1, help='Number of threads running batches, the analysis itself is serialized so more threads only overlap batching with it')
 
     lemmatize = subparsers.add_parser('lemmatize')
     lemmatize.add_argument('-d', '--data-dir', type=str, default=lemma_data_default, help='Lemmatization data directory')
 
+    user_dict = subparsers.add_parser('user_dict')
+    user_dict.add_argument('-i', '--input', type=str, required=True, help='User dictionary file or directory path')
+    user_dict.add_argument('-o', '--output', type=str, default=None, help='Output artifact path, defaults to the input path with .kud')
+
+    onnx = subparsers.add_parser('onnx')
+    onnx.add_argument('-i', '--input', type=str, nargs='+', default=[classification_model_default, error_classification_model_default, spacing_classification_model_default], help='Classification model directories to export')
+    onnx.add_argument('-O', '--optimize', action='store_true', default=False, help='Also write a graph-optimized model, which is used instead of the plain export if it exists')
+
+    quantize = subparsers.add_parser('quantize')
+    quantize.add_argument('-i', '--input', type=str, nargs='+', default=[classification_model_default, error_classification_model_default, spacing_classification_model_default], help='Classification model directories, exported with the onnx command')
+    quantize.add_argument('-m', '--model', type=str, default=model_default, help='Pretrained model name or path for tokenization')
+    quantize.add_argument('-c', '--cache', type=str, default=cache_default, help='Cache directory')
+    quantize.add_argument('-d', '--data', type=str, default=os.path.join('data', 'txt'), help='Text file or directory of text files to draw the calibration and evaluation sentences from')
+    quantize.add_argument('-M', '--mode', type=str, default='dynamic', choices=['dynamic', 'static'], help='"dynamic" quantizes the activations at runtime, "static" calibrates their ranges on sentences of the corpus')
+    quantize.add_argument('-cs', '--calibration_size', type=int, default=256, help='Number of sentences for the static calibration')
+    quantize.add_argument('-es', '--eval_size', type=int, default=500, help='Number of held-out sentences to compare the int8 and fp32 models on')
+    quantize.add_argument('-bs', '--batch_size', type=int, default=16, help='Batch size of the calibration and evaluation')
+
+    lexicon = subparsers.add_parser('lexicon')
+    lexicon.add_argument('-i', '--input', type=str, nargs='+', default=[os.path.join(lemma_data_default, 'lemmas.txt'), os.path.join('data', 'correction', 'clean.txt')], help='Word lists with one "word frequency" pair per line')
+    lexicon.add_argument('-o', '--output', type=str, default=None, help='Output file path for a single input, defaults to the input path with .lex')
+
     return parser
 
+def disable_correction_models(args):
+    # If no error or spacing correction is needed, set the model to None to override the default model
+    if args.no_error_correction:
+        args.error_model = None
+        args.error_classification_model = None
+    if args.no_spacing_correction:
+        args.spacing_model = None
+        args.spacing_classification_model = None
+
 def main():
     logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
@@ -79,17 +143,27 @@ def main():
         train(args)
     elif args.command == 'inference':
         from .inference import inference
-        # If no error or spacing correction is needed, set the model to None to override the default model
-        if args.no_error_correction:
-            args.error_model = None
-            args.error_classification_model = None
-        if args.no_spacing_correction:
-            args.spacing_model = None
-            args.spacing_classification_model = None    
+        disable_correction_models(args)
         inference(**args.__dict__)
+    elif args.command == 'serve':
+        from .server import serve
+        disable_correction_models(args)
+        serve(**args.__dict__)
     elif args.command == 'lemmatize':
         from .lemmatize import lemmatize
         lemmatize(**args.__dict__)
+    elif args.command == 'user_dict':
+        from .user_dict import compile_user_dict
+        compile_user_dict(**args.__dict__)
+    elif args.command == 'onnx':
+        from .onnx_backend import onnx_export
+        onnx_export(**args.__dict__)
+    elif args.command == 'quantize':
+        from .quantize import quantize
+        quantize(**args.__dict__)
+    elif args.command == 'lexicon':
+        from .lexicon import lexicon
+        lexicon(**args.__dict__)
 
 
 if __name__ == '__main__':
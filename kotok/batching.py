@@ -0,0 +1,68 @@
+import logging
+
+DEFAULT_MAX_BATCH_TOKENS = 4096
+
+
+def count_tokens(tokenizer, texts):
+    """
+    Number of tokens (including special tokens) of each text.
+    """
+    if not texts:
+        return []
+    encoded = tokenizer(list(texts), add_special_tokens=True)
+    return [len(input_ids) for input_ids in encoded['input_ids']]
+
+
+def make_batches(lengths, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS, same_length=False):
+    """
+    Group indices into batches, so that the padded size of each batch (longest length * batch size) stays within the token budget.
+    Indices are sorted by length first, so that texts of similar length share a batch and little padding is wasted.
+    If same_length is set, only texts of the same length share a batch, so that no padding is needed at all.
+    A single text exceeding the budget is put into a batch on its own.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    batches = []
+    batch = []
+    batch_max_len = 0
+
+    for i in order:
+        length = max(lengths[i], 1)
+        new_max_len = max(batch_max_len, length)
+        if batch and (new_max_len * (len(batch) + 1) > max_batch_tokens or (same_length and length != batch_max_len)):
+            batches.append(batch)
+            batch = []
+            new_max_len = length
+        batch.append(i)
+        batch_max_len = new_max_len
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def run_pipeline_batched(classification_pipeline, texts, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS, same_length=False):
+    """
+    Run a token classification pipeline on many texts at once.
+    Identical texts are only processed once. Results are returned in input order.
+    same_length: see make_batches
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    lengths = count_tokens(classification_pipeline.tokenizer, unique_texts)
+
+    unique_results = [None] * len(unique_texts)
+    for batch in make_batches(lengths, max_batch_tokens, same_length):
+        batch_texts = [unique_texts[i] for i in batch]
+        logging.debug(f'Batch: {len(batch_texts)} texts, {max(lengths[i] for i in batch)} max tokens')
+        batch_results = classification_pipeline(batch_texts, batch_size=len(batch_texts))
+        for i, result in zip(batch, batch_results):
+            unique_results[i] = result
+
+    results_by_text = dict(zip(unique_texts, unique_results))
+
+    # Every occurrence gets its own copy, callers are free to modify the token dicts
+    return [
+        [dict(token) for token in results_by_text[text]]
+        for text in texts
+    ]
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import collections
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry, counts hits, misses and evictions.
+    """
+
+    def __init__(self, maxsize = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default = None):
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class PersistentCache:
+    """
+    Key-value store in a sqlite database, keys are strings and values are stored as JSON.
+    A fingerprint of the data the values were computed from is stored with the cache, the cache is emptied when it changes.
+    With max_entries, the oldest written entries are deleted once the cache grows past it.
+    Several processes can use the same file, each with its own connection, writers wait up to timeout seconds for each other.
+    Threads of a process share the connection, lock is held for each access and can be held across a transaction.
+    """
+
+    def __init__(self, path, fingerprint = None, max_entries = None, timeout = 30.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self.lock = threading.RLock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT)')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.max_entries = max_entries
+        # entries written since the size was last counted, the count is shared with other processes
+        self.writes = 0
+
+        if fingerprint is not None:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', ('fingerprint',)).fetchone()
+            if row is None or row[0] != fingerprint:
+                self.connection.execute('DELETE FROM cache')
+                self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('fingerprint', fingerprint))
+        self.connection.commit()
+
+    def get(self, key, default = None):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value, commit = True):
+        value = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            # a replaced entry gets a new rowid, so rowids are in write order
+            self.connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?)', (key, value))
+            self.writes += 1
+            if self.max_entries is not None and self.writes >= max(self.max_entries // 10, 1):
+                self.evict()
+            if commit:
+                self.connection.commit()
+
+    def evict(self):
+        """
+        Delete the oldest written entries above max_entries.
+        The size is only counted every max_entries / 10 writes, so the cache may exceed it by that much in between.
+        """
+        with self.lock:
+            self.writes = 0
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self.connection.execute('DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?)', (excess,))
+                self.evictions += excess
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def rollback(self):
+        with self.lock:
+            self.connection.rollback()
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,92 @@
+import re
+import dataclasses
+
+# characters of a window, the window and its context on both sides stay below 512 model tokens as one character is at most one token
+# (run_document shrinks the window if normalizing decomposes characters)
+DEFAULT_WINDOW_CHARS = 256
+DEFAULT_CONTEXT_CHARS = 32
+
+# a sentence ends at a line break or at sentence-final punctuation followed by whitespace
+SENTENCE_END = re.compile(r'\n\s*|(?<=[.!?。？！…])\s+')
+WHITESPACE = re.compile(r'\s+')
+
+
+def split_sentences(text):
+    """
+    Spans (start, end) of the sentences of a text, without the whitespace between them.
+    """
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    spans = [strip_span(text, span) for span in spans]
+    return [(start, end) for start, end in spans if start < end]
+
+
+def strip_span(text, span):
+    start, end = span
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def split_long_span(text, start, end, window):
+    """
+    Cuts a span longer than the window at the last whitespace of each window, or within a word if it has none.
+    """
+    spans = []
+    while end - start > window:
+        cut = max(text.rfind(' ', start + 1, start + window + 1), text.rfind('\n', start + 1, start + window + 1))
+        if cut <= start:
+            cut = start + window
+        spans.append(strip_span(text, (start, cut)))
+        start = strip_span(text, (cut, end))[0]
+    spans.append((start, end))
+    return [span for span in spans if span[0] < span[1]]
+
+
+def split_document(text, window = DEFAULT_WINDOW_CHARS):
+    """
+    Spans (start, end) of the chunks of a document: consecutive sentences are merged as long as they fit in the window,
+    longer sentences are cut between words. The whitespace between chunks is not part of any chunk.
+    """
+    chunks = []
+    for start, end in split_sentences(text):
+        if chunks and end - chunks[-1][0] <= window:
+            chunks[-1] = (chunks[-1][0], end)
+        elif end - start <= window:
+            chunks.append((start, end))
+        else:
+            chunks.extend(split_long_span(text, start, end, window))
+    return chunks
+
+
+def context_span(text, start, end, context = DEFAULT_CONTEXT_CHARS):
+    """
+    The span extended by up to context characters on both sides, cut back to whole words where possible.
+    """
+    context_start = max(start - context, 0)
+    if context_start > 0:
+        space = WHITESPACE.search(text, context_start, start)
+        context_start = space.end() if space else start
+    context_end = min(end + context, len(text))
+    while context_end > end and context_end < len(text) and not text[context_end].isspace():
+        context_end -= 1
+    return strip_span(text, (context_start, context_end))
+
+
+def stitch_tokens(all_tokens, windows, spans):
+    """
+    Tokens of the whole text from the tokens of each window (start, end) of the text:
+    a window keeps the tokens starting within its span, offsets are moved from the window to the text.
+    """
+    tokens = []
+    for window_tokens, (window_start, _window_end), (start, end) in zip(all_tokens, windows, spans):
+        for token in window_tokens:
+            if start <= token.start + window_start < end:
+                tokens.append(dataclasses.replace(token, start=token.start + window_start, end=token.end + window_start))
+    return tokens
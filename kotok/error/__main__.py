@@ -32,6 +32,25 @@ def make_parser():
     inference.add_argument('-cm', '--classification_model', type=str, default='kotok_error_model')
     inference.add_argument('-m', '--model', type=str, default=model_default)
     inference.add_argument('-c', '--cache', type=str, default=cache_default)
+    inference.add_argument('-k', '--candidate_top_k', type=int, default=None)
+    inference.add_argument('-ms', '--candidate_mass', type=float, default=None)
+    inference.add_argument('-te', '--typo_engine', type=str, default='search', choices=['search', 'index', 'trie'])
+    inference.add_argument('-tc', '--typo_cache', type=str, default=None)
+
+    typo_index = subparsers.add_parser('typo_index')
+    typo_index.add_argument('-i', '--input', type=str, default=os.path.join('data', 'correction'))
+    typo_index.add_argument('-o', '--output', type=str, default=None)
+    typo_index.add_argument('-k', '--max_masks', type=int, default=3)
+    typo_index.add_argument('-r', '--max_removals', type=int, default=2)
+
+    typo_cache = subparsers.add_parser('typo_cache')
+    typo_cache.add_argument('-i', '--input', type=str, default=os.path.join('data', 'txt'))
+    typo_cache.add_argument('-d', '--correction_data', type=str, default=os.path.join('data', 'correction'))
+    typo_cache.add_argument('-o', '--output', type=str, default=None)
+    typo_cache.add_argument('-te', '--engine', type=str, default='search', choices=['search', 'index', 'trie'])
+    typo_cache.add_argument('-n', '--top', type=int, default=100000)
+    typo_cache.add_argument('--max_depth', type=int, default=4)
+    typo_cache.add_argument('--max_cost', type=float, default=5)
 
     return parser
 
@@ -52,6 +71,12 @@ def main():
     elif args.command == 'inference':
         from .inference import inference
         inference(**args.__dict__)
+    elif args.command == 'typo_index':
+        from .typo_index import typo_index
+        typo_index(**args.__dict__)
+    elif args.command == 'typo_cache':
+        from .typo_cache import typo_cache
+        typo_cache(**args.__dict__)
 
 if __name__ == '__main__':
     main()
@@ -8,6 +8,7 @@ import kiwipiepy
 
 from .labels import pos_tags, label2id
 from .typo_gen import TypoGenerator
+from ..offsets import normalize_with_map
 
 
 kiwi = kiwipiepy.Kiwi(num_workers=0, model_type='sbg')
@@ -49,7 +50,7 @@ def kiwi_tag_map(tag):
     
     return r
 
-def process_sents(tokenizer, normalize_func, sents, max_tokens):
+def process_sents(tokenizer, normalize_mode, sents, max_tokens):
     entries = []
 
     for sent in sents:
@@ -79,20 +80,7 @@ def process_sents(tokenizer, normalize_func, sents, max_tokens):
         for morph in morphs:
             morph_ends.add(morph['end'])
         
-        og_map = {}
-        text_norm = ''
-
-        for text_idx, text_char in enumerate(text):
-            og_map[len(text_norm)] = text_idx
-            text_norm += normalize_func(text_char)
-        og_map[len(text_norm)] = len(text)
-        
-        last_idx = 0
-        for i in range(len(text_norm) + 1):
-            if i in og_map:
-                last_idx = og_map[i]
-            else:
-                og_map[i] = last_idx
+        text_norm, og_map = normalize_with_map(text, normalize_mode)
         
         tokenized_result = tokenizer(text_norm, return_offsets_mapping=True)
         tokens = tokenizer.convert_ids_to_tokens(tokenized_result['input_ids'])
@@ -164,7 +152,7 @@ def process_sents(tokenizer, normalize_func, sents, max_tokens):
 
     return entries
 
-def process_lines(tokenizer, normalize_func, lines, max_tokens):
+def process_lines(tokenizer, normalize_mode, lines, max_tokens):
     multi_sents_txt = [
         unicodedata.normalize('NFC', line)
         for line in lines
@@ -175,7 +163,7 @@ def process_lines(tokenizer, normalize_func, lines, max_tokens):
     entries = []
     for kiwi_result in kiwi_results:
         entries.extend(
-            process_sents(tokenizer, normalize_func, kiwi_result, max_tokens)
+            process_sents(tokenizer, normalize_mode, kiwi_result, max_tokens)
         )
     return entries
 
@@ -217,11 +205,6 @@ def data(
 
     data = []
 
-    if normalize_mode is None:
-        normalize_func = lambda x: x
-    else:
-        normalize_func = lambda x: unicodedata.normalize(normalize_mode, x)
-
     for txt_file in txt_files_iter:
         total = 0
         with open(txt_file, 'r', encoding='utf-8') as f:
@@ -230,7 +213,7 @@ def data(
         with open(txt_file, 'r', encoding='utf-8') as f:
             for lines in chunked(tqdm(f, leave=False, desc=txt_file, total=total), 500):
                 data.extend(
-                    process_lines(tokenizer, normalize_func, lines, max_token_length)
+                    process_lines(tokenizer, normalize_mode, lines, max_token_length)
                 )
 
     print('Shuffling data...')
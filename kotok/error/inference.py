@@ -3,20 +3,30 @@ import logging
 from transformers import pipeline, AutoTokenizer
 # from symspellpy_ko import KoSymSpell, Verbosity
 from .typo import TypoCorrector
+from ..batching import DEFAULT_MAX_BATCH_TOKENS, run_pipeline_batched
 
 # sym_spell = KoSymSpell()
 # sym_spell.load_korean_dictionary(decompose_korean=True, load_bigrams=False)
 
-typo_corrector = TypoCorrector(
-    os.path.join(
-        os.path.dirname(__file__),
-        '..',
-        '..',
-        'data',
-        'correction',
-    )
+CORRECTION_DATA_PATH = os.path.join(
+    os.path.dirname(__file__),
+    '..',
+    '..',
+    'data',
+    'correction',
 )
 
+typo_corrector = None
+
+def get_typo_corrector():
+    """
+    The typo corrector of the correction data, created on first use instead of when this module is imported.
+    """
+    global typo_corrector
+    if typo_corrector is None:
+        typo_corrector = TypoCorrector(CORRECTION_DATA_PATH)
+    return typo_corrector
+
 
 HANGUL_RANGES = [
     (0xAC00, 0xD7A3),  # Hangul Syllables
@@ -37,7 +47,12 @@ def create_pipeline(
     model,
     classification_model,
     cache,
+    backend = 'torch',
 ):
+    if backend != 'torch':
+        from ..onnx_backend import create_onnx_pipeline
+        return create_onnx_pipeline(model, classification_model, cache, backend)
+
     tokenizer = AutoTokenizer.from_pretrained(model, cache_dir=cache)
 
     return pipeline(
@@ -56,9 +71,8 @@ def should_correct_token(token, error_min_score=0.4, no_error_max_score=0.5):
         return score > error_min_score
     return score < no_error_max_score
 
-def avg_score_in_span(classification_pipeline, text, start_idx, end_idx):
+def avg_score_of_tokens(tokens, start_idx, end_idx):
     scores = []
-    tokens = classification_pipeline(text)
     for token in tokens:
         token_start = token['start']
         token_end = token['end']
@@ -78,13 +92,39 @@ def avg_score_in_span(classification_pipeline, text, start_idx, end_idx):
 
     return sum(scores) / len(scores)
 
+def avg_score_in_span(classification_pipeline, text, start_idx, end_idx):
+    tokens = classification_pipeline(text)
+    return avg_score_of_tokens(tokens, start_idx, end_idx)
+
+def avg_scores_in_spans(classification_pipeline, texts, spans, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS):
+    """
+    Same as avg_score_in_span for many texts, each with its own span (start_idx, end_idx).
+    Only texts with the same number of tokens share a batch, without padding the scores are the same as when classified one by one.
+    """
+    all_tokens = run_pipeline_batched(classification_pipeline, texts, max_batch_tokens, same_length=True)
+    return [
+        avg_score_of_tokens(tokens, start_idx, end_idx)
+        for tokens, (start_idx, end_idx) in zip(all_tokens, spans)
+    ]
+
 def correct(
     classification_pipeline,
     text,
     correction_min_score=0.7,
     text_start_idx=0,
+    tokens=None,
+    max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+    candidate_top_k=None,
+    candidate_mass=None,
+    typo_engine=None,
 ):
-    tokens = classification_pipeline(text)
+    """
+    Correct the spelling of a text, returns the corrected text and the applied corrections.
+    candidate_top_k, candidate_mass: only rescore the best candidates of each span by their noisy channel score, see TypoCorrector.rank
+    typo_engine: 'search' or 'index', see TypoCorrector
+    """
+    if tokens is None:
+        tokens = classification_pipeline(text)
 
     logging.debug(f'Tokens:')
     for token in tokens:
@@ -148,16 +188,26 @@ def correct(
         logging.debug(f'Checking span: {span}')
 
         # corrections = sym_spell.lookup(span, Verbosity.ALL, max_edit_distance=2)
-        corrections = typo_corrector.correct(span, max_depth=4, max_cost=5)
+        corrections = get_typo_corrector().correct(span, max_depth=4, max_cost=5, top_k=candidate_top_k, mass=candidate_mass, engine=typo_engine)
+
+        # score all corrections of the span together
+        corrected_texts = [
+            text[:i_start_idx] + correction[0] + text[i_end_idx:]
+            for correction in corrections
+        ]
+        corrected_spans = [
+            (i_start_idx, i_start_idx + len(correction[0]))
+            for correction in corrections
+        ]
+        corrected_scores = avg_scores_in_spans(classification_pipeline, corrected_texts, corrected_spans, max_batch_tokens)
 
         best_correction = None
 
         for i_correction, correction in enumerate(corrections):
             corrected_span = correction[0]
-            corrected_span_start_idx = i_start_idx
-            corrected_span_end_idx = corrected_span_start_idx + len(corrected_span)
-            corrected_text = text[:i_start_idx] + corrected_span + text[i_end_idx:]
-            corrected_score = avg_score_in_span(classification_pipeline, corrected_text, corrected_span_start_idx, corrected_span_end_idx)
+            corrected_span_end_idx = corrected_spans[i_correction][1]
+            corrected_text = corrected_texts[i_correction]
+            corrected_score = corrected_scores[i_correction]
             adj_corrected_score = corrected_score - (correction[1] * 0.025)
 
             logging.debug(f'Correction {i_correction+1}: {corrected_span} ({corrected_score:.05f}, {adj_corrected_score:.05f})')
@@ -175,7 +225,11 @@ def correct(
             applied_corrections.append({
                 'span': span,
                 'corrected_span': best_correction['corrected_span'],
-                'score': best_correction['score'],
+                # numpy scores are not JSON serializable
+                'score': float(best_correction['score']),
+                # position of the corrected span in the corrected text
+                'start': i_start_idx,
+                'end': best_correction['corrected_span_end_idx'],
             })
             
             sub_text, sub_applied_corrections = correct(
@@ -183,6 +237,10 @@ def correct(
                 text,
                 correction_min_score=correction_min_score,
                 text_start_idx=best_correction['corrected_span_end_idx'],
+                max_batch_tokens=max_batch_tokens,
+                candidate_top_k=candidate_top_k,
+                candidate_mass=candidate_mass,
+                typo_engine=typo_engine,
             )
             text = sub_text
 
@@ -193,10 +251,42 @@ def correct(
     return text, applied_corrections
 
 
+def correct_many(
+    classification_pipeline,
+    texts,
+    correction_min_score=0.7,
+    max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+    candidate_top_k=None,
+    candidate_mass=None,
+    typo_engine=None,
+):
+    """
+    Correct the spelling of many texts. The initial classification of all texts is done in batches,
+    only texts with spelling errors need further passes.
+    """
+    all_tokens = run_pipeline_batched(classification_pipeline, texts, max_batch_tokens)
+    return [
+        correct(
+            classification_pipeline,
+            text,
+            correction_min_score=correction_min_score,
+            tokens=tokens,
+            max_batch_tokens=max_batch_tokens,
+            candidate_top_k=candidate_top_k,
+            candidate_mass=candidate_mass,
+            typo_engine=typo_engine,
+        )
+        for text, tokens in zip(texts, all_tokens)
+    ]
+
+
 def create_error_corrector(
     model,
     classification_model,
     cache = None,
+    candidate_top_k = None,
+    candidate_mass = None,
+    typo_engine = None,
 ):
     classification_pipeline = create_pipeline(
         model,
@@ -205,15 +295,30 @@ def create_error_corrector(
     )
 
     def error_corrector(text):
-        return correct(classification_pipeline, text)
+        return correct(classification_pipeline, text, candidate_top_k=candidate_top_k, candidate_mass=candidate_mass, typo_engine=typo_engine)
 
     return error_corrector
 
 
+def candidate_stats():
+    """
+    Counts of the typo candidates since the start, 'saved' is the number of model passes saved by candidate pruning.
+    Also holds the counters of the candidate caches.
+    """
+    stats = dict(get_typo_corrector().stats)
+    stats['saved'] = stats.get('pruned', 0)
+    stats.update(get_typo_corrector().cache_stats())
+    return stats
+
+
 def inference(
     model,
     classification_model,
     cache,
+    candidate_top_k=None,
+    candidate_mass=None,
+    typo_engine=None,
+    typo_cache=None,
     **kwargs,
 ):
     classification_pipeline = create_pipeline(
@@ -222,13 +327,20 @@ def inference(
         cache,
     )
 
+    if typo_cache:
+        get_typo_corrector().open_cache(typo_cache, typo_engine)
+
     while True:
         try:
             text = input('> ')
             if not text:
                 continue
-            print(correct(classification_pipeline, text))
+            print(correct(classification_pipeline, text, candidate_top_k=candidate_top_k, candidate_mass=candidate_mass, typo_engine=typo_engine))
         except KeyboardInterrupt:
             break
         except EOFError:
-            break
\ No newline at end of file
+            break
+
+    stats = candidate_stats()
+    logging.info(f'Candidates: {stats.get("candidates", 0)} in {stats.get("spans", 0)} spans, {stats["saved"]} model passes saved by pruning')
+    logging.info(f'Candidate cache: {stats["cache_hits"]} hits, {stats["cache_misses"]} misses, {stats["cache_evictions"]} evictions')
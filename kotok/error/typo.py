@@ -4,8 +4,14 @@
 #   Support latin characters
 
 import os
+import json
+import math
+import logging
+import collections
 from typing import Optional
-import hangul_jamo
+from ..cache import LRUCache, PersistentCache, DEFAULT_CACHE_SIZE
+from ..lexicon import load_word_list
+from ..jamo import decompose_syllable, compose_syllable
 
 COST_KEY_ADJACENT = 1.25
 COST_KEY_LAYER = 1.0
@@ -18,6 +24,9 @@ COST_BATCHIM_SHIFT = 0.5
 COST_LENGTHEN = 0.25
 COST_BATCHIM_REMOVE = 2.0
 
+# weight of the typo cost against the log frequency when ranking candidates
+CANDIDATE_COST_WEIGHT = 1.0
+
 HANGUL_RANGES = [
     (0xAC00, 0xD7A3),  # Hangul Syllables
     (0x1100, 0x11FF),  # Hangul Jamo
@@ -255,21 +264,10 @@ def batchim_remove(s):
         return None
     return (c, v, None)
 
-def typo(syllables: tuple[tuple[str, str, Optional[str]]], max_depth = 5, max_cost = 4.5, candidates = None, current_cost = 0.0):
-    if candidates is None:
-        candidates = {}
-    if max_depth == 0 or current_cost > max_cost:
-        return candidates
-    
-    def add_candidate(syllables, cost):
-        actual_cost = current_cost + cost
-        if actual_cost > max_cost:
-            return
-        if syllables not in candidates or candidates[syllables] > actual_cost:
-            candidates[syllables] = actual_cost
-            typo(syllables, max_depth - 1, max_cost, candidates, actual_cost)
-
-
+def typo_operations(syllables: tuple[tuple[str, str, Optional[str]]]):
+    """
+    Syllables one typo operation turns the syllables into, with the cost of the operation.
+    """
     num_s = len(syllables)
     for i, s in enumerate(syllables):
         s_next = syllables[i+1] if i < num_s-1 else None
@@ -277,45 +275,59 @@ def typo(syllables: tuple[tuple[str, str, Optional[str]]], max_depth = 5, max_co
         # Attempt Batchim shift
         if s_next:
             for s_pair in batchim_shift(s, s_next):
-                candidate = syllables[:i] + s_pair + syllables[i + 2:]
-                add_candidate(candidate, COST_BATCHIM_SHIFT)
+                yield syllables[:i] + s_pair + syllables[i + 2:], COST_BATCHIM_SHIFT
 
         # Attempt lengthening removal
         if s_next and lengthening_remove(s, s_next):
-            candidate = syllables[:i] + syllables[i+1:]
-            add_candidate(candidate, COST_LENGTHEN)
+            yield syllables[:i] + syllables[i+1:], COST_LENGTHEN
 
         # Attempt lengthening
         s_lengthening = lengthening_add(s)
         if s_lengthening:
-            candidate = syllables[:i] + (s, s_lengthening) + syllables[i+1:]
-            add_candidate(candidate, COST_LENGTHEN)
+            yield syllables[:i] + (s, s_lengthening) + syllables[i+1:], COST_LENGTHEN
 
         # Attempt batchim removal
         s_batchim_removed = batchim_remove(s)
         if s_batchim_removed:
-            candidate = syllables[:i] + (s_batchim_removed,) + syllables[i+1:]
-            add_candidate(candidate, COST_BATCHIM_REMOVE)
+            yield syllables[:i] + (s_batchim_removed,) + syllables[i+1:], COST_BATCHIM_REMOVE
 
         c, v, b = s
 
         # Consonant typos
         if c in swap_costs_con:
             for c2, cost in swap_costs_con[c].items():
-                candidate = syllables[:i] + ((c2, v, b),) + syllables[i+1:]
-                add_candidate(candidate, cost)
+                yield syllables[:i] + ((c2, v, b),) + syllables[i+1:], cost
 
         # Vowel typos
         if v in swap_costs_vov:
             for v2, cost in swap_costs_vov[v].items():
-                candidate = syllables[:i] + ((c, v2, b),) + syllables[i+1:]
-                add_candidate(candidate, cost)
+                yield syllables[:i] + ((c, v2, b),) + syllables[i+1:], cost
 
         # Batchim typos
         if b in swap_costs_bat:
             for b2, cost in swap_costs_bat[b].items():
-                candidate = syllables[:i] + ((c, v, b2),) + syllables[i+1:]
-                add_candidate(candidate, cost)
+                yield syllables[:i] + ((c, v, b2),) + syllables[i+1:], cost
+
+def typo(syllables: tuple[tuple[str, str, Optional[str]]], max_depth = 5, max_cost = 4.5):
+    """
+    All syllables reachable with 1 to max_depth typo operations costing at most max_cost in total, {syllables: cost}
+    with the cheapest cost over all sequences of operations. The text itself is only a candidate if operations lead back to it.
+    Expands one number of operations at a time, a sequence that reaches syllables more cheaply with fewer operations is not continued.
+    """
+    candidates = {}
+    level = {syllables: 0.0}
+
+    for _depth in range(max_depth):
+        next_level = {}
+        for current, current_cost in level.items():
+            for candidate, cost in typo_operations(current):
+                cost += current_cost
+                if cost > max_cost or cost >= candidates.get(candidate, math.inf):
+                    continue
+                if cost < next_level.get(candidate, math.inf):
+                    next_level[candidate] = cost
+        candidates.update(next_level)
+        level = next_level
 
     return candidates
 
@@ -329,13 +341,15 @@ lengthenable_jamo = {
     'ㅣ',
 }
 
-def typo_text(text: str, max_depth = 4, max_cost = 4.0, return_suffix = False):
-    suffix = ''
+def split_syllables(text: str):
+    """
+    Split a text into the syllables (jamo triples) of its leading hangul part and the remaining suffix.
+    """
     syllables = []
 
     for char in text:
         try:
-            jamo = hangul_jamo.decompose_syllable(char)
+            jamo = decompose_syllable(char)
             syllables.append(jamo)
         except ValueError:
             if char in lengthenable_jamo:
@@ -344,12 +358,17 @@ def typo_text(text: str, max_depth = 4, max_cost = 4.0, return_suffix = False):
                 break
     suffix = text[len(syllables):]
 
-    result = typo(tuple(syllables), max_depth, max_cost).items()
+    return tuple(syllables), suffix
+
+def typo_text(text: str, max_depth = 4, max_cost = 4.0, return_suffix = False):
+    syllables, suffix = split_syllables(text)
+
+    result = typo(syllables, max_depth, max_cost).items()
     candidates = {}
 
     for syllables, cost in result:
         try:
-            typoed_text = ''.join(hangul_jamo.compose_jamo_characters(*s) for s in syllables)
+            typoed_text = ''.join(compose_syllable(*s) for s in syllables)
         except ValueError:
             # invalid jamo combination
             continue
@@ -364,27 +383,200 @@ def typo_text(text: str, max_depth = 4, max_cost = 4.0, return_suffix = False):
 
 
 class TypoCorrector:
-    def __init__(self, correction_data_path: str):
+    def __init__(self, correction_data_path: str, engine = 'search', cache_size = DEFAULT_CACHE_SIZE, cache_path: Optional[str] = None):
+        """
+        engine: 'search' generates all typos of a text and keeps the known ones,
+        'index' looks up known words in the typo index (see typo_index.py), loaded on first use,
+        'trie' searches typos along a trie of the known words (see typo_search.py), built on first use
+        cache_size: number of texts whose candidates are kept in memory
+        cache_path: sqlite file to keep the candidates of all texts across processes, see open_cache
+        """
         self.correction_data_path = correction_data_path
+        self.engine = engine
+        self.index = None
+        # size and mtime of the loaded index file, part of the cache keys of its candidates
+        self.index_signature = None
+        self.trie = None
         self.load_correction_data()
+        # spans: corrected spans, candidates: known candidates, pruned: candidates removed by ranking
+        self.stats = collections.Counter()
+        self.cache = LRUCache(cache_size)
+        self.persistent_cache = None
+        if cache_path:
+            self.open_cache(cache_path)
 
     def load_correction_data(self):
-        self.clean_data = {}
-        clean_path = os.path.join(self.correction_data_path, 'clean.txt')
+        # the compiled lexicon (clean.lex) is memory-mapped instead of reading clean.txt if it exists
+        self.clean_data, self.clean_path = load_word_list(os.path.join(self.correction_data_path, 'clean.txt'))
+
+    def prior(self, candidate: str, cost: float, cost_weight = CANDIDATE_COST_WEIGHT):
+        """
+        Noisy channel score of a known candidate: log frequency of the candidate (language model)
+        minus the weighted typo cost (negative log probability of the typo).
+        """
+        return math.log(max(self.clean_data[candidate], 1)) - cost * cost_weight
+
+    def rank(self, candidates: list, top_k: Optional[int] = None, mass: Optional[float] = None, cost_weight = CANDIDATE_COST_WEIGHT):
+        """
+        Sort known candidates (candidate, cost) by their noisy channel score, best first.
+        top_k: keep at most this many candidates
+        mass: keep the best candidates until their share of the normalized scores reaches this value (0 to 1)
+        """
+        scores = [self.prior(candidate, cost, cost_weight) for candidate, cost in candidates]
+        order = sorted(range(len(candidates)), key=lambda i: -scores[i])
+
+        if mass is not None and order:
+            max_score = scores[order[0]]
+            probs = [math.exp(scores[i] - max_score) for i in order]
+            total = sum(probs)
+            cumulative = 0.0
+            for n, prob in enumerate(probs):
+                cumulative += prob / total
+                if cumulative >= mass:
+                    order = order[:n + 1]
+                    break
 
-        with open(clean_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                clean, freq = line.strip().split()
-                self.clean_data[clean] = int(freq)
+        if top_k is not None:
+            order = order[:top_k]
+
+        return [candidates[i] for i in order]
+
+    def load_index(self):
+        from .typo_index import TypoIndex, INDEX_FILE_NAME, words_signature
+
+        index_path = os.path.join(self.correction_data_path, INDEX_FILE_NAME)
+        self.index = None
+        if os.path.exists(index_path):
+            try:
+                self.index = TypoIndex.load(index_path)
+            except (ValueError, KeyError) as e:
+                logging.warning(f'Could not load the typo index {index_path}, rebuilding it: {e}')
+            else:
+                if self.index.source != words_signature(self.clean_data):
+                    logging.warning(f'The typo index {index_path} was built from other words than {self.clean_path}, rebuilding it')
+                    self.index = None
+        else:
+            logging.info(f'No typo index at {index_path}, building it once')
+
+        if self.index is None:
+            self.index = TypoIndex.build(self.clean_data)
+            try:
+                self.index.save(index_path)
+            except OSError as e:
+                logging.warning(f'Could not write the typo index to {index_path}, it is built again by the next process: {e}')
+                self.index_signature = 'memory'
+                return
+        stat = os.stat(index_path)
+        self.index_signature = f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def preload(self, engine: Optional[str] = None):
+        """
+        Load the index or build the trie of the engine now instead of on first use, e.g. before forking worker processes that share it.
+        """
+        engine = engine or self.engine
+        if engine == 'index' and self.index is None:
+            self.load_index()
+        elif engine == 'trie' and self.trie is None:
+            from .typo_search import DictionaryTrie
+            self.trie = DictionaryTrie(self.clean_data)
+
+    def fingerprint(self):
+        """
+        Identifies the correction data, cached candidates are only valid for the same data.
+        """
+        stat = os.stat(self.clean_path)
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def engine_key(self, engine: str):
+        # candidates of the index also depend on the index file, a rebuilt index only changes the keys of its candidates
+        if engine == 'index':
+            if self.index is None:
+                self.load_index()
+            return f'index:{self.index_signature}:{self.index.max_masks}:{self.index.max_removals}'
+        return engine
+
+    def open_cache(self, path: str, engine: Optional[str] = None):
+        """
+        Keep the candidates of all texts in a sqlite file, which can be shared by processes and pre-warmed with `python -m kotok.error typo_cache`.
+        engine: the engine the candidates will be found with, its index or trie is loaded first, see preload
+        """
+        self.preload(engine)
+        self.persistent_cache = PersistentCache(path, self.fingerprint())
+
+    def cache_stats(self):
+        stats = {f'cache_{k}': v for k, v in self.cache.stats().items()}
+        if self.persistent_cache is not None:
+            stats.update({f'persistent_cache_{k}': v for k, v in self.persistent_cache.stats().items()})
+        return stats
+
+    def candidates(self, text: str, max_depth = 4, max_cost = 4.0, engine: Optional[str] = None, commit = True):
+        """
+        Known corrections [(candidate, cost)] of the hangul part of a text and the remaining suffix, cached.
+        """
+        engine = engine or self.engine
+        key = (self.engine_key(engine), text, int(max_depth), float(max_cost))
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        if self.persistent_cache is not None:
+            persistent_key = json.dumps(key, ensure_ascii=False)
+            persistent_cached = self.persistent_cache.get(persistent_key)
+            if persistent_cached is not None:
+                r, suffix = persistent_cached
+                cached = ([tuple(candidate) for candidate in r], suffix)
+                self.cache.put(key, cached)
+                return cached
+
+        cached = self.find_candidates(text, max_depth, max_cost, engine)
+        self.cache.put(key, cached)
+        if self.persistent_cache is not None:
+            self.persistent_cache.put(persistent_key, cached, commit=commit)
+        return cached
+
+    def find_candidates(self, text: str, max_depth, max_cost, engine):
+        if engine == 'index':
+            if self.index is None:
+                self.load_index()
+            syllables, suffix = split_syllables(text)
+            candidates = self.index.lookup(syllables, max_depth, max_cost)
+        elif engine == 'trie':
+            from .typo_search import DictionaryTrie, search
+            if self.trie is None:
+                self.trie = DictionaryTrie(self.clean_data)
+            syllables, suffix = split_syllables(text)
+            candidates = search(self.trie, syllables, max_depth, max_cost)
+        elif engine == 'search':
+            candidates, suffix = typo_text(text, max_depth, max_cost, return_suffix=True)
+        else:
+            raise ValueError(f'Invalid typo engine: {engine}')
 
-    def correct(self, text: str, max_depth = 4, max_cost = 4.0):
-        candidates, suffix = typo_text(text, max_depth, max_cost, return_suffix=True)
         r = []
         for candidate, cost in candidates.items():
             if not candidate in self.clean_data:
                 continue
-            r.append((candidate + suffix, cost))
-        return r
+            r.append((candidate, cost))
+
+        return r, suffix
+
+    def correct(self, text: str, max_depth = 4, max_cost = 4.0, top_k: Optional[int] = None, mass: Optional[float] = None, engine: Optional[str] = None):
+        """
+        Known corrections (text, cost) of a text.
+        If top_k or mass is given, candidates are ranked by their noisy channel score and pruned, see rank.
+        engine: overrides the engine of the corrector
+        """
+        r, suffix = self.candidates(text, max_depth, max_cost, engine)
+
+        self.stats['spans'] += 1
+        self.stats['candidates'] += len(r)
+
+        if top_k is not None or mass is not None:
+            ranked = self.rank(r, top_k, mass)
+            self.stats['pruned'] += len(r) - len(ranked)
+            r = ranked
+
+        return [(candidate + suffix, cost) for candidate, cost in r]
 
 
 def main():
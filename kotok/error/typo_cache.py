@@ -0,0 +1,65 @@
+import os
+import collections
+from tqdm import tqdm
+from .typo import TypoCorrector, is_hangul
+
+TYPO_CACHE_FILE_NAME = 'typo_cache.sqlite'
+
+
+def hangul_words(line):
+    """
+    Runs of hangul characters in a line, the spans the error corrector looks up are always within such a run.
+    """
+    word = ''
+    for char in line:
+        if is_hangul(char):
+            word += char
+        elif word:
+            yield word
+            word = ''
+    if word:
+        yield word
+
+
+def typo_cache(
+    input,
+    correction_data,
+    output,
+    engine,
+    top,
+    max_depth,
+    max_cost,
+    **_kwargs,
+):
+    """
+    Pre-warm the persistent typo cache with the candidates of the most frequent words of a corpus.
+    """
+    txt_files = []
+    if os.path.isfile(input):
+        txt_files.append(input)
+    elif os.path.isdir(input):
+        for root, _, files in os.walk(input):
+            for file in files:
+                if file.endswith('.txt'):
+                    txt_files.append(os.path.join(root, file))
+    else:
+        raise ValueError(f'Invalid input: {input}')
+    txt_files.sort()
+
+    print('Counting words...')
+    counts = collections.Counter()
+    for txt_file in txt_files:
+        with open(txt_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                counts.update(hangul_words(line))
+
+    output = output or os.path.join(correction_data, TYPO_CACHE_FILE_NAME)
+    typo_corrector = TypoCorrector(correction_data, engine=engine, cache_path=output)
+
+    print(f'Caching candidates of {min(top, len(counts))} of {len(counts)} words in {output}...')
+    for i, (word, _count) in enumerate(tqdm(counts.most_common(top))):
+        typo_corrector.candidates(word, max_depth, max_cost, commit=False)
+        if i % 1000 == 999:
+            typo_corrector.persistent_cache.commit()
+
+    typo_corrector.persistent_cache.close()
@@ -1,5 +1,5 @@
 import random
-import hangul_jamo
+from ..jamo import decompose_syllable, compose_syllable
 
 class TypoGenerator:
     def __init__(self, char_typo_probability=0.3, word_typo_probability=0.5, multiple_component_chance=0.4):
@@ -228,7 +228,7 @@ class TypoGenerator:
             # Apply typo with probability
             if self.should_apply_typo():
                 # Decompose the character
-                leading, vowel, trailing = hangul_jamo.decompose_syllable(char)
+                leading, vowel, trailing = decompose_syllable(char)
                 
                 # Possibly modify multiple components
                 components_to_alter = []
@@ -254,7 +254,7 @@ class TypoGenerator:
                 
                 # Compose the character back
                 try:
-                    char = hangul_jamo.compose_jamo_characters(leading, vowel, trailing)
+                    char = compose_syllable(leading, vowel, trailing)
                 except:
                     # Fallback if composition fails
                     pass
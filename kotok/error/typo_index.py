@@ -0,0 +1,381 @@
+import os
+import json
+import math
+import hashlib
+import logging
+from .typo import (
+    COST_BATCHIM_SHIFT,
+    COST_LENGTHEN,
+    COST_BATCHIM_REMOVE,
+    swap_costs_con,
+    swap_costs_vov,
+    swap_costs_bat,
+    batchim_split,
+    batchim_shift,
+    lengthening_add,
+    lengthening_remove,
+    split_syllables,
+)
+
+INDEX_VERSION = 3
+INDEX_FILE_NAME = 'typo_index.json'
+
+
+def to_slots(syllables):
+    """
+    Flatten syllables into jamo slots, three per syllable, a missing batchim is an empty slot.
+    """
+    return tuple(jamo or '' for syllable in syllables for jamo in syllable)
+
+def block_keys(slots, max_masks):
+    """
+    Keys of the slots split into max_masks + 1 blocks of consecutive slots, one per block.
+    Slots of the same length differing in at most max_masks slots have at least one block in common.
+    """
+    num_slots = len(slots)
+    num_blocks = max_masks + 1
+    for block in range(num_blocks):
+        start, end = block * num_slots // num_blocks, (block + 1) * num_slots // num_blocks
+        yield '|'.join((str(num_slots), str(block)) + slots[start:end])
+
+def words_signature(words):
+    """
+    Hash of the words an index is built from, independent of their order and frequencies.
+    """
+    h = hashlib.sha256()
+    for word in sorted(words):
+        h.update(word.encode('utf-8') + b'\n')
+    return h.hexdigest()[:16]
+
+def count_differences(slots_from, slots_to):
+    return sum(jamo_from != jamo_to for jamo_from, jamo_to in zip(slots_from, slots_to))
+
+
+def swap_closure(swap_costs, max_steps):
+    """
+    Cheapest cost of turning a jamo into another jamo with up to k swaps, {(from, to): [cost with <= 1 swap, cost with <= 2 swaps, ...]}.
+    Turning a jamo into itself needs at least one swap away and back.
+    """
+    best = {}
+    for jamo_from, jamo_to_dict in swap_costs.items():
+        for jamo_to, cost in jamo_to_dict.items():
+            best[(jamo_from, jamo_to)] = cost
+
+    closure = {pair: [cost] for pair, cost in best.items()}
+    for _step in range(1, max_steps):
+        next_best = dict(best)
+        for (jamo_from, jamo_mid), cost in best.items():
+            for jamo_to, swap_cost in swap_costs.get(jamo_mid, {}).items():
+                pair = (jamo_from, jamo_to)
+                if pair not in next_best or next_best[pair] > cost + swap_cost:
+                    next_best[pair] = cost + swap_cost
+        best = next_best
+        for pair, cost in best.items():
+            closure.setdefault(pair, []).append(cost)
+
+    # pad pairs that were first reached after the first step
+    for pair, costs in closure.items():
+        closure[pair] = [math.inf] * (max_steps - len(costs)) + costs
+
+    return closure
+
+def batchim_swap_costs():
+    """
+    Batchim swaps including the removal of the batchim (to an empty slot).
+    """
+    costs = {jamo_from: dict(jamo_to_dict) for jamo_from, jamo_to_dict in swap_costs_bat.items()}
+    batchims = set(costs) | {jamo for jamo_to_dict in costs.values() for jamo in jamo_to_dict}
+    for batchim in batchims:
+        costs.setdefault(batchim, {})[''] = COST_BATCHIM_REMOVE
+    return costs
+
+
+class TypoIndex:
+    """
+    Index of known words for typo lookup, instead of generating all typos of a text and keeping the known ones.
+    Each word (and each of its forms without lengthening) is stored under max_masks + 1 keys, one per block of its jamo slots.
+    A lookup generates the structural variants of the text (batchim shifts, lengthening), probes the block keys of each variant
+    and verifies the found words with the swap costs of the typo generator.
+    Only words differing from a variant in at most max_masks slots are found.
+    """
+
+    def __init__(self, words, max_masks = 3, max_removals = 2, forms = None, max_steps = 5, source = None):
+        self.words = list(words)
+        self.max_masks = max_masks
+        self.max_removals = max_removals
+        # words_signature of the word list the index was built from
+        self.source = source
+
+        self.max_steps = max_steps
+        self.closures = [
+            swap_closure(swap_costs_con, max_steps),
+            swap_closure(swap_costs_vov, max_steps),
+            swap_closure(batchim_swap_costs(), max_steps),
+        ]
+        # cheapest (cost, swaps) of each jamo pair, regardless of the number of swaps
+        self.cheapest = [
+            {
+                pair: min((cost, steps) for steps, cost in enumerate(costs, 1))
+                for pair, costs in closure.items()
+            }
+            for closure in self.closures
+        ]
+
+        # (word id, slots, depth, cost) of all indexed forms
+        if forms is None:
+            forms = []
+            for word_id, word in enumerate(self.words):
+                syllables, _suffix = split_syllables(word)
+                for form, (depth, cost) in self.word_forms(syllables).items():
+                    forms.append((word_id, to_slots(form), depth, cost))
+        self.forms = forms
+
+        self.keys = {}
+        for form_id, (_word_id, slots, _depth, _cost) in enumerate(self.forms):
+            for key in block_keys(slots, max_masks):
+                self.keys.setdefault(key, []).append(form_id)
+
+    def swap(self, slot, jamo_from, jamo_to):
+        """
+        Cheapest (cost, swaps) of turning a jamo into another, slot 0: consonant, 1: vowel, 2: batchim.
+        """
+        if jamo_from == jamo_to:
+            return 0.0, 0
+        return self.cheapest[slot].get((jamo_from, jamo_to), (math.inf, 0))
+
+    def word_forms(self, syllables):
+        """
+        All forms of a word with up to max_removals lengthening syllables removed, {syllables: (depth, cost)}.
+        The lengthening syllable may have been swapped after it was added, these words differ from the lengthened text
+        in too many slots to be found by the block keys.
+        """
+        forms = {syllables: (0, 0.0)}
+        frontier = [syllables]
+
+        for _removal in range(self.max_removals):
+            next_frontier = []
+            for current in frontier:
+                for i in range(1, len(current)):
+                    (_, v1, b1), (c2, v2, b2) = current[i-1], current[i]
+                    if b1 or b2:
+                        continue
+                    con_cost, con_steps = self.swap(0, 'ㅇ', c2)
+                    vov_cost, vov_steps = self.swap(1, v1, v2)
+                    depth, cost = forms[current]
+                    depth += 1 + con_steps + vov_steps
+                    cost += COST_LENGTHEN + con_cost + vov_cost
+                    if math.isinf(cost):
+                        continue
+                    form = current[:i] + current[i+1:]
+                    if form not in forms or forms[form][1] > cost:
+                        forms[form] = (depth, cost)
+                        next_frontier.append(form)
+            frontier = next_frontier
+
+        return forms
+
+    def structural_variants(self, syllables, max_depth, max_cost):
+        """
+        All syllables reachable with batchim shifts and lengthening (the operations that change the syllable structure),
+        including the swaps that are needed before such an operation can be applied.
+        Returns {syllables: {depth: cost}}, the cheapest cost for each number of operations.
+        """
+        levels = [{} for _depth in range(max_depth + 1)]
+        levels[0][syllables] = 0.0
+
+        for depth in range(max_depth):
+            for current, current_cost in levels[depth].items():
+
+                def add_variant(variant, steps, cost):
+                    variant_depth = depth + steps
+                    variant_cost = current_cost + cost
+                    if variant_depth > max_depth or variant_cost > max_cost:
+                        return
+                    if variant not in levels[variant_depth] or levels[variant_depth][variant] > variant_cost:
+                        levels[variant_depth][variant] = variant_cost
+
+                num_s = len(current)
+                for i, s in enumerate(current):
+                    s_next = current[i+1] if i < num_s-1 else None
+
+                    if s_next:
+                        (c1, v1, b1), (c2, v2, b2) = s, s_next
+
+                        for s_pair in batchim_shift(s, s_next):
+                            add_variant(current[:i] + s_pair + current[i + 2:], 1, COST_BATCHIM_SHIFT)
+
+                        # shift after swapping the next consonant to ㅇ
+                        con_cost, con_steps = self.swap(0, c2, 'ㅇ')
+                        if b1 and con_steps:
+                            for s_pair in batchim_shift(s, ('ㅇ', v2, b2)):
+                                add_variant(current[:i] + s_pair + current[i + 2:], con_steps + 1, con_cost + COST_BATCHIM_SHIFT)
+
+                        # recombine batchim after swapping the batchim or the next consonant
+                        if b1 and c2:
+                            for combined, (split_b, split_c) in batchim_split.items():
+                                bat_cost, bat_steps = self.swap(2, b1, split_b)
+                                con_cost, con_steps = self.swap(0, c2, split_c)
+                                if not bat_steps and not con_steps:
+                                    # handled by batchim_shift
+                                    continue
+                                add_variant(
+                                    current[:i] + ((c1, v1, combined), ('ㅇ', v2, b2)) + current[i + 2:],
+                                    bat_steps + con_steps + 1,
+                                    bat_cost + con_cost + COST_BATCHIM_SHIFT,
+                                )
+
+                        # remove the lengthening after swapping the next consonant to ㅇ or the vowel to the next vowel
+                        if lengthening_remove(s, s_next):
+                            add_variant(current[:i] + current[i+1:], 1, COST_LENGTHEN)
+                        else:
+                            con_cost, con_steps = self.swap(0, c2, 'ㅇ')
+                            vov_cost, vov_steps = self.swap(1, v1, v2)
+                            add_variant(
+                                current[:i] + (('ㅇ', v2, b2),) + current[i+2:],
+                                con_steps + vov_steps + 1,
+                                con_cost + vov_cost + COST_LENGTHEN,
+                            )
+
+                    s_lengthening = lengthening_add(s)
+                    if s_lengthening:
+                        add_variant(current[:i] + (s, s_lengthening) + current[i+1:], 1, COST_LENGTHEN)
+                        # lengthen and remove the syllable again, which leaves only the lengthening syllable
+                        if s_lengthening != s:
+                            add_variant(current[:i] + (s_lengthening,) + current[i+1:], 2, 2 * COST_LENGTHEN)
+
+        variants = {}
+        for depth, level in enumerate(levels):
+            for variant, cost in level.items():
+                variants.setdefault(variant, {})[depth] = cost
+        return variants
+
+    @staticmethod
+    def indexable(word):
+        syllables, suffix = split_syllables(word)
+        return syllables and not suffix
+
+    @classmethod
+    def build(cls, words, max_masks = 3, max_removals = 2):
+        words = list(words)
+        return cls([word for word in words if cls.indexable(word)], max_masks, max_removals, source=words_signature(words))
+
+    def save(self, path):
+        """
+        Writes the words and their forms, the block keys are rebuilt when loading.
+        """
+        # written to a temporary file first, a process loading the index never sees a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'max_masks': self.max_masks,
+                'max_removals': self.max_removals,
+                'source': self.source,
+                'words': self.words,
+                # word id, slots (a missing batchim is an empty slot), depth and cost of each form
+                'forms': [[word_id, '|'.join(slots), depth, cost] for word_id, slots, depth, cost in self.forms],
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f'Unsupported typo index version {data.get("version")} in {path}, rebuild the index')
+        forms = [(word_id, tuple(slots.split('|')), depth, cost) for word_id, slots, depth, cost in data['forms']]
+        return cls(data['words'], data['max_masks'], data['max_removals'], forms, source=data['source'])
+
+    def swap_costs(self, slots_from, slots_to, max_steps, require_swap = False):
+        """
+        Cheapest cost of swapping slots_from into slots_to for each number of swaps, {swaps: cost}.
+        """
+        best = {0: 0.0}
+        for i, (jamo_from, jamo_to) in enumerate(zip(slots_from, slots_to)):
+            if jamo_from == jamo_to:
+                continue
+            costs = self.closures[i % 3].get((jamo_from, jamo_to))
+            if not costs:
+                return {}
+            next_best = {}
+            for steps, cost in best.items():
+                for swaps, swap_cost in enumerate(costs[:max_steps - steps], 1):
+                    total = cost + swap_cost
+                    if total < next_best.get(steps + swaps, math.inf):
+                        next_best[steps + swaps] = total
+            best = next_best
+            if not best:
+                return {}
+
+        if require_swap and 0 in best:
+            # identical slots, swap a jamo away and back
+            del best[0]
+            for i, jamo in enumerate(slots_from):
+                for steps, cost in enumerate(self.closures[i % 3].get((jamo, jamo), [])[:max_steps], 1):
+                    if cost < best.get(steps, math.inf):
+                        best[steps] = cost
+
+        return best
+
+    def lookup(self, syllables, max_depth = 4, max_cost = 4.0):
+        """
+        Known words reachable from the syllables with typo operations, {word: cost}, like typo() filtered by the known words.
+        """
+        candidates = {}
+
+        for variant, depth_costs in self.structural_variants(syllables, max_depth, max_cost).items():
+            variant_slots = to_slots(variant)
+
+            form_ids = set()
+            for key in block_keys(variant_slots, self.max_masks):
+                form_ids.update(self.keys.get(key, ()))
+
+            for form_id in form_ids:
+                word_id, form_slots, form_depth, form_cost = self.forms[form_id]
+                if count_differences(variant_slots, form_slots) > self.max_masks:
+                    continue
+                word = self.words[word_id]
+                for depth, cost in depth_costs.items():
+                    depth += form_depth
+                    cost += form_cost
+                    if depth > max_depth:
+                        continue
+                    swap_costs = self.swap_costs(
+                        variant_slots,
+                        form_slots,
+                        min(max_depth - depth, self.max_steps),
+                        # the text itself is only a candidate if it can be reached by operations
+                        require_swap=(depth == 0),
+                    )
+                    if not swap_costs:
+                        continue
+                    total = cost + min(swap_costs.values())
+                    if total <= max_cost and total < candidates.get(word, math.inf):
+                        candidates[word] = total
+
+        return candidates
+
+
+def typo_index(
+    input,
+    output,
+    max_masks,
+    max_removals,
+    **_kwargs,
+):
+    """
+    Build the typo index of the known words in clean.txt of the correction data directory.
+    """
+    clean_path = os.path.join(input, 'clean.txt')
+    output = output or os.path.join(input, INDEX_FILE_NAME)
+
+    print(f'Reading words from {clean_path}...')
+    with open(clean_path, 'r', encoding='utf-8') as f:
+        words = [line.split()[0] for line in f if line.strip()]
+
+    print(f'Building index of words differing in up to {max_masks} slots...')
+    index = TypoIndex.build(words, max_masks, max_removals)
+    logging.info(f'{len(index.words)} of {len(words)} words indexed under {len(index.keys)} keys')
+
+    print(f'Writing index to {output}...')
+    index.save(output)
@@ -0,0 +1,334 @@
+import math
+import heapq
+import functools
+import itertools
+from .typo import (
+    COST_BATCHIM_SHIFT,
+    COST_LENGTHEN,
+    swap_costs_con,
+    swap_costs_vov,
+    batchim_split,
+    batchim_shift,
+    split_syllables,
+)
+from .typo_index import swap_closure, batchim_swap_costs
+from ..jamo import compose_syllable
+
+
+@functools.lru_cache(maxsize=None)
+def swap_paths(max_steps):
+    """
+    Swaps of each slot (0: consonant, 1: vowel, 2: batchim, an empty batchim is ''), [{from: {to: ((swaps, cost), ...)}}]
+    with the cheapest cost for each number of swaps that is cheaper than with fewer swaps.
+    Turning a jamo into itself needs at least one swap away and back, these cycles are stored under the jamo itself.
+    """
+    paths = []
+    for swap_costs in (swap_costs_con, swap_costs_vov, batchim_swap_costs()):
+        slot_paths = {}
+        for (jamo_from, jamo_to), costs in swap_closure(swap_costs, max_steps).items():
+            path = []
+            for steps, cost in enumerate(costs, 1):
+                if cost < (path[-1][1] if path else math.inf):
+                    path.append((steps, cost))
+            slot_paths.setdefault(jamo_from, {})[jamo_to] = tuple(path)
+        paths.append(slot_paths)
+    return paths
+
+def swap_options(slot, jamo, max_steps):
+    """
+    Jamo the jamo can be swapped into with at most max_steps swaps, {to: ((swaps, cost), ...)}, including the jamo itself without swaps.
+    """
+    options = {jamo: ((0, 0.0),)}
+    if max_steps <= 0:
+        return options
+    for jamo_to, path in swap_paths(max_steps)[slot].get(jamo, {}).items():
+        if jamo_to != jamo:
+            options[jamo_to] = path
+    return options
+
+def pareto(costs):
+    """
+    Only the entries of {depth: cost} that are cheaper than all entries with a lower depth.
+    Depth 0 (no operations) is kept apart, the text itself is not a candidate without operations.
+    """
+    if len(costs) < 2:
+        return costs
+    r = {}
+    cheapest = math.inf
+    for depth in sorted(costs):
+        if depth == 0:
+            r[depth] = costs[depth]
+        elif costs[depth] < cheapest:
+            r[depth] = cheapest = costs[depth]
+    return r
+
+def join_groups(groups, i):
+    """
+    Groups after an operation on the syllables i and i + 1, all syllables of both spans belong to the joined span.
+    """
+    group = (groups[i][0], groups[i+1][1])
+    return tuple(group if other in (groups[i], groups[i+1]) else other for other in groups)
+
+def add_costs(costs, other, max_depth, max_cost):
+    """
+    Cheapest cost {depth: cost} of two independent sequences of operations {depth: cost} done together.
+    """
+    r = {}
+    for depth, cost in costs.items():
+        for other_depth, other_cost in other.items():
+            total_depth = depth + other_depth
+            total = cost + other_cost
+            if total_depth <= max_depth and total <= max_cost and total < r.get(total_depth, math.inf):
+                r[total_depth] = total
+    return pareto(r)
+
+def merge_costs(costs, other):
+    for depth, cost in other.items():
+        if cost < costs.get(depth, math.inf):
+            costs[depth] = cost
+    return pareto(costs)
+
+
+def structural_operations(syllables, groups, max_steps):
+    """
+    Operations that change the syllable structure: lengthening a syllable, removing a syllable the next syllable lengthens
+    and the batchim shifts, each with the swaps before it that make it possible or change what it moves or copies.
+    groups: span of the original syllables each syllable was made from, operations on two syllables join their spans
+    Yields (syllables, groups, swaps + 1, cost).
+    """
+    if max_steps < 1:
+        return
+    num_s = len(syllables)
+    for i, (c1, v1, b1) in enumerate(syllables):
+        # lengthening copies the vowel, the batchim has to be removed first
+        for b_to, b_path in swap_options(2, b1, max_steps - 1).items():
+            if b_to:
+                continue
+            for b_steps, b_cost in b_path:
+                for v_to, v_path in swap_options(1, v1, max_steps - 1 - b_steps).items():
+                    for v_steps, v_cost in v_path:
+                        yield (
+                            syllables[:i] + ((c1, v_to, ''), ('ㅇ', v_to, '')) + syllables[i+1:],
+                            groups[:i] + (groups[i], groups[i]) + groups[i+1:],
+                            b_steps + v_steps + 1,
+                            b_cost + v_cost + COST_LENGTHEN,
+                        )
+
+        if i == num_s - 1:
+            continue
+        c2, v2, b2 = syllables[i+1]
+        joined = join_groups(groups, i)
+
+        # remove the syllable if the next syllable lengthens it, which needs ㅇ and the same vowel
+        consonants = swap_options(0, c2, max_steps - 1)
+        if 'ㅇ' in consonants:
+            vowels_1 = swap_options(1, v1, max_steps - 1)
+            vowels_2 = swap_options(1, v2, max_steps - 1)
+            for v_to in vowels_1.keys() & vowels_2.keys():
+                for (c_steps, c_cost), (v1_steps, v1_cost), (v2_steps, v2_cost) in itertools.product(consonants['ㅇ'], vowels_1[v_to], vowels_2[v_to]):
+                    steps = c_steps + v1_steps + v2_steps + 1
+                    if steps <= max_steps:
+                        yield (
+                            syllables[:i] + (('ㅇ', v_to, b2),) + syllables[i+2:],
+                            joined[:i] + joined[i+1:],
+                            steps,
+                            c_cost + v1_cost + v2_cost + COST_LENGTHEN,
+                        )
+
+        # batchim shifts, only the batchim and the next consonant decide which shifts apply and are moved
+        batchims = swap_options(2, b1, max_steps - 1)
+        pairs = set()
+        if 'ㅇ' in consonants:
+            pairs.update((b, 'ㅇ') for b in batchims if b)
+        pairs.update((b, c) for b, c in batchim_split.values() if b in batchims and c in consonants)
+        if '' in batchims:
+            pairs.update(('', c) for c in consonants)
+        for b_to, c_to in pairs:
+            shifted = batchim_shift((c1, v1, b_to or None), (c_to, v2, b2 or None))
+            for (b_steps, b_cost), (c_steps, c_cost) in itertools.product(batchims[b_to], consonants[c_to]):
+                steps = b_steps + c_steps + 1
+                if steps > max_steps:
+                    continue
+                for (sc1, sv1, sb1), (sc2, sv2, sb2) in shifted:
+                    yield (
+                        syllables[:i] + ((sc1, sv1, sb1 or ''), (sc2, sv2, sb2 or '')) + syllables[i+2:],
+                        joined,
+                        steps,
+                        b_cost + c_cost + COST_BATCHIM_SHIFT,
+                    )
+
+def structural_images(syllables, max_depth, max_cost):
+    """
+    Syllables the structural operations turn the syllables into, {syllables: {depth: cost}}, the other swaps are left to the caller.
+    Only images whose operations join all the syllables are returned (a single syllable also without operations),
+    so that the images of neighbouring windows combine into all sequences of operations on the text.
+    """
+    num_s = len(syllables)
+    # levels[depth]: {(syllables, groups): cost}
+    levels = [{} for _depth in range(max_depth + 1)]
+    levels[0][(syllables, tuple((i, i) for i in range(num_s)))] = 0.0
+    images = {}
+
+    for depth, level in enumerate(levels):
+        for (current, groups), cost in level.items():
+            # reached more cheaply with fewer operations, the syllables without operations are not an image of the text itself
+            if any(levels[lower].get((current, groups), math.inf) <= cost for lower in range(1, depth)):
+                continue
+            if all(group == (0, num_s - 1) for group in groups):
+                image = images.setdefault(current, {})
+                image[depth] = min(cost, image.get(depth, math.inf))
+            # each operation joins at most two spans
+            if len(set(groups)) - 1 > max_depth - depth:
+                continue
+            for next_syllables, next_groups, steps, operation_cost in structural_operations(current, groups, max_depth - depth):
+                next_cost = cost + operation_cost
+                if next_cost > max_cost:
+                    continue
+                next_level = levels[depth + steps]
+                key = (next_syllables, next_groups)
+                if next_cost < next_level.get(key, math.inf):
+                    next_level[key] = next_cost
+
+    return {image: pareto(costs) for image, costs in images.items()}
+
+
+class TrieNode:
+    __slots__ = ('children', 'word', 'syllable')
+
+    def __init__(self, syllable = None):
+        self.children = {}
+        self.word = None
+        self.syllable = syllable
+
+
+class DictionaryTrie:
+    """
+    Trie of known words over their syllables (jamo triples, an empty batchim is '').
+    """
+
+    def __init__(self, words):
+        self.root = TrieNode()
+        self.size = 0
+        for word in words:
+            syllables, suffix = split_syllables(word)
+            # typo candidates are composed syllables, words with single vowels or other characters are never one
+            if not syllables or suffix or ''.join(compose_syllable(*syllable) for syllable in syllables) != word:
+                continue
+            node = self.root
+            for syllable in syllables:
+                syllable = tuple(jamo or '' for jamo in syllable)
+                if syllable not in node.children:
+                    node.children[syllable] = TrieNode(syllable)
+                node = node.children[syllable]
+            node.word = word
+            self.size += 1
+
+
+def swapped_children(node, syllable, max_steps, max_cost):
+    """
+    Children of a node the syllable can be swapped into, [(child, {swaps: cost})].
+    """
+    options = [swap_options(slot, jamo, max_steps) for slot, jamo in enumerate(syllable)]
+    r = []
+
+    def add(child, paths):
+        costs = {}
+        for (steps_0, cost_0), (steps_1, cost_1), (steps_2, cost_2) in itertools.product(*paths):
+            steps = steps_0 + steps_1 + steps_2
+            cost = cost_0 + cost_1 + cost_2
+            if steps <= max_steps and cost <= max_cost and cost < costs.get(steps, math.inf):
+                costs[steps] = cost
+        if costs:
+            r.append((child, pareto(costs)))
+
+    if len(node.children) < len(options[0]) * len(options[1]) * len(options[2]):
+        for child_syllable, child in node.children.items():
+            paths = [options[slot].get(child_syllable[slot]) for slot in range(3)]
+            if all(paths):
+                add(child, paths)
+    else:
+        for child_syllable in itertools.product(*options):
+            child = node.children.get(child_syllable)
+            if child:
+                add(child, [options[slot][child_syllable[slot]] for slot in range(3)])
+
+    return r
+
+def cycle_costs(syllables, max_steps):
+    """
+    Cheapest cost {swaps: cost} of swapping a jamo of the syllables away and back.
+    """
+    costs = {}
+    paths = swap_paths(max_steps)
+    for syllable in syllables:
+        for slot, jamo in enumerate(syllable):
+            costs = merge_costs(costs, dict(paths[slot].get(jamo, {}).get(jamo, ())))
+    return costs
+
+def search(trie, syllables, max_depth = 4, max_cost = 4.0, n_best = None):
+    """
+    Known words reachable from the syllables with typo operations, {word: cost} in cost order, with the costs of typo() filtered by the known words.
+    The operations of any sequence split the text into windows of syllables that are changed together: the structural operations
+    of each window are expanded by structural_images and their images are matched against the trie with the remaining swaps.
+    The search is best-first: partial matches are expanded cheapest first, so words are found in cost order.
+    n_best: stop after the cheapest words
+    """
+    syllables = tuple((c, v, b or '') for c, v, b in syllables)
+    num_s = len(syllables)
+    windows = {}
+    tie_breaker = itertools.count()
+
+    # (cost, 0, tie breaker, swaps, position, image, node): the window before the position is matched up to the rest of its image
+    # (cost, 1, word): a found word, after the partial matches of the same cost so that words of the same cost are in order
+    heap = [(0.0, 0, next(tie_breaker), 0, 0, (), trie.root)]
+
+    # the text itself is only a candidate if operations lead back to it
+    node = trie.root
+    for syllable in syllables:
+        node = node.children.get(syllable)
+        if node is None:
+            break
+    if node is not None and node.word is not None:
+        cycles = add_costs({0: 0.0}, cycle_costs(syllables, max_depth), max_depth, max_cost)
+        if cycles:
+            heap.append((min(cycles.values()), 1, node.word))
+    heapq.heapify(heap)
+
+    # fewest swaps each partial match was expanded with, those with more swaps and a higher cost are not expanded again
+    expanded = {}
+    candidates = {}
+    while heap and (n_best is None or len(candidates) < n_best):
+        entry = heapq.heappop(heap)
+        cost = entry[0]
+        if entry[1] == 1:
+            candidates.setdefault(entry[2], cost)
+            continue
+
+        _cost, _kind, _tie, depth, position, image, node = entry
+        # partial matches without operations are kept apart, they only lead to the text itself
+        if depth:
+            key = (position, image, id(node))
+            if expanded.get(key, math.inf) <= depth:
+                continue
+            expanded[key] = depth
+
+        if image:
+            for child, swap_costs in swapped_children(node, image[0], max_depth - depth, max_cost - cost):
+                for steps, swap_cost in swap_costs.items():
+                    heapq.heappush(heap, (cost + swap_cost, 0, next(tie_breaker), depth + steps, position, image[1:], child))
+            continue
+
+        if position == num_s:
+            if node.word is not None and depth and node.word not in candidates:
+                heapq.heappush(heap, (cost, 1, node.word))
+            continue
+
+        for end in range(position + 1, min(position + 1 + max_depth, num_s) + 1):
+            if (position, end) not in windows:
+                windows[(position, end)] = structural_images(syllables[position:end], max_depth, max_cost)
+            for window_image, image_costs in windows[(position, end)].items():
+                for steps, image_cost in image_costs.items():
+                    if depth + steps <= max_depth and cost + image_cost <= max_cost:
+                        heapq.heappush(heap, (cost + image_cost, 0, next(tie_breaker), depth + steps, end, window_image, node))
+
+    return candidates
@@ -1,17 +1,27 @@
 from transformers import pipeline, AutoTokenizer
 import dataclasses
 import unicodedata
-import os
 import numpy as np
 import logging
 from .lemmatize import Lemmatizer
-
-@dataclasses.dataclass
-class UserDictEntry:
-    morph: str
-    suffix_wildcard: bool
-    pos: str
-    pos_match: set[str] | None
+from .batching import DEFAULT_MAX_BATCH_TOKENS, run_pipeline_batched
+from .cache import LRUCache, DEFAULT_CACHE_SIZE
+from .result_cache import ResultCache, config_fingerprint, DEFAULT_MAX_ENTRIES
+from .document import split_document, context_span, stitch_tokens, DEFAULT_WINDOW_CHARS, DEFAULT_CONTEXT_CHARS
+from .offsets import normalize_with_map, normalized_position, max_normalized_length
+from .user_dict import (
+    UserDictEntry,
+    UserDictMatcher,
+    decode_with_user_dict,
+    load_user_dict,
+    load_user_dict_file,
+    load_user_dict_dir,
+    load_user_dict_matcher,
+    is_user_dict_artifact,
+    user_dict_hash,
+    source_signature,
+)
+from .pipeline import classify_with_probabilities, pipeline_labels, pipeline_max_length
 
 @dataclasses.dataclass
 class Token:
@@ -30,23 +40,12 @@ class Token:
         return repr(self)
 
 
-def normalize_with_map(text, normalize_mode):
-    convert_map = {}
-    text_norm = ''
-
-    for text_idx, text_char in enumerate(text):
-        convert_map[len(text_norm)] = text_idx
-        text_norm += unicodedata.normalize(normalize_mode, text_char)
-    convert_map[len(text_norm)] = len(text)
-    
-    last_idx = 0
-    for i in range(len(text_norm) + 1):
-        if i in convert_map:
-            last_idx = convert_map[i]
-        else:
-            convert_map[i] = last_idx
-
-    return text_norm, convert_map
+@dataclasses.dataclass
+class AnalysisResult:
+    # the text after spacing and spelling correction, offsets of tokens and corrections refer to it
+    text: str
+    tokens: list[Token]
+    corrections: list[dict]
 
 
 def apply_splits_single(token: Token):
@@ -109,11 +108,13 @@ def analyze(
     classification_pipeline,
     text,
     normalize_mode=None,
-    lemmatizer=None
+    lemmatizer=None,
+    raw_tokens=None,
 ):
     text_norm, convert_map = normalize_with_map(text, normalize_mode or 'NFC')
 
-    raw_tokens = classification_pipeline(text_norm)
+    if raw_tokens is None:
+        raw_tokens = classification_pipeline(text_norm)
 
     i = 0
     tokens = []
@@ -160,6 +161,27 @@ def analyze(
     return tokens
 
 
+def analyze_many(
+    classification_pipeline,
+    texts,
+    normalize_mode=None,
+    lemmatizer=None,
+    max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+):
+    """
+    Analyze many texts, the classification is done in batches.
+    """
+    texts_norm = [
+        normalize_with_map(text, normalize_mode or 'NFC')[0]
+        for text in texts
+    ]
+    all_raw_tokens = run_pipeline_batched(classification_pipeline, texts_norm, max_batch_tokens)
+    return [
+        analyze(classification_pipeline, text, normalize_mode, lemmatizer, raw_tokens=raw_tokens)
+        for text, raw_tokens in zip(texts, all_raw_tokens)
+    ]
+
+
 # TODO: Support normalize mode, then merge with analyze
 def analyze_with_user_dict(
     classification_pipeline,
@@ -167,68 +189,34 @@ def analyze_with_user_dict(
     normalize_mode=None,
     user_dict=[],
     lemmatizer=None,
-    _ignore_user_dict_entries=[]
+    _ignore_user_dict_entries=[],
+    tokens_pre_masked=None,
+    user_dict_matcher=None,
 ):
 
     mask_token = classification_pipeline.tokenizer.mask_token
 
-    tokens_pre_masked = classification_pipeline(text)
+    if tokens_pre_masked is None:
+        tokens_pre_masked = classification_pipeline(text)
     
     logging.debug('pre-masked')
     for token in tokens_pre_masked:
         logging.debug(token)
 
-    pre_mask_char = '\x1A'
-    pre_masks = []
-    text_pre_masked = text
+    if user_dict_matcher is None:
+        user_dict_matcher = UserDictMatcher(user_dict)
 
     # mask text that appears in the user dictionary
-    for entry_idx, entry in enumerate(user_dict):
-        search_idx = 0
-        while True:
-            idx = text_pre_masked.find(entry.morph, search_idx)
-            if idx == -1:
-                break
-
-            pre_mask_start = idx
-            pre_mask_end = idx + len(entry.morph)
-
-            if entry.suffix_wildcard:
-                for token in tokens_pre_masked:
-                    if token['start'] <= pre_mask_start and pre_mask_end <= token['end']:
-                        pre_mask_end = max(token['end'], pre_mask_end)
-
-            '''
-            # These are now handled post-masking, pos tags for user dict entries are not predicted properly in many cases
-            if entry.pos_match:
-                found_pos = False
-                for token in tokens_pre_masked:
-                    pos = token['entity'].split('-')[-1]
-                    if pre_mask_start <= token['start'] and token['end'] <= pre_mask_end and pos in entry.pos:
-                        found_pos = True
-                        break
-                if not found_pos:
-                    search_idx = pre_mask_end
-                    continue
-            '''
-
-            replace_len = pre_mask_end - pre_mask_start
-
-            search_idx = pre_mask_end + 1
-
-            new_entry = (pre_mask_start, pre_mask_end, entry_idx)
-            if new_entry in _ignore_user_dict_entries:
-                continue
+    pre_masks_ftb = user_dict_matcher.match(text, tokens_pre_masked, _ignore_user_dict_entries)
 
-            text_pre_masked = text_pre_masked[:pre_mask_start] + pre_mask_char * replace_len + text_pre_masked[pre_mask_end:]
-            pre_masks.append(new_entry)
-
-    pre_masks_ftb = sorted(pre_masks, key=lambda x: x[0])
-    pre_masks_btf = sorted(pre_masks, key=lambda x: x[0], reverse=True)
-
-    text_masked = text_pre_masked
-    for pre_mask_start, pre_mask_end, entry_idx in pre_masks_btf:
-        text_masked = text_masked[:pre_mask_start] + mask_token + text_masked[pre_mask_end:]
+    text_masked_parts = []
+    last_end = 0
+    for pre_mask_start, pre_mask_end, _entry_idx in pre_masks_ftb:
+        text_masked_parts.append(text[last_end:pre_mask_start])
+        text_masked_parts.append(mask_token)
+        last_end = pre_mask_end
+    text_masked_parts.append(text[last_end:])
+    text_masked = ''.join(text_masked_parts)
 
     tokens = classification_pipeline(text_masked)
     logging.debug('masked')
@@ -272,7 +260,16 @@ def analyze_with_user_dict(
 
     if ignore_user_dict_entries:
         # retry, with the ignored entries
-        return analyze_with_user_dict(classification_pipeline, text, normalize_mode, user_dict, ignore_user_dict_entries)
+        return analyze_with_user_dict(
+            classification_pipeline,
+            text,
+            normalize_mode,
+            user_dict,
+            lemmatizer,
+            _ignore_user_dict_entries=_ignore_user_dict_entries + ignore_user_dict_entries,
+            tokens_pre_masked=tokens_pre_masked,
+            user_dict_matcher=user_dict_matcher,
+        )
 
     logging.debug('fixed')
     for token in tokens:
@@ -313,22 +310,54 @@ def analyze_with_user_dict(
 
         i = end_i + 1
     
-    if not _ignore_user_dict_entries:
-        # prevent morphemes across spaces
-        tokens_out = apply_splits(tokens_out)
+    # prevent morphemes across spaces
+    tokens_out = apply_splits(tokens_out)
 
-        # lemmatize verbs
-        if lemmatizer:
-            tokens_out = apply_lemmatization(tokens_out, lemmatizer)
+    # lemmatize verbs
+    if lemmatizer:
+        tokens_out = apply_lemmatization(tokens_out, lemmatizer)
 
     return tokens_out
 
 
+def analyze_with_user_dict_constrained(
+    classification_pipeline,
+    text,
+    normalize_mode=None,
+    user_dict=[],
+    lemmatizer=None,
+    user_dict_matcher=None,
+    user_dict_weight=None,
+    raw_tokens=None,
+):
+    """
+    Analyze with a user dictionary from a single classification pass of the text:
+    the entries found in the text constrain the decoding of the label probabilities instead of being masked.
+    user_dict_weight: None for hard constraints, otherwise the bonus of the constrained labels to their log probability
+    """
+    if user_dict_matcher is None:
+        user_dict_matcher = UserDictMatcher(user_dict)
+
+    text_norm, _ = normalize_with_map(text, normalize_mode or 'NFC')
+    if raw_tokens is None:
+        raw_tokens = classify_with_probabilities(classification_pipeline, [text_norm])[0]
+
+    labels = pipeline_labels(classification_pipeline)
+    raw_tokens = decode_with_user_dict(text_norm, raw_tokens, labels, user_dict, user_dict_matcher, user_dict_weight)
+
+    return analyze(classification_pipeline, text, normalize_mode, lemmatizer, raw_tokens=raw_tokens)
+
+
 def create_pipeline(
     model,
     classification_model,
     cache,
+    backend = 'torch',
 ):
+    if backend != 'torch':
+        from .onnx_backend import create_onnx_pipeline
+        return create_onnx_pipeline(model, classification_model, cache, backend)
+
     tokenizer = AutoTokenizer.from_pretrained(model, cache_dir=cache)
 
     return pipeline(
@@ -340,74 +369,40 @@ def create_pipeline(
 
 
 def inference(
-    model,
-    classification_model,
-    cache,
     format,
-    normalize_mode = None,
-    user_dict = None,
-    lemma_data = None,
-    no_lemma = False,
-    error_model = None,
-    error_classification_model = None,
-    spacing_model = None,
-    spacing_classification_model = None,
+    input_path = None,
+    output = '-',
+    input_format = None,
+    text_field = 'text',
+    batch_size = None,
+    document = False,
     **kwargs,
 ):
-    if isinstance(user_dict, str):
-        user_dict = load_user_dict(user_dict)
-    elif user_dict is None:
-        user_dict = []
-    elif not isinstance(user_dict, list):
-        raise ValueError(f'Invalid user dictionary: {user_dict}')
-    
-    lemmatizer = None
-    if not no_lemma or lemma_data:
-        lemmatizer = Lemmatizer(lemma_data)
-
-    spacing_corrector = None
-    if spacing_model and spacing_classification_model:
-        from .spacing.inference import correct as correct_spacing, create_pipeline as create_spacing_pipeline
-        spacing_pipeline = create_spacing_pipeline(
-            spacing_model,
-            spacing_classification_model,
-            cache,
+    analyzer = Analyzer(**kwargs)
+
+    if input_path:
+        # non-interactive: analyze a whole file or stdin and write JSONL
+        from .stream import stream, DEFAULT_STREAM_BATCH_SIZE
+        stream(
+            analyzer,
+            input_path,
+            output,
+            input_format=input_format,
+            text_field=text_field,
+            batch_size=batch_size or DEFAULT_STREAM_BATCH_SIZE,
+            document=document,
         )
-        spacing_corrector = lambda text: correct_spacing(spacing_pipeline, text)
-
-    error_corretor = None
-    if error_model and error_classification_model:
-        from .error.inference import create_error_corrector
-        error_corretor = create_error_corrector(error_model, error_classification_model, cache)
-
-    classification_pipeline = create_pipeline(
-        model,
-        classification_model,
-        cache,
-    )
-
-    if user_dict:
-        analyze_func = lambda text: analyze_with_user_dict(classification_pipeline, text, normalize_mode, user_dict, lemmatizer)
-    else:
-        analyze_func = lambda text: analyze(classification_pipeline, text, normalize_mode, lemmatizer)
+        return
 
     while True:
         try:
             text = input('> ')
 
-            if spacing_corrector:
-                text = spacing_corrector(text)
-
-            if error_corretor:
-                text, _corrections = error_corretor(text)
-
-            if normalize_mode:
-                text = unicodedata.normalize(normalize_mode, text)
             if format == 'pretty':
-                tokens = analyze_func(text)
+                tokens = analyzer.run(text)
                 print(' '.join(map(str, tokens)))
             elif format == 'raw':
-                tokens_raw = classification_pipeline(text)
+                tokens_raw = analyzer.run(text, format='raw')
                 for token in tokens_raw:
                     print(token)
         except KeyboardInterrupt:
@@ -416,11 +411,26 @@ def inference(
             break
 
 
+def cache_value(result: AnalysisResult):
+    """
+    JSON serializable analysis result of a text for the result cache: the corrected text, the tokens and the applied spelling corrections.
+    """
+    return {
+        'text': result.text,
+        'tokens': [[token.surface, token.lemma, token.tag, token.start, token.end] for token in result.tokens],
+        'corrections': [dict(correction) for correction in result.corrections],
+    }
+
+def result_from_cache(value):
+    tokens = [Token(surface, lemma, tag, start, end) for surface, lemma, tag, start, end in value['tokens']]
+    return AnalysisResult(value['text'], tokens, [dict(correction) for correction in value['corrections']])
+
+
 class Analyzer:
     def __init__(
         self,
         model: str,
-        classification_model: str,
+        classification_model: str | None = None,
         cache: str | None = None,
         normalize_mode: list[UserDictEntry] | str | None = None,
         user_dict: str | None = None,
@@ -430,72 +440,339 @@ class Analyzer:
         error_classification_model: str | None = None,
         spacing_model: str | None = None,
         spacing_classification_model: str | None = None,
+        multitask_model: str | None = None,
+        no_error_correction: bool = False,
+        no_spacing_correction: bool = False,
+        spacing_decoder: str = 'search',
+        error_candidate_top_k: int | None = None,
+        error_candidate_mass: float | None = None,
+        error_typo_engine: str = 'search',
+        error_typo_cache: str | None = None,
+        max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+        user_dict_mode: str = 'mask',
+        user_dict_weight: float | None = None,
+        user_dict_cache_size: int = 16,
+        result_cache: str | bool | None = None,
+        result_cache_size: int = DEFAULT_CACHE_SIZE,
+        result_cache_max_entries: int = DEFAULT_MAX_ENTRIES,
+        backend: str = 'torch',
+        quantize: list[str] | None = None,
         **kwargs,
     ):
         """
         model: str -- The tokenizer model to use, either a name on Hugging Face or a path to a local model
-        classification_model: str -- The classification model to use, generated from the train command
+        classification_model: str | None -- The classification model to use, generated from the train command. Not needed when using a multi-task model.
         cache: str | None -- The cache directory to use for the tokenizer
         normalize_mode: str | None -- The unicode normalization mode to use for the input text
-        user_dict: list[UserDictEntry] | str | None -- The user dictionary to use for the analyzer, either a list of UserDictEntry objects, a path to a file, or a path to a directory
+        user_dict: list[UserDictEntry] | str | None -- The user dictionary to use for the analyzer, either a list of UserDictEntry objects, a path to a file, a path to a directory, or a path to an artifact compiled with `python -m kotok user_dict`
         lemma_data: str | None -- Path to the lemmatization data directory
         no_lemma: bool -- Whether to force disable lemmatization
         error_model: str | None -- The tokenizer model to use for the error corrector, either a name on Hugging Face or a path to a local model
         error_classification_model: str | None -- The classification model to use for the error corrector, generated from the train command
         spacing_model: str | None -- The tokenizer model to use for the spacing corrector, either a name on Hugging Face or a path to a local model
         spacing_classification_model: str | None -- The classification model to use for the spacing corrector, generated from the train command
+        multitask_model: str | None -- The multi-task model to use for POS-tagging, error and spacing correction, generated from the multitask train command. Replaces the three classification models, all tasks are then classified in a single forward pass.
+        no_error_correction: bool -- Whether to disable error correction when using the multi-task model
+        no_spacing_correction: bool -- Whether to disable spacing correction when using the multi-task model
+        spacing_decoder: str -- The spacing correction decoder, either 'search' (try all insert positions of each flagged token) or 'global' (fix missing and extra spaces of the whole text from a fixed number of passes)
+        error_candidate_top_k: int | None -- Only rescore the best k spelling correction candidates of each span, ranked by word frequency and typo cost
+        error_candidate_mass: float | None -- Only rescore the best spelling correction candidates of each span covering this share (0 to 1) of the normalized ranking scores
+        error_typo_engine: str -- The spelling correction candidate generator, either 'search' (generate all typos of a span), 'index' (look up known words in the typo index) or 'trie' (search typos along a trie of the known words)
+        error_typo_cache: str | None -- Path to a sqlite file that keeps the spelling correction candidates across runs and processes, pre-warmed with `python -m kotok.error typo_cache`
+        max_batch_tokens: int -- The token budget of a single batch in run_many, counted as padded length * batch size
+        user_dict_mode: str -- How user dictionary entries are applied, either 'mask' (classify the text again with the entries masked) or 'constrained' (decode the labels of a single classification pass with the entries as constraints)
+        user_dict_weight: float | None -- Only for the 'constrained' mode, None to force the labels of the entries, otherwise the bonus added to the log probability of their labels
+        user_dict_cache_size: int -- The number of compiled user dictionaries passed to run and run_many that are kept in memory
+        result_cache: str | bool | None -- Cache the analysis results by input text, True for an in-memory cache, or the path to a sqlite file that keeps them across runs and processes
+        result_cache_size: int -- The number of analysis results kept in memory when result_cache is set
+        result_cache_max_entries: int -- The number of analysis results kept in the sqlite file, the oldest written results are deleted first
+        backend: str -- How the classification models are run, either 'torch' or 'onnx' (onnxruntime on the CPU, the models have to be exported with `python -m kotok onnx` first)
+        quantize: list[str] | None -- The stages ('pos', 'error', 'spacing') that run their int8 model, quantized with `python -m kotok quantize`. Needs the onnx backend.
         """
 
         self.normalize_mode = normalize_mode
 
+        # compiled once, matching is linear in the length of the text
+        self.user_dict_path = None
+        self.user_dict_signature = None
         if isinstance(user_dict, str):
-            self.user_dict = load_user_dict(user_dict)
+            self.user_dict_path = user_dict
+            self.user_dict_signature = source_signature(user_dict)
+            self.user_dict_matcher = load_user_dict_matcher(user_dict)
         elif user_dict is None:
-            self.user_dict = []
-        elif not isinstance(user_dict, list):
+            self.user_dict_matcher = UserDictMatcher([])
+        elif isinstance(user_dict, list):
+            self.user_dict_matcher = UserDictMatcher(user_dict)
+        else:
             raise ValueError(f'Invalid user dictionary: {user_dict}')
+        self.user_dict = self.user_dict_matcher.user_dict
+        # per request dictionaries: names, content hash -> compiled dictionary, (path, signature) -> content hash
+        self.user_dict_names = {}
+        self.user_dict_cache = LRUCache(user_dict_cache_size)
+        self.user_dict_path_hashes = LRUCache(user_dict_cache_size)
         
         self.lemmatizer = None
         if not no_lemma or lemma_data:
             self.lemmatizer = Lemmatizer(lemma_data)
 
-        self.spacing_corrector = None
-        if spacing_model and spacing_classification_model:
-            from .spacing.inference import correct as correct_spacing, create_pipeline as create_spacing_pipeline
+        self.max_batch_tokens = max_batch_tokens
+
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f'Invalid backend: {backend}')
+        quantize = list(quantize or [])
+        if quantize and backend != 'onnx':
+            raise ValueError('Quantized models can only be run with the onnx backend')
+        for stage in quantize:
+            if stage not in ('pos', 'error', 'spacing'):
+                raise ValueError(f'Invalid stage to quantize: {stage}')
+        stage_backends = {stage: 'onnx-int8' if stage in quantize else backend for stage in ('pos', 'error', 'spacing')}
+
+        multitask_pipelines = None
+        if multitask_model:
+            if backend != 'torch':
+                raise ValueError('The multi-task model can only be run with the torch backend')
+            from .multitask.inference import create_pipelines as create_multitask_pipelines
+            multitask_pipelines = create_multitask_pipelines(model, multitask_model, cache)
+
+        spacing_pipeline = None
+        if multitask_pipelines:
+            if not no_spacing_correction:
+                spacing_pipeline = multitask_pipelines['spacing']
+        elif spacing_model and spacing_classification_model:
+            from .spacing.inference import create_pipeline as create_spacing_pipeline
             spacing_pipeline = create_spacing_pipeline(
                 spacing_model,
                 spacing_classification_model,
                 cache,
+                stage_backends['spacing'],
             )
-            self.spacing_corrector = lambda text: correct_spacing(spacing_pipeline, text)
 
-        self.error_corretor = None
-        if error_model and error_classification_model:
-            from .error.inference import create_error_corrector
-            self.error_corretor = create_error_corrector(error_model, error_classification_model, cache)
-
-        self.classification_pipeline = create_pipeline(
-            model,
-            classification_model,
-            cache,
-        )
+        self.spacing_corrector = None
+        self.spacing_corrector_many = None
+        if spacing_pipeline and spacing_decoder == 'global':
+            from .spacing.inference import correct_global_many as correct_spacing_global_many
+            self.spacing_corrector = lambda text: correct_spacing_global_many(spacing_pipeline, [text], max_batch_tokens=self.max_batch_tokens)[0]
+            self.spacing_corrector_many = lambda texts: correct_spacing_global_many(spacing_pipeline, texts, max_batch_tokens=self.max_batch_tokens)
+        elif spacing_pipeline:
+            from .spacing.inference import correct as correct_spacing, correct_many as correct_spacing_many
+            self.spacing_corrector = lambda text: correct_spacing(spacing_pipeline, text, max_batch_tokens=self.max_batch_tokens)
+            self.spacing_corrector_many = lambda texts: correct_spacing_many(spacing_pipeline, texts, max_batch_tokens=self.max_batch_tokens)
+
+        error_pipeline = None
+        if multitask_pipelines:
+            if not no_error_correction:
+                error_pipeline = multitask_pipelines['error']
+        elif error_model and error_classification_model:
+            from .error.inference import create_pipeline as create_error_pipeline
+            error_pipeline = create_error_pipeline(
+                error_model,
+                error_classification_model,
+                cache,
+                stage_backends['error'],
+            )
 
-        if self.user_dict:
-            self.analyze_func = lambda text: analyze_with_user_dict(self.classification_pipeline, text, self.normalize_mode, self.user_dict, self.lemmatizer)
+        self.error_corretor = None
+        self.error_corretor_many = None
+        self.error_typo_engine = error_typo_engine
+        if error_pipeline:
+            from .error.inference import correct as correct_error, correct_many as correct_error_many, get_typo_corrector
+            if error_typo_cache:
+                get_typo_corrector().open_cache(error_typo_cache, error_typo_engine)
+            error_kwargs = {
+                'candidate_top_k': error_candidate_top_k,
+                'candidate_mass': error_candidate_mass,
+                'typo_engine': error_typo_engine,
+            }
+            self.error_corretor = lambda text: correct_error(error_pipeline, text, max_batch_tokens=self.max_batch_tokens, **error_kwargs)
+            self.error_corretor_many = lambda texts: correct_error_many(error_pipeline, texts, max_batch_tokens=self.max_batch_tokens, **error_kwargs)
+
+        if multitask_pipelines:
+            self.classification_pipeline = multitask_pipelines['pos']
         else:
-            self.analyze_func = lambda text: analyze(self.classification_pipeline, text, self.normalize_mode, self.lemmatizer)
+            self.classification_pipeline = create_pipeline(
+                model,
+                classification_model,
+                cache,
+                stage_backends['pos'],
+            )
+
+        if user_dict_mode not in ('mask', 'constrained'):
+            raise ValueError(f'Invalid user dictionary mode: {user_dict_mode}')
+        self.user_dict_mode = user_dict_mode
+        self.user_dict_weight = user_dict_weight
+
+        self.analyze_func = self._analyze
+        self.analyze_many_func = self._analyze_many
+
+        self.result_cache = None
+        if result_cache:
+            self.result_cache = ResultCache(
+                result_cache if isinstance(result_cache, str) else None,
+                size=result_cache_size,
+                max_entries=result_cache_max_entries,
+            )
+        # everything the results depend on besides the text and the user dictionary, models are identified by their paths
+        self.result_cache_fingerprint = config_fingerprint({
+            'model': model,
+            'classification_model': classification_model,
+            'multitask_model': multitask_model,
+            'backend': stage_backends,
+            'error_model': [error_model, error_classification_model] if error_pipeline else None,
+            'error_options': [error_candidate_top_k, error_candidate_mass, error_typo_engine] if error_pipeline else None,
+            'spacing_model': [spacing_model, spacing_classification_model, spacing_decoder] if spacing_pipeline else None,
+            'normalize_mode': normalize_mode,
+            'lemma_data': lemma_data if self.lemmatizer else None,
+            'user_dict_mode': [user_dict_mode, user_dict_weight],
+        })
+
+    def _analyze(self, text, matcher=None):
+        # the matcher is read once, reload_user_dict may replace it at any time
+        matcher = matcher or self.user_dict_matcher
+        if not len(matcher.user_dict):
+            return analyze(self.classification_pipeline, text, self.normalize_mode, self.lemmatizer)
+        if self.user_dict_mode == 'constrained':
+            return analyze_with_user_dict_constrained(self.classification_pipeline, text, self.normalize_mode, matcher.user_dict, self.lemmatizer, matcher, self.user_dict_weight)
+        return analyze_with_user_dict(self.classification_pipeline, text, self.normalize_mode, matcher.user_dict, self.lemmatizer, user_dict_matcher=matcher)
+
+    def _analyze_many(self, texts, matcher=None):
+        matcher = matcher or self.user_dict_matcher
+        if not len(matcher.user_dict):
+            return analyze_many(self.classification_pipeline, texts, self.normalize_mode, self.lemmatizer, self.max_batch_tokens)
+
+        if self.user_dict_mode == 'constrained':
+            texts_norm = [normalize_with_map(text, self.normalize_mode or 'NFC')[0] for text in texts]
+            all_raw_tokens = classify_with_probabilities(self.classification_pipeline, texts_norm, self.max_batch_tokens)
+            return [
+                analyze_with_user_dict_constrained(self.classification_pipeline, text, self.normalize_mode, matcher.user_dict, self.lemmatizer, matcher, self.user_dict_weight, raw_tokens=raw_tokens)
+                for text, raw_tokens in zip(texts, all_raw_tokens)
+            ]
+
+        # Only the pre-masked pass can be shared, the masked pass depends on the user dictionary matches of each text
+        all_tokens_pre_masked = run_pipeline_batched(self.classification_pipeline, texts, self.max_batch_tokens)
+        return [
+            analyze_with_user_dict(self.classification_pipeline, text, self.normalize_mode, matcher.user_dict, self.lemmatizer, tokens_pre_masked=tokens_pre_masked, user_dict_matcher=matcher)
+            for text, tokens_pre_masked in zip(texts, all_tokens_pre_masked)
+        ]
+
+    def register_user_dict(self, name: str, user_dict):
+        """
+        Register a user dictionary under a name, which can then be passed to run and run_many.
+        name: str -- The name of the dictionary, e.g. of a tenant
+        user_dict: UserDictMatcher | list[UserDictEntry] | str -- The dictionary, a list is compiled now, a path is loaded when it is used
+        """
+        if isinstance(user_dict, list):
+            user_dict = self.compiled_user_dict(user_dict)
+        elif not isinstance(user_dict, (str, UserDictMatcher)):
+            raise ValueError(f'Invalid user dictionary: {user_dict}')
+        self.user_dict_names[name] = user_dict
+
+    def compiled_user_dict(self, user_dict: list[UserDictEntry], content_hash: str | None = None) -> UserDictMatcher:
+        """
+        Matcher of a list of entries, compiled dictionaries are kept in a bounded cache by the hash of their content.
+        """
+        content_hash = content_hash or user_dict_hash(user_dict)
+        matcher = self.user_dict_cache.get(content_hash)
+        if matcher is None:
+            matcher = UserDictMatcher(user_dict, content_hash=content_hash)
+            self.user_dict_cache.put(content_hash, matcher)
+        return matcher
+
+    def resolve_user_dict(self, user_dict) -> UserDictMatcher:
+        """
+        Matcher of a user dictionary given for a single request:
+        None for the dictionary of the analyzer, a name registered with register_user_dict, a compiled UserDictMatcher,
+        a list of UserDictEntry objects or a path to a user dictionary file, directory or compiled artifact.
+        Dictionaries from paths and lists are kept in a bounded cache (user_dict_cache_size) by the hash of their content,
+        a path is loaded again when its files change.
+        """
+        if user_dict is None:
+            return self.user_dict_matcher
+        if isinstance(user_dict, str):
+            user_dict = self.user_dict_names.get(user_dict, user_dict)
+        if isinstance(user_dict, UserDictMatcher):
+            return user_dict
+        if isinstance(user_dict, list):
+            return self.compiled_user_dict(user_dict)
+        if not isinstance(user_dict, str):
+            raise ValueError(f'Invalid user dictionary: {user_dict}')
+
+        path_key = (user_dict, tuple(source_signature(user_dict)))
+        content_hash = self.user_dict_path_hashes.get(path_key)
+        matcher = self.user_dict_cache.get(content_hash) if content_hash is not None else None
+        if matcher is None:
+            if is_user_dict_artifact(user_dict):
+                matcher = UserDictMatcher.load(user_dict)
+                self.user_dict_cache.put(matcher.hash, matcher)
+            else:
+                matcher = self.compiled_user_dict(load_user_dict(user_dict))
+            self.user_dict_path_hashes.put(path_key, matcher.hash)
+        return matcher
+
+    def result_cache_key(self, text, matcher):
+        return self.result_cache.key(f'{self.result_cache_fingerprint}:{matcher.hash}', text)
+
+    def cache_stats(self):
+        """
+        Hits, misses, evictions and the hit rate of the result cache, None if it is disabled.
+        """
+        if self.result_cache is None:
+            return None
+        return self.result_cache.stats()
+
+    def reload_user_dict(self, path: str | None = None) -> bool:
+        """
+        Replace the user dictionary without reloading the models, if its files changed (size or modification time) and their content differs.
+        The new dictionary is loaded completely before it replaces the old one, texts analyzed meanwhile use the old one.
+        path: str | None -- A user dictionary file, directory or compiled artifact, defaults to the path the analyzer was created with
+        Returns whether the dictionary was replaced.
+        """
+        path = path or self.user_dict_path
+        if path is None:
+            raise ValueError('No user dictionary path to reload from')
+
+        signature = source_signature(path)
+        if path == self.user_dict_path and signature == self.user_dict_signature:
+            return False
 
-    def run(self, text: str, format='pretty') -> list[Token]:
+        if is_user_dict_artifact(path):
+            matcher = UserDictMatcher.load(path)
+        else:
+            user_dict = load_user_dict(path)
+            content_hash = user_dict_hash(user_dict)
+            # only compiled if the content changed
+            matcher = UserDictMatcher(user_dict, content_hash=content_hash) if content_hash != self.user_dict_matcher.hash else self.user_dict_matcher
+        self.user_dict_path = path
+        self.user_dict_signature = signature
+        if matcher.hash == self.user_dict_matcher.hash:
+            return False
+
+        self.user_dict_matcher = matcher
+        self.user_dict = matcher.user_dict
+        logging.info(f'Reloaded user dictionary from {path}: {len(matcher.user_dict)} entries')
+        return True
+
+    def run(self, text: str, format='pretty', user_dict=None) -> list[Token]:
         """
         text: str -- The input text to analyze
-        format: str -- The output format, either 'pretty' or 'raw'. 'pretty' will return a list of Token objects, 'raw' will return the raw output from the model.
+        format: str -- The output format, either 'pretty', 'full' or 'raw'. 'pretty' will return a list of Token objects, 'full' an AnalysisResult with the corrected text, the tokens and the applied spelling corrections, 'raw' will return the raw output from the model.
+        user_dict: UserDictMatcher | list[UserDictEntry] | str | None -- The user dictionary for this text instead of the one of the analyzer, see resolve_user_dict
         """
+        matcher = self.resolve_user_dict(user_dict)
+
+        cache_key = None
+        if self.result_cache is not None and format != 'raw':
+            cache_key = self.result_cache_key(text, matcher)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                result = result_from_cache(cached)
+                return result if format == 'full' else result.tokens
 
         if self.spacing_corrector:
             text = self.spacing_corrector(text)
 
+        corrections = []
         if self.error_corretor:
-            text, _corrections = self.error_corretor(text)
+            text, corrections = self.error_corretor(text)
 
         if self.normalize_mode:
             text = unicodedata.normalize(self.normalize_mode, text)
@@ -503,78 +780,140 @@ class Analyzer:
         if format == 'raw':
             return self.classification_pipeline(text)
 
-        return self.analyze_func(text)        
+        result = AnalysisResult(text, self.analyze_func(text, matcher), corrections)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, cache_value(result))
+        return result if format == 'full' else result.tokens
+
+    def run_document(self, text: str, user_dict=None, window: int | None = None, context: int = DEFAULT_CONTEXT_CHARS) -> AnalysisResult:
+        """
+        Analyze a document of any length. It is split into chunks of whole sentences of up to window characters (longer sentences are cut between words),
+        all chunks are corrected and classified in batches like in run_many. Each chunk is classified with up to context characters of the text around it,
+        which only keep the tokens of the chunk. Returns the corrected document with the tokens and the applied spelling corrections at their positions in it.
+        text: str -- The document to analyze
+        user_dict: UserDictMatcher | list[UserDictEntry] | str | None -- The user dictionary for this document, see run
+        window: int | None -- The maximum number of characters of a chunk, by default 256 or less if the chunk and its context would not fit in the input length of the models
+        context: int -- The number of characters before and after a chunk the POS-tagging model sees
+        """
+        matcher = self.resolve_user_dict(user_dict)
+
+        if window is None:
+            # a normalized character is at most one token, the special tokens take 2 and spacing correction inserts spaces
+            max_length = pipeline_max_length(self.classification_pipeline) - 2
+            # chunks are cut from the text before normalizing, a character may be normalized to several (e.g. decomposed by NFD)
+            expansion = max_normalized_length(text, self.normalize_mode) if self.normalize_mode else 1
+            window = max(min(DEFAULT_WINDOW_CHARS, (max_length * 2 // 3 - 2 * context) // expansion), 1)
+
+        spans = split_document(text, window)
+        chunks = [text[start:end] for start, end in spans]
+
+        if chunks and self.spacing_corrector_many:
+            chunks = self.spacing_corrector_many(chunks)
+
+        all_corrections = [[] for _ in chunks]
+        if chunks and self.error_corretor_many:
+            chunks, all_corrections = zip(*self.error_corretor_many(chunks))
+
+        # the corrected chunks with the original whitespace between them
+        parts = []
+        corrected_spans = []
+        corrections = []
+        position = 0
+        previous_end = 0
+        for (start, end), chunk, chunk_corrections in zip(spans, chunks, all_corrections):
+            gap = text[previous_end:start]
+            if self.normalize_mode:
+                gap = unicodedata.normalize(self.normalize_mode, gap)
+                # corrections refer to the chunk before normalizing
+                chunk_corrections = [
+                    dict(
+                        correction,
+                        start=normalized_position(chunk, correction['start'], self.normalize_mode),
+                        end=normalized_position(chunk, correction['end'], self.normalize_mode),
+                    )
+                    for correction in chunk_corrections
+                ]
+                chunk = unicodedata.normalize(self.normalize_mode, chunk)
+            position += len(gap)
+            corrected_spans.append((position, position + len(chunk)))
+            corrections.extend(
+                dict(correction, start=correction['start'] + position, end=correction['end'] + position)
+                for correction in chunk_corrections
+            )
+            parts.append(gap)
+            parts.append(chunk)
+            position += len(chunk)
+            previous_end = end
+        rest = text[previous_end:]
+        parts.append(unicodedata.normalize(self.normalize_mode, rest) if self.normalize_mode else rest)
+        document = ''.join(parts)
 
+        windows = [context_span(document, start, end, context) for start, end in corrected_spans]
+        all_tokens = self.analyze_many_func([document[start:end] for start, end in windows], matcher) if windows else []
 
-#
-# User dictionary loading
-#
+        return AnalysisResult(document, stitch_tokens(all_tokens, windows, corrected_spans), corrections)
 
-def load_user_dict_file(file_path: str, _no_sort: bool=False):
-    '''
-    file_path: str -- 
-    '''
+    def run_many(self, texts: list[str], format='pretty', user_dict=None) -> list[list[Token]]:
+        """
+        Analyze many texts at once. Texts are sorted by length and classified in batches within the token budget (max_batch_tokens),
+        identical texts are only processed once. Results are returned in input order, token offsets refer to the corrected text like in run.
+        texts: list[str] -- The input texts to analyze
+        format: str -- The output format, see run
+        user_dict: UserDictMatcher | list[UserDictEntry] | str | None -- The user dictionary for these texts, see run
+        """
+        matcher = self.resolve_user_dict(user_dict)
 
-    user_dict = []
+        results_by_text = {}
+        cache_keys = None
+        if self.result_cache is not None and format != 'raw':
+            cache_keys = {text: self.result_cache_key(text, matcher) for text in dict.fromkeys(texts)}
+            for text, cache_key in cache_keys.items():
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    results_by_text[text] = result_from_cache(cached)
 
-    with open(file_path, 'r', encoding='utf-8') as file:
-        for line_idx, line in enumerate(file):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
+        # only texts that are not cached are analyzed
+        input_texts = [text for text in dict.fromkeys(texts) if text not in results_by_text]
+        unique_texts = input_texts
 
-            line = line.replace('\t', ' ')
-            space_idx = line.rfind(' ')
-            if space_idx == -1:
-                raise ValueError(f'Invalid user dictionary entry at {file_path}:{line_idx + 1}')
-            
-            suffix_wildcard = False
-            pos_match = None
-            morph = line[:space_idx].strip()
-            pos_raw = line[space_idx + 1:].strip()
-
-            if morph.endswith('*'):
-                morph = morph[:-1].strip()
-                suffix_wildcard = True
-
-            exclamation_idx = pos_raw.rfind('!')
-            if exclamation_idx != -1:
-                pos = pos_raw[:exclamation_idx].strip()
-                pos_parts = pos_raw[exclamation_idx + 1:].split(',')
-                if pos_parts:
-                    pos_match = set(pos_parts)
+        if unique_texts and self.spacing_corrector_many:
+            unique_texts = self.spacing_corrector_many(unique_texts)
+
+        all_corrections = [[] for _ in unique_texts]
+        if unique_texts and self.error_corretor_many:
+            unique_texts, all_corrections = zip(*self.error_corretor_many(unique_texts))
+            unique_texts = list(unique_texts)
+
+        if self.normalize_mode:
+            unique_texts = [unicodedata.normalize(self.normalize_mode, text) for text in unique_texts]
+
+        if not unique_texts:
+            unique_results = []
+        elif format == 'raw':
+            unique_results = run_pipeline_batched(self.classification_pipeline, unique_texts, self.max_batch_tokens)
+        else:
+            unique_results = [
+                AnalysisResult(text, tokens, corrections)
+                for text, tokens, corrections in zip(unique_texts, self.analyze_many_func(unique_texts, matcher), all_corrections)
+            ]
+
+        results_by_text.update(zip(input_texts, unique_results))
+        if cache_keys is not None:
+            self.result_cache.put_many([
+                (cache_keys[input_text], cache_value(result))
+                for input_text, result in zip(input_texts, unique_results)
+            ])
+
+        results = []
+        seen = set()
+        for text in texts:
+            result = results_by_text[text]
+            if text in seen:
+                # Duplicates get their own copies of the tokens
+                if format == 'raw':
+                    result = [dict(token) for token in result]
                 else:
-                    pos_match = set([pos])
-            else:
-                pos = pos_raw
-
-            user_dict.append(UserDictEntry(
-                morph = morph,
-                suffix_wildcard = suffix_wildcard,
-                pos = pos,
-                pos_match = pos_match,
-            ))
-
-    if not _no_sort:
-        user_dict.sort(key=lambda x: len(x.morph), reverse=True)
-
-    return user_dict
-
-def load_user_dict_dir(dir_path: str, _no_sort: bool=True) -> list[UserDictEntry]:
-    user_dict = []
-    for root, _, files in os.walk(dir_path):
-        for file in files:
-            if os.path.splitext(file)[1] in ('.tsv'):
-                file_path = os.path.join(root, file)
-                user_dict.extend(load_user_dict_file(file_path, _no_sort=True))
-    if not _no_sort:
-        user_dict = dict(sorted(user_dict.items(), key=lambda x: len(x[0]), reverse=True))
-    return user_dict
-
-def load_user_dict(path: str) -> list[UserDictEntry]:
-    if os.path.isfile(path):
-        return load_user_dict_file(path)
-    elif os.path.isdir(path):
-        return load_user_dict_dir(path)
-    else:
-        raise ValueError(f'Invalid user dictionary: {path}')
+                    result = AnalysisResult(result.text, [dataclasses.replace(token) for token in result.tokens], [dict(correction) for correction in result.corrections])
+            seen.add(text)
+            results.append(result if format in ('raw', 'full') else result.tokens)
+        return results
@@ -0,0 +1,140 @@
+# Conversion between hangul syllables and compatibility jamo, with tables computed over the syllable block U+AC00-U+D7A3
+BASE_OF_SYLLABLES = 0xAC00
+
+LEADING_CONSONANTS = ['ㄱ', 'ㄲ', 'ㄴ', 'ㄷ', 'ㄸ', 'ㄹ', 'ㅁ', 'ㅂ', 'ㅃ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅉ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
+VOWELS = ['ㅏ', 'ㅐ', 'ㅑ', 'ㅒ', 'ㅓ', 'ㅔ', 'ㅕ', 'ㅖ', 'ㅗ', 'ㅘ', 'ㅙ', 'ㅚ', 'ㅛ', 'ㅜ', 'ㅝ', 'ㅞ', 'ㅟ', 'ㅠ', 'ㅡ', 'ㅢ', 'ㅣ']
+# an empty batchim is None
+TRAILING_CONSONANTS = [None, 'ㄱ', 'ㄲ', 'ㄳ', 'ㄴ', 'ㄵ', 'ㄶ', 'ㄷ', 'ㄹ', 'ㄺ', 'ㄻ', 'ㄼ', 'ㄽ', 'ㄾ', 'ㄿ', 'ㅀ', 'ㅁ', 'ㅂ', 'ㅄ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
+
+NUMBER_OF_SYLLABLES = len(LEADING_CONSONANTS) * len(VOWELS) * len(TRAILING_CONSONANTS)
+
+LEADING_INDEX = {jamo: i for i, jamo in enumerate(LEADING_CONSONANTS)}
+VOWEL_INDEX = {jamo: i for i, jamo in enumerate(VOWELS)}
+TRAILING_INDEX = {jamo: i for i, jamo in enumerate(TRAILING_CONSONANTS)}
+
+VOWEL_SPLIT = {
+    'ㅘ': 'ㅗㅏ',
+    'ㅙ': 'ㅗㅐ',
+    'ㅚ': 'ㅗㅣ',
+    'ㅝ': 'ㅜㅓ',
+    'ㅞ': 'ㅜㅔ',
+    'ㅟ': 'ㅜㅣ',
+    'ㅢ': 'ㅡㅣ',
+}
+VOWEL_MERGE = {v: k for k, v in VOWEL_SPLIT.items()}
+
+# (leading consonant, vowel, trailing consonant) of each syllable, in code point order
+SYLLABLES = [
+    (leading, vowel, trailing)
+    for leading in LEADING_CONSONANTS
+    for vowel in VOWELS
+    for trailing in TRAILING_CONSONANTS
+]
+
+# str.translate tables from syllables to jamo, with and without splitting the compound vowels
+DECOMPOSE_TABLE = {
+    BASE_OF_SYLLABLES + i: leading + vowel + (trailing or '')
+    for i, (leading, vowel, trailing) in enumerate(SYLLABLES)
+}
+DECOMPOSE_SPLIT_TABLE = {
+    BASE_OF_SYLLABLES + i: leading + VOWEL_SPLIT.get(vowel, vowel) + (trailing or '')
+    for i, (leading, vowel, trailing) in enumerate(SYLLABLES)
+}
+DECOMPOSE_SPLIT_TABLE.update({ord(k): v for k, v in VOWEL_SPLIT.items()})
+
+
+def is_syllable(char):
+    return 0 <= ord(char) - BASE_OF_SYLLABLES < NUMBER_OF_SYLLABLES
+
+def decompose_syllable(char):
+    """
+    Jamo of a syllable (leading consonant, vowel, trailing consonant or None), raises ValueError for other characters.
+    """
+    i = ord(char) - BASE_OF_SYLLABLES
+    if not 0 <= i < NUMBER_OF_SYLLABLES:
+        raise ValueError(f'{char!r} is not a hangul syllable')
+    return SYLLABLES[i]
+
+def compose_syllable(leading, vowel, trailing = None):
+    """
+    Syllable of the jamo, raises ValueError if they do not form a syllable.
+    """
+    try:
+        i = (LEADING_INDEX[leading] * len(VOWELS) + VOWEL_INDEX[vowel]) * len(TRAILING_CONSONANTS) + TRAILING_INDEX[trailing]
+    except KeyError:
+        raise ValueError(f'Invalid jamo: {leading!r} {vowel!r} {trailing!r}') from None
+    return chr(BASE_OF_SYLLABLES + i)
+
+def decompose(text, split_vowels = True):
+    """
+    Text to jamo, other characters are kept. Compound vowels are split (ㅘ to ㅗㅏ) if split_vowels is set.
+    """
+    return text.translate(DECOMPOSE_SPLIT_TABLE if split_vowels else DECOMPOSE_TABLE)
+
+def decompose_batch(texts, split_vowels = True):
+    """
+    decompose() of each of the texts.
+    """
+    table = DECOMPOSE_SPLIT_TABLE if split_vowels else DECOMPOSE_TABLE
+    return [text.translate(table) for text in texts]
+
+def decompose_with_offsets(text, split_vowels = True):
+    """
+    decompose() and the index of the character of the text each jamo comes from.
+    """
+    table = DECOMPOSE_SPLIT_TABLE if split_vowels else DECOMPOSE_TABLE
+    parts = []
+    offsets = []
+    for i, char in enumerate(text):
+        part = table.get(ord(char), char)
+        parts.append(part)
+        offsets.extend([i] * len(part))
+    return ''.join(parts), offsets
+
+def merge_vowels(text):
+    """
+    Merge split compound vowels (ㅗㅏ to ㅘ).
+    """
+    if not any(char in VOWEL_INDEX for char in text):
+        return text
+    r = []
+    i = 0
+    while i < len(text):
+        merged = VOWEL_MERGE.get(text[i:i + 2])
+        if merged:
+            r.append(merged)
+            i += 2
+        else:
+            r.append(text[i])
+            i += 1
+    return ''.join(r)
+
+def compose(text, merge = True):
+    """
+    Jamo to text, jamo that do not form a syllable are kept. Split compound vowels are merged first if merge is set.
+    A consonant between two vowels starts the next syllable.
+    """
+    if merge:
+        text = merge_vowels(text)
+
+    r = []
+    i = 0
+    n = len(text)
+    while i < n:
+        leading = LEADING_INDEX.get(text[i])
+        vowel = VOWEL_INDEX.get(text[i + 1]) if leading is not None and i + 1 < n else None
+        if vowel is None:
+            r.append(text[i])
+            i += 1
+            continue
+
+        trailing = 0
+        if i + 2 < n:
+            third = text[i + 2]
+            next_is_syllable = third in LEADING_INDEX and i + 3 < n and text[i + 3] in VOWEL_INDEX
+            if not next_is_syllable and third in TRAILING_INDEX:
+                trailing = TRAILING_INDEX[third]
+
+        r.append(chr(BASE_OF_SYLLABLES + (leading * len(VOWELS) + vowel) * len(TRAILING_CONSONANTS) + trailing))
+        i += 3 if trailing else 2
+    return ''.join(r)
@@ -2,35 +2,10 @@ import os
 import math
 import json
 import logging
-import hangul_jamo
-
-VOVEL_SPLIT = {
-    'ㅘ': 'ㅗㅏ',
-    'ㅙ': 'ㅗㅐ',
-    'ㅚ': 'ㅗㅣ',
-    'ㅝ': 'ㅜㅓ',
-    'ㅞ': 'ㅜㅔ',
-    'ㅟ': 'ㅜㅣ',
-    'ㅢ': 'ㅡㅣ',
-}
-
-def decompose(text):
-    """
-    Regular text to jamo, also split vovels.
-    """
-    r = hangul_jamo.decompose(text)
-    for k, v in VOVEL_SPLIT.items():
-        r = r.replace(k, v)
-    return r
-
-def compose(text):
-    """
-    Jamo to regular text, also merge vovels.
-    """
-    r = hangul_jamo.compose(text)
-    for k, v in VOVEL_SPLIT.items():
-        r = r.replace(v, k)
-    return r
+import dataclasses
+from .cache import LRUCache, DEFAULT_CACHE_SIZE
+from .lexicon import load_word_list
+from .jamo import decompose, compose, decompose_with_offsets
 
 def trace_to_tokens(surface_text, trace):
     """
@@ -42,19 +17,14 @@ def trace_to_tokens(surface_text, trace):
 
     ta_ending = surface_text.endswith('다')
 
-    offset_map = {}
-    accu = 0
-    for i, c in enumerate(surface_text):
-        dc = decompose(c)
-        for ii in range(len(dc)):
-            offset_map[accu + ii] = i
-        accu += len(dc)
+    # index of the surface character of each jamo
+    _, offset_map = decompose_with_offsets(surface_text)
     
     for i, (name, suffix_in, suffix_out, jamo_end_distance) in enumerate(trace):
         is_last = i == len(trace) - 1
 
         jamo_check_pos = jamo_end_distance - len(suffix_out)
-        start_i = len(surface_text) - offset_map[jamo_check_pos] if jamo_check_pos in offset_map else 0
+        start_i = len(surface_text) - offset_map[jamo_check_pos] if 0 <= jamo_check_pos < len(offset_map) else 0
         start_i = max(0, start_i)
         end_i = start_i + math.ceil(len(suffix_in) / 2.4)
         end_i = min(len(surface_text), end_i)
@@ -85,15 +55,11 @@ def trace_to_tokens(surface_text, trace):
 
 
 class Lemmatizer:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, cache_size=DEFAULT_CACHE_SIZE):
         lemmas_path = os.path.join(data_dir, 'lemmas.txt')
         transforms_path = os.path.join(data_dir, 'transforms.json')
 
-        self.lemmas = {}
-        with open(lemmas_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                lemma, freq = line.strip().split()
-                self.lemmas[lemma] = int(freq)
+        self.lemmas, _ = load_word_list(lemmas_path)
 
         with open(transforms_path, 'r', encoding='utf-8') as f:
             transforms = json.load(f)
@@ -103,37 +69,75 @@ class Lemmatizer:
             for transform_rule in transform_rules:
                 self.rules.append((name, transform_rule))
 
+        # rules indexed by the length and the jamo of their input suffix, a state only visits the rules matching its end
+        self.condition_bits = {}
+        self.rules_by_suffix = {}
+        for rule_idx, (name, (suffix_in, suffix_out, cond_in, cond_out)) in enumerate(self.rules):
+            rule = (rule_idx, name, suffix_in, suffix_out, self.condition_mask(cond_in), self.condition_mask(cond_out), cond_out)
+            self.rules_by_suffix.setdefault(len(suffix_in), {}).setdefault(suffix_in, []).append(rule)
+        self.suffix_lengths = sorted(self.rules_by_suffix)
+
+        self.cache = LRUCache(cache_size)
+
+    def condition_mask(self, conditions):
+        """
+        Bit mask of condition names, each condition gets its own bit.
+        """
+        mask = 0
+        for condition in conditions:
+            if condition not in self.condition_bits:
+                self.condition_bits[condition] = 1 << len(self.condition_bits)
+            mask |= self.condition_bits[condition]
+        return mask
+
+    def matching_rules(self, text):
+        """
+        Rules whose input suffix is a suffix of the text, in the order of the transforms file.
+        """
+        rules = []
+        for length in self.suffix_lengths:
+            if length > len(text):
+                break
+            rules.extend(self.rules_by_suffix[length].get(text[len(text) - length:], ()))
+        rules.sort(key=lambda rule: rule[0])
+        return rules
+
     def transform_jamo(self, source_text, max_depth=5):
         """
         Returns a list of all possible lemmatizations of the given text in jamo form.
         """
-        results = [(source_text, set(), [], 0)]
+        results = [(source_text, set(), [], 0, 0)]
+        # states already in results, a state reached again through another order of rules is not expanded again.
+        # The first trace of a state is the shortest one (breadth first)
+        seen = {(source_text, 0)}
 
         i = 0
         while i < len(results):
-            (text, conditions, trace, depth) = results[i]
+            (text, _conditions, trace, depth, condition_mask) = results[i]
             if depth >= max_depth:
                 i += 1
                 continue
             
-            # attempt to apply all rules
-            for name, (suffix_in, suffix_out, cond_in, cond_out) in self.rules:
-                if cond_in and not any(c in conditions for c in cond_in):
-                    continue
-                if not text.endswith(suffix_in):
+            # attempt to apply the rules matching the end of the text
+            for _rule_idx, name, suffix_in, suffix_out, cond_in, cond_out, new_conditions in self.matching_rules(text):
+                if cond_in and not cond_in & condition_mask:
                     continue
                 
                 # exchange the suffix
                 new_text = text[:-len(suffix_in)] + suffix_out
-                new_conditions = cond_out
                 
                 old_jamo_end_distance = 0 if not trace else trace[-1][3]
                 jamo_end_distance = len(suffix_in) - len(suffix_out) + old_jamo_end_distance
                 
+                state = (new_text, cond_out)
+                if state in seen:
+                    continue
+                seen.add(state)
+
                 new_trace = trace + [(name, suffix_in, suffix_out, jamo_end_distance)]
 
                 # add new transformation (will be processed later in the loop again)
-                results.append((new_text, new_conditions, new_trace, depth + 1))
+                results.append((new_text, new_conditions, new_trace, depth + 1, cond_out))
 
             i += 1
 
@@ -159,8 +163,18 @@ class Lemmatizer:
 
     def lemmatize(self, surface_text):
         """
-        Find the best lemmatization of the given text.
+        Find the best lemmatization of the given text, results are cached per text.
         """
+        cached = self.cache.get(surface_text)
+        if cached is None:
+            cached = self.find_lemma(surface_text)
+            self.cache.put(surface_text, cached)
+
+        # callers modify the tokens
+        lemma, tokens = cached
+        return lemma, [dataclasses.replace(token) for token in tokens]
+
+    def find_lemma(self, surface_text):
         transforms = self.transform(surface_text)
         lemmas = []
 
@@ -187,7 +201,7 @@ class Lemmatizer:
             lemma, trace = lemmas[0]
             return lemma, trace_to_tokens(surface_text, trace)
 
-        return text, []
+        return surface_text, []
 
 
 def lemmatize(
@@ -0,0 +1,201 @@
+import os
+import sys
+import zlib
+import mmap
+import array
+import struct
+import logging
+
+LEXICON_MAGIC = b'KLEX'
+LEXICON_VERSION = 2
+LEXICON_EXTENSION = '.lex'
+# magic, version, number of words, number of slots of the hash table, size of the string pool
+HEADER = struct.Struct('<4sIIII')
+# magic and version, the same in all versions
+FILE_TYPE = struct.Struct('<4sI')
+
+
+def read_word_list(path):
+    """
+    Reads a word list with one "word frequency" pair per line, {word: frequency}.
+    """
+    words = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            word, freq = line.strip().split()
+            words[word] = int(freq)
+    return words
+
+
+def lexicon_path(word_list_path):
+    return os.path.splitext(word_list_path)[0] + LEXICON_EXTENSION
+
+
+def hash_slots(num_words):
+    # a power of two with at most half of the slots used
+    slots = 1
+    while slots < 2 * num_words:
+        slots *= 2
+    return slots
+
+
+def write_lexicon(words, path):
+    """
+    Writes {word: frequency} as a lexicon file:
+    header, frequencies (int64), offsets of the words in the string pool (uint32, one more than words),
+    a hash table of the words (uint32 slots holding the position of a word plus one, 0 for an empty slot, found by the crc32
+    of the word with linear probing) and the string pool of the UTF-8 encoded words sorted by their bytes.
+    """
+    encoded = sorted((word.encode('utf-8'), freq) for word, freq in words.items())
+
+    freqs = array.array('q', (freq for _word, freq in encoded))
+    offsets = array.array('I', [0])
+    for word, _freq in encoded:
+        offsets.append(offsets[-1] + len(word))
+
+    num_slots = hash_slots(len(encoded))
+    table = array.array('I', [0]) * num_slots
+    for i, (word, _freq) in enumerate(encoded):
+        slot = zlib.crc32(word) & (num_slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (num_slots - 1)
+        table[slot] = i + 1
+
+    if sys.byteorder != 'little':
+        freqs.byteswap()
+        offsets.byteswap()
+        table.byteswap()
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION, len(encoded), num_slots, offsets[-1]))
+        f.write(freqs.tobytes())
+        f.write(offsets.tobytes())
+        f.write(table.tobytes())
+        for word, _freq in encoded:
+            f.write(word)
+
+
+class Lexicon:
+    """
+    Read-only {word: frequency} mapping over a memory-mapped lexicon file, words are found in its hash table.
+    Opening it does not read the words, and processes opening the same file share its pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = FILE_TYPE.unpack_from(self.mmap, 0) if len(self.mmap) >= FILE_TYPE.size else (None, None)
+        if magic != LEXICON_MAGIC or version != LEXICON_VERSION or len(self.mmap) < HEADER.size:
+            raise ValueError(f'Not a lexicon file of version {LEXICON_VERSION}: {path}, run `python -m kotok lexicon` to rebuild it')
+        _magic, _version, self.size, self.num_slots, pool_size = HEADER.unpack_from(self.mmap, 0)
+
+        freqs_start = HEADER.size
+        offsets_start = freqs_start + 8 * self.size
+        table_start = offsets_start + 4 * (self.size + 1)
+        self.pool_start = table_start + 4 * self.num_slots
+        if len(self.mmap) != self.pool_start + pool_size:
+            raise ValueError(f'Truncated lexicon file: {path}')
+
+        view = memoryview(self.mmap)
+        if sys.byteorder == 'little':
+            self.freqs = view[freqs_start:offsets_start].cast('q')
+            self.offsets = view[offsets_start:table_start].cast('I')
+            self.table = view[table_start:self.pool_start].cast('I')
+        else:
+            self.freqs = array.array('q', view[freqs_start:offsets_start])
+            self.offsets = array.array('I', view[offsets_start:table_start])
+            self.table = array.array('I', view[table_start:self.pool_start])
+            self.freqs.byteswap()
+            self.offsets.byteswap()
+            self.table.byteswap()
+
+    def word_bytes(self, i):
+        return self.mmap[self.pool_start + self.offsets[i]:self.pool_start + self.offsets[i + 1]]
+
+    def find(self, word):
+        """
+        Position of the word in the lexicon, -1 if it is not in the lexicon.
+        """
+        if not isinstance(word, str):
+            return -1
+        key = word.encode('utf-8')
+        mask = self.num_slots - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            i = self.table[slot] - 1
+            if i < 0:
+                return -1
+            if self.word_bytes(i) == key:
+                return i
+            slot = (slot + 1) & mask
+
+    def get(self, word, default = None):
+        i = self.find(word)
+        if i < 0:
+            return default
+        return self.freqs[i]
+
+    def __getitem__(self, word):
+        i = self.find(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.freqs[i]
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.word_bytes(i).decode('utf-8')
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for i in range(self.size):
+            yield self.word_bytes(i).decode('utf-8'), self.freqs[i]
+
+
+def load_word_list(path):
+    """
+    Loads a word list, the compiled lexicon next to it (same name with .lex) is used instead if it is up to date.
+    Returns the mapping and the path of the file it was read from.
+    """
+    compiled_path = lexicon_path(path)
+    if os.path.exists(compiled_path):
+        if not os.path.exists(path) or os.path.getmtime(compiled_path) >= os.path.getmtime(path):
+            try:
+                return Lexicon(compiled_path), compiled_path
+            except ValueError as e:
+                if not os.path.exists(path):
+                    raise
+                logging.warning(f'{e}, reading the word list instead.')
+        else:
+            logging.warning(f'{compiled_path} is older than {path}, reading the word list. Run `python -m kotok lexicon` to rebuild it.')
+    return read_word_list(path), path
+
+
+def lexicon(
+    input,
+    output = None,
+    **_kwargs,
+):
+    """
+    Compile word lists (lemmas.txt, clean.txt) into lexicon files next to them, which are used instead of the word lists.
+    """
+    if output and len(input) > 1:
+        raise ValueError('An output path can only be given for a single input')
+
+    for word_list_path in input:
+        output_path = output or lexicon_path(word_list_path)
+        print(f'Reading words from {word_list_path}...')
+        words = read_word_list(word_list_path)
+        print(f'Writing {len(words)} words to {output_path}...')
+        write_lexicon(words, output_path)
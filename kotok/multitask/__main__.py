@@ -0,0 +1,48 @@
+import os
+import logging
+import argparse
+
+def make_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-v', '--verbose', action='store_true')
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    model_default = 'klue/bert-base'
+    out_model_default = os.path.join('models', 'kotok_multitask_model')
+    cache_default = os.path.join('cache')
+    data_default = os.path.join('data', 'labeled_multitask.json')
+
+    data = subparsers.add_parser('data')
+    data.add_argument('-p', '--pos_data', type=str, default=os.path.join('data', 'labeled.json'))
+    data.add_argument('-s', '--spacing_data', type=str, default=os.path.join('data', 'labeled_spacing.json'))
+    data.add_argument('-e', '--error_data', type=str, default=os.path.join('data', 'labeled_error.json'))
+    data.add_argument('-o', '--output', type=str, default=data_default)
+
+    train = subparsers.add_parser('train')
+    train.add_argument('-m', '--model', type=str, default=model_default)
+    train.add_argument('-c', '--cache', type=str, default=cache_default)
+    train.add_argument('-d', '--data', type=str, default=data_default)
+    train.add_argument('-o','--output', type=str, default=out_model_default)
+    train.add_argument('-l', '--logs', type=str, default='logs')
+
+    return parser
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+
+    args = make_parser().parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.command == 'data':
+        from .data import data
+        data(**args.__dict__)
+    elif args.command == 'train':
+        from .train import train
+        train(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import json
+import random
+from .labels import tasks, ignore_label_id
+
+
+def merge_entries(task, entries):
+    """
+    Convert entries of a single task dataset into multi-task entries, the labels of all other tasks are ignored.
+    """
+    merged = []
+    for entry in entries:
+        merged_entry = {
+            'input_ids': entry['input_ids'],
+            'attention_mask': entry['attention_mask'],
+        }
+        for other_task in tasks:
+            if other_task == task:
+                merged_entry[f'{other_task}_labels'] = entry['labels']
+            else:
+                merged_entry[f'{other_task}_labels'] = [ignore_label_id] * len(entry['labels'])
+        merged.append(merged_entry)
+    return merged
+
+
+def data(
+    pos_data,
+    spacing_data,
+    error_data,
+    output,
+    **_kwargs,
+):
+    """
+    Merge the datasets generated by `python -m kotok data`, `python -m kotok.spacing data` and `python -m kotok.error data`.
+    All datasets must have been generated with the same tokenizer model.
+    """
+    data_paths = {
+        'pos': pos_data,
+        'spacing': spacing_data,
+        'error': error_data,
+    }
+
+    data = {
+        'train': [],
+        'validation': [],
+    }
+
+    for task in tasks:
+        print(f'Reading {task} data from {data_paths[task]}...')
+        with open(data_paths[task], 'r', encoding='utf-8') as f:
+            task_data = json.load(f)
+        for split in data:
+            data[split].extend(merge_entries(task, task_data[split]))
+
+    print('Shuffling data...')
+    for split in data:
+        random.shuffle(data[split])
+
+    print(f'Writing data to {output}...',)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
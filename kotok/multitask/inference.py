@@ -0,0 +1,108 @@
+import collections
+import torch
+from transformers import AutoTokenizer
+from ..batching import DEFAULT_MAX_BATCH_TOKENS, count_tokens, make_batches
+from ..pipeline import encode, model_inputs, decode
+from .labels import tasks
+from .model import BertForMultiTaskTokenClassification
+
+
+class MultiTaskPipeline:
+    """
+    Runs the multi-task model and keeps the results of all tasks for the most recent texts,
+    so that classifying the same text for another task does not need another forward pass.
+    """
+
+    def __init__(self, tokenizer, model, cache_size=1024):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.model.eval()
+        self.id2label = {
+            task: dict(enumerate(self.model.config.task_labels[task]))
+            for task in tasks
+        }
+        self.cache_size = cache_size
+        self.results = collections.OrderedDict()
+
+    def classify(self, texts, batch_size=None):
+        """
+        Returns the entities of all tasks for each text, {task: entities}.
+        """
+        missing = [text for text in dict.fromkeys(texts) if text not in self.results]
+        batch_size = batch_size or 1
+
+        for i in range(0, len(missing), batch_size):
+            batch_texts = missing[i:i + batch_size]
+            encoding = encode(self.tokenizer, batch_texts)
+            with torch.no_grad():
+                outputs = self.model(**{k: torch.from_numpy(v) for k, v in model_inputs(encoding).items()})
+
+            task_entities = {
+                task: decode(self.tokenizer, batch_texts, encoding, outputs[f'{task}_logits'].numpy(), self.id2label[task], with_probs=True)
+                for task in tasks
+            }
+            for batch_idx, text in enumerate(batch_texts):
+                self.results[text] = {task: task_entities[task][batch_idx] for task in tasks}
+                while len(self.results) > self.cache_size:
+                    self.results.popitem(last=False)
+
+        r = []
+        for text in texts:
+            # texts of this call may have been evicted again if the call holds more texts than the cache
+            if text not in self.results:
+                self.classify([text])
+            self.results.move_to_end(text)
+            r.append(self.results[text])
+        return r
+
+
+class TaskPipeline:
+    """
+    Token classification pipeline for a single task of the multi-task model,
+    can be used in place of the transformers pipeline of the single task models.
+    """
+
+    def __init__(self, multitask_pipeline, task):
+        self.multitask_pipeline = multitask_pipeline
+        self.task = task
+        self.tokenizer = multitask_pipeline.tokenizer
+        self.labels = list(multitask_pipeline.model.config.task_labels[task])
+
+    def __call__(self, inputs, batch_size=None, **_kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        results = [
+            [
+                {k: v for k, v in entity.items() if k != 'probs'}
+                for entity in result[self.task]
+            ]
+            for result in self.multitask_pipeline.classify(texts, batch_size)
+        ]
+        return results[0] if isinstance(inputs, str) else results
+
+    def classify_with_probabilities(self, texts, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS):
+        results = [None] * len(texts)
+        for batch in make_batches(count_tokens(self.tokenizer, texts), max_batch_tokens):
+            batch_texts = [texts[i] for i in batch]
+            for i, result in zip(batch, self.multitask_pipeline.classify(batch_texts, len(batch_texts))):
+                results[i] = [dict(entity) for entity in result[self.task]]
+        return results
+
+
+def create_pipelines(
+    model,
+    multitask_model,
+    cache,
+):
+    """
+    Returns a token classification pipeline for each task, all sharing the same model.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model, cache_dir=cache)
+    multitask_pipeline = MultiTaskPipeline(
+        tokenizer,
+        BertForMultiTaskTokenClassification.from_pretrained(multitask_model),
+    )
+
+    return {
+        task: TaskPipeline(multitask_pipeline, task)
+        for task in tasks
+    }
@@ -0,0 +1,21 @@
+from .. import labels as pos_labels
+from ..spacing import labels as spacing_labels
+from ..error import labels as error_labels
+
+# All tasks of the multi-task model, each task has its own classification head
+#  pos: Morpheme splitting and POS-tagging, see kotok/labels.py
+#  spacing: Spacing error detection, see kotok/spacing/labels.py
+#  error: Spelling error detection, see kotok/error/labels.py
+tasks = ['pos', 'spacing', 'error']
+
+task_labels = {
+    'pos': pos_labels.all_labels,
+    'spacing': spacing_labels.all_labels,
+    'error': error_labels.all_labels,
+}
+
+# Names of the label columns in the training data, one per task
+label_names = [f'{task}_labels' for task in tasks]
+
+# Label index used for tokens that are not labeled for a task
+ignore_label_id = -100
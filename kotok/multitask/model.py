@@ -0,0 +1,82 @@
+import dataclasses
+import torch
+from torch import nn
+from transformers import BertModel, BertPreTrainedModel
+from transformers.utils import ModelOutput
+from .labels import tasks, ignore_label_id
+
+
+@dataclasses.dataclass
+class MultiTaskTokenClassifierOutput(ModelOutput):
+    loss: torch.FloatTensor | None = None
+    pos_logits: torch.FloatTensor | None = None
+    spacing_logits: torch.FloatTensor | None = None
+    error_logits: torch.FloatTensor | None = None
+
+
+class BertForMultiTaskTokenClassification(BertPreTrainedModel):
+    """
+    A single BERT encoder with one token classification head per task.
+    The labels of each task are stored in config.task_labels.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+
+        self.bert = BertModel(config, add_pooling_layer=False)
+
+        classifier_dropout = config.classifier_dropout if config.classifier_dropout is not None else config.hidden_dropout_prob
+        self.dropout = nn.Dropout(classifier_dropout)
+
+        self.classifiers = nn.ModuleDict({
+            task: nn.Linear(config.hidden_size, len(config.task_labels[task]))
+            for task in tasks
+        })
+
+        self.post_init()
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        token_type_ids=None,
+        pos_labels=None,
+        spacing_labels=None,
+        error_labels=None,
+        **kwargs,
+    ):
+        outputs = self.bert(
+            input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+        )
+        sequence_output = self.dropout(outputs[0])
+
+        logits = {
+            task: classifier(sequence_output)
+            for task, classifier in self.classifiers.items()
+        }
+
+        labels = {
+            'pos': pos_labels,
+            'spacing': spacing_labels,
+            'error': error_labels,
+        }
+
+        loss = None
+        loss_fct = nn.CrossEntropyLoss(ignore_index=ignore_label_id)
+        for task in tasks:
+            task_labels = labels[task]
+            # Every example is only labeled for a single task, skip tasks without any labels in this batch
+            if task_labels is None or not (task_labels != ignore_label_id).any():
+                continue
+            task_logits = logits[task]
+            task_loss = loss_fct(task_logits.view(-1, task_logits.shape[-1]), task_labels.view(-1))
+            loss = task_loss if loss is None else loss + task_loss
+
+        return MultiTaskTokenClassifierOutput(
+            loss=loss,
+            pos_logits=logits['pos'],
+            spacing_logits=logits['spacing'],
+            error_logits=logits['error'],
+        )
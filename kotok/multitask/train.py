@@ -0,0 +1,77 @@
+import json
+import torch
+from transformers import AutoConfig, AutoTokenizer, Trainer, TrainingArguments
+from .labels import task_labels, label_names, ignore_label_id
+from .model import BertForMultiTaskTokenClassification
+
+
+class DataCollatorForMultiTaskTokenClassification:
+    """
+    Pads the inputs with the tokenizer and the labels of all tasks with the ignore label.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, features):
+        inputs = [
+            {k: v for k, v in feature.items() if k not in label_names}
+            for feature in features
+        ]
+        batch = self.tokenizer.pad(inputs, padding=True, return_tensors='pt')
+        sequence_length = batch['input_ids'].shape[1]
+
+        for label_name in label_names:
+            batch[label_name] = torch.tensor([
+                feature[label_name] + [ignore_label_id] * (sequence_length - len(feature[label_name]))
+                for feature in features
+            ], dtype=torch.long)
+
+        return batch
+
+
+def train(args):
+    config = AutoConfig.from_pretrained(args.model)
+    config.task_labels = task_labels
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, cache_dir=args.cache)
+
+    model = BertForMultiTaskTokenClassification.from_pretrained(
+        args.model, cache_dir=args.cache, config=config,
+    )
+
+    training_args = TrainingArguments(
+        output_dir=args.output,
+        learning_rate=2e-5,
+        per_device_train_batch_size=16,
+        per_device_eval_batch_size=16,
+        num_train_epochs=2,
+        weight_decay=0.01,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        logging_strategy="steps",
+        logging_steps=5,
+        report_to="tensorboard",
+        logging_dir=args.logs,
+        label_names=label_names,
+    )
+
+    data_collator = DataCollatorForMultiTaskTokenClassification(tokenizer)
+
+    with open(args.data, 'r', encoding='utf-8') as f:
+        dataset = json.load(f)
+
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=dataset['train'],
+        eval_dataset=dataset['validation'],
+        processing_class=tokenizer,
+        data_collator=data_collator,
+    )
+
+    print('Training...')
+    trainer.train()
+
+    print('Saving...')
+    model.save_pretrained(args.output)
@@ -0,0 +1,51 @@
+import array
+import unicodedata
+
+
+def normalize_with_map(text, normalize_mode):
+    """
+    Normalizes each character of the text, returns the normalized text and for each of its positions (and its end)
+    the position in the original text, as a sequence of integers.
+    Text that is already normalized is returned as it is, with an identity map.
+    """
+    if normalize_mode is None or unicodedata.is_normalized(normalize_mode, text):
+        return text, range(len(text) + 1)
+
+    parts = [unicodedata.normalize(normalize_mode, text_char) for text_char in text]
+    convert_map = array.array('i')
+    for text_idx, char_norm in enumerate(parts):
+        if len(char_norm) == 1:
+            convert_map.append(text_idx)
+        else:
+            convert_map.extend([text_idx] * len(char_norm))
+    convert_map.append(len(text))
+
+    return ''.join(parts), convert_map
+
+def normalized_position(text, position, normalize_mode):
+    """
+    Position in the normalized text of a position in the text, the length of the normalized text before it.
+    """
+    return len(unicodedata.normalize(normalize_mode, text[:position]))
+
+def max_normalized_length(text, normalize_mode):
+    """
+    The most characters a single character of the text is normalized to, e.g. 3 for a hangul syllable with a batchim under NFD.
+    """
+    return max((len(unicodedata.normalize(normalize_mode, char)) for char in set(text)), default=1)
+
+def invert_offsets(offset_map, length, mapped_length):
+    """
+    Inverts a map of positions {mapped position: position} into an array from the positions 0 to length
+    to the last mapped position mapped to each of them. Positions without a mapped position take the one of the next position.
+    """
+    inverse = array.array('i', [-1]) * (length + 1)
+    for k, v in offset_map.items():
+        inverse[v] = max(inverse[v], k)
+    inverse[length] = mapped_length
+
+    for i in range(length - 1, -1, -1):
+        if inverse[i] < 0:
+            inverse[i] = inverse[i + 1]
+
+    return inverse
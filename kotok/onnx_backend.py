@@ -0,0 +1,172 @@
+import os
+import weakref
+import logging
+from .batching import DEFAULT_MAX_BATCH_TOKENS, count_tokens, make_batches
+from .pipeline import encode, decode, model_inputs
+
+# exported next to the weights of the fine-tuned model, see export_onnx
+ONNX_FILE_NAME = 'model.onnx'
+OPTIMIZED_ONNX_FILE_NAME = 'model.optimized.onnx'
+# written by `python -m kotok quantize`
+QUANTIZED_ONNX_FILE_NAME = 'model.int8.onnx'
+ONNX_OPSET = 17
+
+# pipelines of this process, see recreate_sessions
+pipelines = weakref.WeakSet()
+# sessions replaced after a fork, destroying them in the forked process crashes it
+replaced_sessions = []
+
+
+def onnx_model_path(classification_model, optimized = None, quantized = False):
+    """
+    Path of the exported model in a classification model directory.
+    optimized: True for the graph-optimized variant, False for the plain export, None for the optimized one if it exists
+    quantized: the int8 model instead
+    """
+    if quantized:
+        return os.path.join(classification_model, QUANTIZED_ONNX_FILE_NAME)
+    optimized_path = os.path.join(classification_model, OPTIMIZED_ONNX_FILE_NAME)
+    if optimized or (optimized is None and os.path.exists(optimized_path)):
+        return optimized_path
+    return os.path.join(classification_model, ONNX_FILE_NAME)
+
+
+def export_onnx(classification_model, optimize = False, opset = ONNX_OPSET):
+    """
+    Export a fine-tuned token classification model to ONNX next to its weights, with dynamic batch and sequence axes.
+    With optimize, onnxruntime also writes the graph-optimized model (fused attention and layer norm) for the CPU.
+    """
+    import torch
+    from transformers import AutoModelForTokenClassification
+
+    model = AutoModelForTokenClassification.from_pretrained(classification_model)
+    model.eval()
+    # the exported graph returns the logits only
+    model.config.return_dict = False
+
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dummy = {name: torch.ones((1, 8), dtype=torch.long) for name in input_names}
+    dummy['token_type_ids'] = torch.zeros((1, 8), dtype=torch.long)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['logits']}
+
+    output_path = os.path.join(classification_model, ONNX_FILE_NAME)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy['input_ids'], dummy['attention_mask'], dummy['token_type_ids']),
+            output_path,
+            input_names=input_names,
+            output_names=['logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            dynamo=False,
+        )
+    print(f'Exported {classification_model} to {output_path}')
+
+    if optimize:
+        import onnxruntime as ort
+
+        optimized_path = os.path.join(classification_model, OPTIMIZED_ONNX_FILE_NAME)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        options.optimized_model_filepath = optimized_path
+        ort.InferenceSession(output_path, options, providers=['CPUExecutionProvider'])
+        print(f'Wrote the optimized model to {optimized_path}')
+
+    return output_path
+
+
+class OnnxPipeline:
+    """
+    Token classification pipeline running an exported model with onnxruntime on the CPU,
+    can be used in place of the transformers pipeline and returns the same entities.
+    """
+
+    def __init__(self, tokenizer, classification_model, optimized = None, threads = None, quantized = False):
+        from transformers import AutoConfig
+
+        self.tokenizer = tokenizer
+        self.config = AutoConfig.from_pretrained(classification_model)
+        self.labels = [self.config.id2label[i] for i in range(len(self.config.id2label))]
+        self.id2label = dict(enumerate(self.labels))
+
+        self.path = onnx_model_path(classification_model, optimized, quantized)
+        if not os.path.exists(self.path):
+            command = 'quantize' if quantized else 'onnx'
+            raise ValueError(f'No ONNX model at {self.path}, run `python -m kotok {command}` first')
+        self.threads = threads
+        self.create_session()
+        self.input_names = tuple(session_input.name for session_input in self.session.get_inputs())
+        pipelines.add(self)
+        logging.debug(f'Loaded {self.path}')
+
+    def create_session(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self.session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+
+    def logits(self, encoding):
+        inputs = {name: value.astype('int64') for name, value in model_inputs(encoding, self.input_names).items()}
+        return self.session.run(['logits'], inputs)[0]
+
+    def classify(self, texts, with_probs = False):
+        encoding = encode(self.tokenizer, texts)
+        return decode(self.tokenizer, texts, encoding, self.logits(encoding), self.id2label, with_probs=with_probs)
+
+    def __call__(self, inputs, batch_size = None, **_kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        batch_size = batch_size or 1
+        results = []
+        for i in range(0, len(texts), batch_size):
+            results.extend(self.classify(texts[i:i + batch_size]))
+        return results[0] if isinstance(inputs, str) else results
+
+    def classify_with_probabilities(self, texts, max_batch_tokens = DEFAULT_MAX_BATCH_TOKENS):
+        results = [None] * len(texts)
+        for batch in make_batches(count_tokens(self.tokenizer, texts), max_batch_tokens):
+            batch_texts = [texts[i] for i in batch]
+            for i, entities in zip(batch, self.classify(batch_texts, with_probs=True)):
+                results[i] = entities
+        return results
+
+
+def create_onnx_pipeline(model, classification_model, cache = None, backend = 'onnx', threads = None):
+    """
+    backend: 'onnx' for the exported model, 'onnx-int8' for its quantized model
+    threads: number of threads of a session, by default onnxruntime uses all cores
+    """
+    from transformers import AutoTokenizer
+
+    if backend not in ('onnx', 'onnx-int8'):
+        raise ValueError(f'Invalid backend: {backend}')
+    tokenizer = AutoTokenizer.from_pretrained(model, cache_dir=cache)
+    return OnnxPipeline(tokenizer, classification_model, threads=threads, quantized=backend == 'onnx-int8')
+
+
+def recreate_sessions(threads = None):
+    """
+    Create the sessions of all pipelines of this process again with the given number of threads.
+    A forked process inherits the sessions but not their thread pools, it has to call this before running them.
+    """
+    for onnx_pipeline in list(pipelines):
+        replaced_sessions.append(onnx_pipeline.session)
+        onnx_pipeline.threads = threads
+        onnx_pipeline.create_session()
+
+
+def onnx_export(
+    input,
+    optimize = False,
+    **_kwargs,
+):
+    """
+    Export fine-tuned classification models to ONNX for the onnx backend of the Analyzer.
+    """
+    for classification_model in input:
+        if not os.path.isdir(classification_model):
+            logging.warning(f'Skipping {classification_model}, not a model directory')
+            continue
+        export_onnx(classification_model, optimize=optimize)
@@ -0,0 +1,119 @@
+import numpy as np
+from .batching import DEFAULT_MAX_BATCH_TOKENS, count_tokens, make_batches
+
+
+def encode(tokenizer, texts):
+    """
+    Tokenize a batch of texts for token classification, padded to the longest text.
+    """
+    return tokenizer(
+        list(texts),
+        padding=True,
+        return_offsets_mapping=True,
+        return_special_tokens_mask=True,
+        return_tensors='np',
+    )
+
+
+def model_inputs(encoding, input_names=('input_ids', 'attention_mask', 'token_type_ids')):
+    """
+    Only the entries of an encoding that are fed into the model.
+    """
+    return {name: encoding[name] for name in input_names if name in encoding}
+
+
+def softmax(logits):
+    maxes = np.max(logits, axis=-1, keepdims=True)
+    shifted_exp = np.exp(logits - maxes)
+    return shifted_exp / shifted_exp.sum(axis=-1, keepdims=True)
+
+
+def decode(tokenizer, texts, encoding, logits, id2label, with_probs=False):
+    """
+    Convert token classification logits of a batch into the same entity dicts as the transformers token classification pipeline
+    (without aggregation and without ignored labels), one list of entities per text.
+    If with_probs is set, each entity also holds the probabilities of all labels ('probs', indexed by label id).
+    """
+    scores = softmax(np.asarray(logits, dtype=np.float32))
+
+    results = []
+    for batch_idx in range(scores.shape[0]):
+        input_ids = encoding['input_ids'][batch_idx]
+        offsets = encoding['offset_mapping'][batch_idx]
+        special_tokens_mask = encoding['special_tokens_mask'][batch_idx]
+        attention_mask = encoding['attention_mask'][batch_idx]
+
+        entities = []
+        for idx in range(len(input_ids)):
+            if special_tokens_mask[idx] or not attention_mask[idx]:
+                continue
+
+            token_scores = scores[batch_idx, idx]
+            label_idx = int(token_scores.argmax())
+            start, end = int(offsets[idx][0]), int(offsets[idx][1])
+
+            word = tokenizer.convert_ids_to_tokens(int(input_ids[idx]))
+            if int(input_ids[idx]) == tokenizer.unk_token_id:
+                word = texts[batch_idx][start:end]
+
+            entity = {
+                'entity': id2label[label_idx],
+                'score': token_scores[label_idx],
+                'index': idx,
+                'word': word,
+                'start': start,
+                'end': end,
+            }
+            if with_probs:
+                entity['probs'] = token_scores
+            entities.append(entity)
+        results.append(entities)
+
+    return results
+
+
+def pipeline_labels(classification_pipeline):
+    """
+    All labels of a token classification pipeline, ordered by label id.
+    """
+    if hasattr(classification_pipeline, 'labels'):
+        return classification_pipeline.labels
+    id2label = classification_pipeline.model.config.id2label
+    return [id2label[i] for i in range(len(id2label))]
+
+
+def pipeline_max_length(classification_pipeline):
+    """
+    The number of tokens the model of a token classification pipeline can take, including the special tokens.
+    """
+    if hasattr(classification_pipeline, 'config'):
+        return classification_pipeline.config.max_position_embeddings
+    model = getattr(classification_pipeline, 'model', None) or classification_pipeline.multitask_pipeline.model
+    return model.config.max_position_embeddings
+
+
+def classify_with_probabilities(classification_pipeline, texts, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS):
+    """
+    Classify texts like the pipeline does, but each entity also holds the probabilities of all labels ('probs', ordered as pipeline_labels).
+    Texts are classified in batches.
+    """
+    if hasattr(classification_pipeline, 'classify_with_probabilities'):
+        return classification_pipeline.classify_with_probabilities(texts, max_batch_tokens)
+
+    import torch
+
+    tokenizer = classification_pipeline.tokenizer
+    model = classification_pipeline.model
+    id2label = dict(enumerate(pipeline_labels(classification_pipeline)))
+
+    results = [None] * len(texts)
+    for batch in make_batches(count_tokens(tokenizer, texts), max_batch_tokens):
+        batch_texts = [texts[i] for i in batch]
+        encoding = encode(tokenizer, batch_texts)
+        with torch.no_grad():
+            inputs = {k: torch.from_numpy(v).to(model.device) for k, v in model_inputs(encoding).items()}
+            logits = model(**inputs).logits.cpu().numpy()
+        for i, entities in zip(batch, decode(tokenizer, batch_texts, encoding, logits, id2label, with_probs=True)):
+            results[i] = entities
+
+    return results
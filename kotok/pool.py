@@ -0,0 +1,102 @@
+import os
+import gc
+import math
+import logging
+import multiprocessing
+
+# the analyzer of a worker process, inherited from the process that created the pool
+worker_analyzer = None
+
+
+def init_worker(analyzer):
+    global worker_analyzer
+    worker_analyzer = analyzer
+
+    import torch
+    # the workers run in parallel, each of them uses a single thread
+    torch.set_num_threads(1)
+
+    # onnxruntime sessions cannot be run across a fork, the workers create them again
+    from . import onnx_backend
+    onnx_backend.recreate_sessions(threads=1)
+
+    # sqlite connections cannot be used across a fork, the caches are opened again
+    from .error import inference as error_inference
+    typo_corrector = error_inference.typo_corrector
+    if typo_corrector is not None and typo_corrector.persistent_cache is not None:
+        typo_corrector.open_cache(typo_corrector.persistent_cache.path)
+
+
+def run_many_worker(args):
+    texts, format, user_dict = args
+    return worker_analyzer.run_many(texts, format=format, user_dict=user_dict)
+
+
+class AnalyzerPool:
+    """
+    Runs an Analyzer in several processes. The models, lexicons and rule tables are loaded once in this process,
+    the workers are forked from it and share its memory copy-on-write, so each further worker only needs the memory it writes to.
+    The rule based parts (spelling candidates, lemmatization, user dictionary matching) hold the GIL, the workers run them in parallel.
+    With the onnx backends each worker creates its own single-threaded sessions, their memory is not shared.
+    Only available on platforms that can fork processes (Linux, macOS).
+    """
+
+    def __init__(self, processes: int | None = None, analyzer=None, **kwargs):
+        """
+        processes: int | None -- The number of worker processes, by default the number of CPUs
+        analyzer: Analyzer | None -- An analyzer to share, otherwise one is created with the remaining arguments, see Analyzer
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError('AnalyzerPool needs the fork start method, which is not available on this platform')
+
+        if analyzer is None:
+            from .inference import Analyzer
+            analyzer = Analyzer(**kwargs)
+        self.analyzer = analyzer
+        self.processes = processes or os.cpu_count()
+
+        # data loaded on first use would otherwise be loaded by every worker
+        if analyzer.error_corretor:
+            from .error.inference import get_typo_corrector
+            get_typo_corrector().preload(analyzer.error_typo_engine)
+
+        # objects of the permanent generation are not touched by the garbage collector, so their pages stay shared with the workers
+        gc.collect()
+        gc.freeze()
+        self.pool = multiprocessing.get_context('fork').Pool(self.processes, initializer=init_worker, initargs=(analyzer,))
+        logging.info(f'Started {self.processes} analyzer workers')
+
+    def run_many(self, texts: list[str], format='pretty', user_dict=None, chunk_size: int | None = None) -> list:
+        """
+        Analyze many texts in the worker processes, results are returned in input order like Analyzer.run_many.
+        texts: list[str] -- The input texts to analyze
+        format: str -- The output format, see Analyzer.run
+        user_dict: list[UserDictEntry] | str | None -- The user dictionary for these texts, a path or a name registered before the pool was created
+        chunk_size: int | None -- The number of texts sent to a worker at once, by default a quarter of an even share so that workers finishing early get more
+        """
+        if not texts:
+            return []
+        chunk_size = chunk_size or max(math.ceil(len(texts) / (self.processes * 4)), 1)
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        results = []
+        for chunk_results in self.pool.imap(run_many_worker, [(chunk, format, user_dict) for chunk in chunks]):
+            results.extend(chunk_results)
+        return results
+
+    def run(self, text: str, format='pretty', user_dict=None):
+        return self.run_many([text], format=format, user_dict=user_dict)[0]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        gc.unfreeze()
+
+    def terminate(self):
+        self.pool.terminate()
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
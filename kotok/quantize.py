@@ -0,0 +1,181 @@
+import os
+import time
+import random
+import logging
+from .document import split_sentences
+from .onnx_backend import OnnxPipeline, onnx_model_path, QUANTIZED_ONNX_FILE_NAME
+from .pipeline import encode, model_inputs
+
+
+def sample_sentences(input, size, seed = 42, max_length = 200):
+    """
+    A uniform sample of the sentences of the txt files of a directory (or a single file), drawn by reservoir sampling
+    so that the corpus is read once and never held in memory.
+    """
+    txt_files = []
+    if os.path.isfile(input):
+        txt_files.append(input)
+    elif os.path.isdir(input):
+        for root, _, files in os.walk(input):
+            for file in files:
+                if file.endswith('.txt'):
+                    txt_files.append(os.path.join(root, file))
+    else:
+        raise ValueError(f'Invalid input: {input}')
+    txt_files.sort()
+
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for txt_file in txt_files:
+        with open(txt_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                for start, end in split_sentences(line):
+                    if end - start > max_length:
+                        continue
+                    seen += 1
+                    if len(sample) < size:
+                        sample.append(line[start:end])
+                    else:
+                        i = rng.randrange(seen)
+                        if i < size:
+                            sample[i] = line[start:end]
+    rng.shuffle(sample)
+    return sample
+
+
+def calibration_reader(tokenizer, sentences, input_names, batch_size):
+    """
+    Feeds batches of encoded sentences to the static quantization calibration of onnxruntime.
+    """
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class SentenceCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter(range(0, len(sentences), batch_size))
+
+        def get_next(self):
+            i = next(self.batches, None)
+            if i is None:
+                return None
+            encoding = encode(tokenizer, sentences[i:i + batch_size])
+            return {name: value.astype('int64') for name, value in model_inputs(encoding, input_names).items()}
+
+    return SentenceCalibrationReader()
+
+
+def quantize_model(classification_model, tokenizer, mode, calibration_sentences, batch_size):
+    """
+    Write the int8 model of an exported classification model (model.onnx), with dynamically quantized activations,
+    or statically quantized activations whose ranges are calibrated on the sentences.
+    """
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantFormat, QuantType
+
+    input_path = onnx_model_path(classification_model, optimized=False)
+    if not os.path.exists(input_path):
+        raise ValueError(f'No exported model at {input_path}, run `python -m kotok onnx` first')
+    output_path = os.path.join(classification_model, QUANTIZED_ONNX_FILE_NAME)
+
+    if mode == 'dynamic':
+        quantize_dynamic(input_path, output_path, weight_type=QuantType.QInt8)
+    elif mode == 'static':
+        fp32 = OnnxPipeline(tokenizer, classification_model, optimized=False)
+        quantize_static(
+            input_path,
+            output_path,
+            calibration_reader(tokenizer, calibration_sentences, fp32.input_names, batch_size),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            # only the matrix multiplications, quantizing the embeddings, layer norms and softmax costs the most accuracy
+            op_types_to_quantize=['MatMul', 'Gemm'],
+        )
+    else:
+        raise ValueError(f'Invalid quantization mode: {mode}')
+    return output_path
+
+
+def compare_models(fp32, int8, sentences, batch_size):
+    """
+    Latency of both pipelines on the sentences and the share of tokens (and sentences) for which the int8 model predicts the same label.
+    Without sentences only the sizes are compared, the other values are None.
+    """
+    latency = {'fp32': None, 'int8': None}
+    results = {'fp32': [], 'int8': []}
+    for name, classification_pipeline in (('fp32', fp32), ('int8', int8)):
+        if not sentences:
+            break
+        # the first batch initializes the session
+        classification_pipeline(sentences[:batch_size], batch_size=batch_size)
+        start = time.perf_counter()
+        results[name] = classification_pipeline(sentences, batch_size=batch_size)
+        latency[name] = (time.perf_counter() - start) / len(sentences) * 1000
+
+    same_tokens = 0
+    tokens = 0
+    same_sentences = 0
+    for fp32_entities, int8_entities in zip(results['fp32'], results['int8']):
+        same = [a['entity'] == b['entity'] for a, b in zip(fp32_entities, int8_entities)]
+        same_tokens += sum(same)
+        tokens += len(same)
+        same_sentences += all(same)
+
+    return {
+        'fp32_ms_per_sentence': latency['fp32'],
+        'int8_ms_per_sentence': latency['int8'],
+        'fp32_mb': os.path.getsize(fp32.path) / 2**20,
+        'int8_mb': os.path.getsize(int8.path) / 2**20,
+        'token_agreement': same_tokens / tokens if tokens else None,
+        'sentence_agreement': same_sentences / len(sentences) if sentences else None,
+    }
+
+
+def format_report_value(value, format_spec):
+    return 'n/a'.rjust(8) if value is None else format(value, format_spec)
+
+
+def quantize(
+    input,
+    model,
+    cache,
+    data,
+    mode,
+    calibration_size,
+    eval_size,
+    batch_size,
+    **_kwargs,
+):
+    """
+    Quantize exported classification models to int8 and report their latency, size and label agreement with the fp32 models
+    on held-out sentences of the corpus, which are not used for calibration.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model, cache_dir=cache)
+
+    print(f'Sampling {calibration_size} calibration and {eval_size} evaluation sentences from {data}...')
+    sentences = sample_sentences(data, calibration_size + eval_size)
+    calibration_sentences = sentences[:calibration_size]
+    eval_sentences = sentences[calibration_size:]
+    if not eval_sentences:
+        logging.warning('No sentences left for the evaluation, the corpus is smaller than the calibration set')
+
+    reports = {}
+    for classification_model in input:
+        print(f'Quantizing {classification_model} ({mode})...')
+        output_path = quantize_model(classification_model, tokenizer, mode, calibration_sentences, batch_size)
+        print(f'Wrote {output_path}')
+
+        fp32 = OnnxPipeline(tokenizer, classification_model)
+        int8 = OnnxPipeline(tokenizer, classification_model, quantized=True)
+        reports[classification_model] = compare_models(fp32, int8, eval_sentences, batch_size)
+
+    print(f'{"model":<40} {"fp32 ms":>8} {"int8 ms":>8} {"fp32 MB":>8} {"int8 MB":>8} {"tokens":>8} {"sents":>8}')
+    for classification_model, report in reports.items():
+        print(
+            f'{classification_model:<40} '
+            f'{format_report_value(report["fp32_ms_per_sentence"], ">8.2f")} {format_report_value(report["int8_ms_per_sentence"], ">8.2f")} '
+            f'{report["fp32_mb"]:>8.1f} {report["int8_mb"]:>8.1f} '
+            f'{format_report_value(report["token_agreement"], ">8.2%")} {format_report_value(report["sentence_agreement"], ">8.2%")}'
+        )
+    return reports
@@ -0,0 +1,88 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+from .cache import LRUCache, PersistentCache, DEFAULT_CACHE_SIZE
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+
+def config_fingerprint(config):
+    """
+    Hash of the settings the analysis results depend on, a JSON serializable mapping.
+    """
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Analysis results by input text, in an in-process LRU cache and optionally in a sqlite file shared by processes.
+    Values are JSON serializable, the caller stores the tokens and the applied corrections of a text.
+    Keys are hashes of the text and a fingerprint of the configuration, so analyzers with different models, normalization,
+    user dictionaries or lemmatization can share the file without clearing it.
+    """
+
+    def __init__(self, path = None, size = DEFAULT_CACHE_SIZE, max_entries = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory = LRUCache(size)
+        self.persistent_cache = None
+        self.pid = None
+        self.write_errors = 0
+
+    @property
+    def persistent(self):
+        # sqlite connections cannot be shared with forked processes, each process opens its own
+        if self.path is None:
+            return None
+        if self.pid != os.getpid():
+            self.persistent_cache = PersistentCache(self.path, max_entries=self.max_entries)
+            self.pid = os.getpid()
+        return self.persistent_cache
+
+    def key(self, fingerprint, text):
+        return hashlib.sha256(f'{fingerprint}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.persistent is None:
+            return value
+        value = self.persistent.get(key)
+        if value is not None:
+            self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """
+        Stores (key, value) pairs, the sqlite file is written in a single transaction.
+        A failed write (e.g. the file is locked for too long) is logged and does not fail the analysis.
+        """
+        for key, value in items:
+            self.memory.put(key, value)
+        if self.persistent is None or not items:
+            return
+        persistent = self.persistent
+        # other threads must not write into or roll back this transaction
+        with persistent.lock:
+            try:
+                for key, value in items:
+                    persistent.put(key, value, commit=False)
+                persistent.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                persistent.rollback()
+                self.write_errors += 1
+                logging.warning(f'Could not write to the result cache {self.path}: {e}')
+
+    def stats(self):
+        stats = {f'memory_{k}': v for k, v in self.memory.stats().items()}
+        if self.persistent is not None:
+            stats.update({f'persistent_{k}': v for k, v in self.persistent.stats().items()})
+            stats['persistent_write_errors'] = self.write_errors
+        lookups = self.memory.hits + self.memory.misses
+        hits = self.memory.hits + (self.persistent.hits if self.persistent is not None else 0)
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,358 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from .stream import correction_records, result_record
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_MAX_WAIT_MS = 5.0
+DEFAULT_MAX_BATCH_TOKENS = 4096
+DEFAULT_MAX_BATCH_SIZE = 64
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class MicroBatcher:
+    """
+    Collects the texts of concurrent requests into batches and runs them with process_many (a list of texts to a list of results) on the executor.
+    A batch is dispatched when max_wait seconds passed since its first text, or when it reaches max_batch_tokens (counted as characters,
+    at least the number of model tokens) or max_batch_size texts. Identical texts that are queued or running share one result.
+    """
+
+    def __init__(self, name, process_many, executor, max_wait, max_batch_tokens, max_batch_size, max_running):
+        self.name = name
+        self.process_many = process_many
+        self.executor = executor
+        self.max_wait = max_wait
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        # batches run at the same time, requests arriving meanwhile form the next batch
+        self.running = asyncio.Semaphore(max_running)
+        self.queue = asyncio.Queue()
+        # text: future of its result, while the text is queued or running
+        self.in_flight = {}
+        self.task = None
+
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.max_batch = 0
+        self.busy_seconds = 0.0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.loop())
+
+    async def submit(self, text):
+        self.requests += 1
+        future = self.in_flight.get(text)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[text] = future
+            self.queue.put_nowait(text)
+        # a cancelled request must not cancel the result other requests wait for
+        return await asyncio.shield(future)
+
+    async def collect(self):
+        """
+        Texts of the next batch, waits for the first one and then at most max_wait for more.
+        """
+        texts = [await self.queue.get()]
+        tokens = len(texts[0])
+        deadline = time.monotonic() + self.max_wait
+        while len(texts) < self.max_batch_size and tokens < self.max_batch_tokens:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                text = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            texts.append(text)
+            tokens += len(text)
+        return texts
+
+    async def loop(self):
+        while True:
+            await self.running.acquire()
+            try:
+                texts = await self.collect()
+            except asyncio.CancelledError:
+                self.running.release()
+                raise
+            asyncio.get_running_loop().create_task(self.run(texts))
+
+    async def run(self, texts):
+        self.batches += 1
+        self.batched_texts += len(texts)
+        self.max_batch = max(self.max_batch, len(texts))
+        start = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.process_many, texts)
+        except Exception as e:
+            logging.exception(f'{self.name} batch of {len(texts)} texts failed')
+            results = [e] * len(texts)
+        finally:
+            self.busy_seconds += time.perf_counter() - start
+            self.running.release()
+
+        for text, result in zip(texts, results):
+            future = self.in_flight.pop(text)
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'in_flight': len(self.in_flight),
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_texts / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch,
+            'busy_seconds': self.busy_seconds,
+        }
+
+
+def token_records(tokens):
+    return [
+        {'surface': token.surface, 'lemma': token.lemma, 'tag': token.tag, 'start': token.start, 'end': token.end}
+        for token in tokens
+    ]
+
+
+def encode_response(response):
+    return json.dumps(response, ensure_ascii=False).encode('utf-8')
+
+
+class AnalysisServer:
+    """
+    HTTP/1.1 server of an Analyzer, built on asyncio streams without further dependencies. Endpoints (POST, JSON body {"text": ...} or {"texts": [...]}):
+    /analyze (corrected text, tokens and corrections), /spelling (spelling corrected text and corrections), /spacing (spacing corrected text)
+    and /lemmatize (lemma and extra tokens of a word). GET /metrics returns the queue depths and batch sizes, GET /health returns ok.
+    The Analyzer is not thread-safe, its calls are serialized: with several workers a batch waits for the running one,
+    so only the batching and the responses overlap with the analysis. AnalyzerPool runs analyses in parallel processes.
+    """
+
+    def __init__(
+        self,
+        analyzer,
+        max_wait_ms = DEFAULT_MAX_WAIT_MS,
+        max_batch_tokens = DEFAULT_MAX_BATCH_TOKENS,
+        max_batch_size = DEFAULT_MAX_BATCH_SIZE,
+        workers = 1,
+    ):
+        self.analyzer = analyzer
+        # held while a batch uses the analyzer, its caches and pipelines must not be used by two threads at once
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kotok')
+        # the cache statistics query the sqlite file and wait for its lock, they must not block the event loop
+        # or wait for the running batches
+        self.stats_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='kotok-stats')
+        self.batcher_options = {
+            'executor': self.executor,
+            'max_wait': max_wait_ms / 1000,
+            'max_batch_tokens': max_batch_tokens,
+            'max_batch_size': max_batch_size,
+            'max_running': workers,
+        }
+        self.process_functions = {
+            '/analyze': self.locked(self.analyze_many),
+            '/spelling': self.locked(self.spelling_many),
+            '/spacing': self.locked(self.spacing_many),
+            '/lemmatize': self.locked(self.lemmatize_many),
+        }
+        self.batchers = {}
+        self.started = time.time()
+
+    def locked(self, process_many):
+        def locked_process_many(texts):
+            with self.lock:
+                return process_many(texts)
+        return locked_process_many
+
+    def analyze_many(self, texts):
+        results = self.analyzer.run_many(texts, format='full')
+        return [result_record({'text': text}, result) for text, result in zip(texts, results)]
+
+    def spelling_many(self, texts):
+        if not self.analyzer.error_corretor_many:
+            raise ValueError('Spelling correction is disabled')
+        return [
+            {'text': text, 'corrected_text': corrected, 'corrections': correction_records(corrections)}
+            for text, (corrected, corrections) in zip(texts, self.analyzer.error_corretor_many(texts))
+        ]
+
+    def spacing_many(self, texts):
+        if not self.analyzer.spacing_corrector_many:
+            raise ValueError('Spacing correction is disabled')
+        return [
+            {'text': text, 'corrected_text': corrected}
+            for text, corrected in zip(texts, self.analyzer.spacing_corrector_many(texts))
+        ]
+
+    def lemmatize_many(self, texts):
+        if not self.analyzer.lemmatizer:
+            raise ValueError('Lemmatization is disabled')
+        results = []
+        for text in texts:
+            lemma, tokens = self.analyzer.lemmatizer.lemmatize(text)
+            results.append({'text': text, 'lemma': lemma, 'tokens': token_records(tokens)})
+        return results
+
+    async def metrics(self):
+        metrics = {
+            'uptime_seconds': time.time() - self.started,
+            'endpoints': {path: batcher.metrics() for path, batcher in self.batchers.items()},
+        }
+        cache_stats = await asyncio.get_running_loop().run_in_executor(self.stats_executor, self.analyzer.cache_stats)
+        if cache_stats is not None:
+            metrics['result_cache'] = cache_stats
+        return metrics
+
+    async def handle_request(self, method, path, body):
+        """
+        Status and JSON response of a request.
+        """
+        path = path.split('?', 1)[0]
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, await self.metrics()
+        if path not in self.batchers:
+            return 404, {'error': f'Unknown endpoint: {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError as e:
+            return 400, {'error': f'Invalid JSON: {e}'}
+        texts = request.get('texts') if isinstance(request, dict) else None
+        single = texts is None
+        if single:
+            texts = [request.get('text')] if isinstance(request, dict) else [None]
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 400, {'error': 'Expected {"text": string} or {"texts": [string, ...]}'}
+
+        batcher = self.batchers[path]
+        try:
+            results = await asyncio.gather(*[batcher.submit(text) for text in texts])
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': str(e)}
+        return 200, results[0] if single else {'results': results}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.write_response(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.write_response(writer, 400, {'error': 'Invalid Content-Length'}, False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.write_response(writer, 413, {'error': 'Request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+                try:
+                    status, response = await self.handle_request(method, path, body)
+                    response = encode_response(response)
+                except Exception as e:
+                    # an unexpected error answers the request instead of dropping the connection
+                    logging.exception(f'{method} {path} failed')
+                    status, response = 500, encode_response({'error': str(e)})
+                await self.write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, status, response, keep_alive):
+        body = response if isinstance(response, bytes) else encode_response(response)
+        writer.write(
+            f'HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n'
+            f'Content-Type: application/json; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def serve(self, host = DEFAULT_HOST, port = DEFAULT_PORT):
+        for path, process_many in self.process_functions.items():
+            batcher = MicroBatcher(path, process_many, **self.batcher_options)
+            batcher.start()
+            self.batchers[path] = batcher
+
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f'Serving on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+def serve(
+    host = DEFAULT_HOST,
+    port = DEFAULT_PORT,
+    max_wait_ms = DEFAULT_MAX_WAIT_MS,
+    batch_tokens = DEFAULT_MAX_BATCH_TOKENS,
+    batch_size = DEFAULT_MAX_BATCH_SIZE,
+    workers = 1,
+    **kwargs,
+):
+    """
+    Load an Analyzer and serve it over HTTP until interrupted.
+    """
+    from .inference import Analyzer
+    analyzer = Analyzer(**kwargs)
+    server = AnalysisServer(
+        analyzer,
+        max_wait_ms=max_wait_ms,
+        max_batch_tokens=batch_tokens,
+        max_batch_size=batch_size,
+        workers=workers,
+    )
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -34,6 +34,7 @@ def make_parser():
     inference.add_argument('-m', '--model', type=str, default=model_default)
     inference.add_argument('-c', '--cache', type=str, default=cache_default)
     inference.add_argument('-f', '--format', type=str, default='pretty')
+    inference.add_argument('-d', '--decoder', type=str, default='search', choices=['search', 'global'])
 
     return parser
 
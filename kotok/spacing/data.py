@@ -8,6 +8,7 @@ import kiwipiepy
 
 from .labels import pos_tags, label2id
 from .error import add_spacing_errors
+from ..offsets import normalize_with_map, invert_offsets
 
 
 kiwi = kiwipiepy.Kiwi(num_workers=0, model_type='sbg')
@@ -43,23 +44,14 @@ def kiwi_tag_map(tag):
     
     return r
 
-def process_sents(tokenizer, normalize_func, sents, max_tokens):
+def process_sents(tokenizer, normalize_mode, sents, max_tokens):
     entries = []
 
     for sent in sents:
         text_no_errors = sent.text
         text, offset_map, spacing_removed, spacing_added = add_spacing_errors(text_no_errors)
 
-        offset_map_inv = {}
-        for k, v in offset_map.items():
-            if v not in offset_map_inv:
-                offset_map_inv[v] = k
-            else:
-                offset_map_inv[v] = max(offset_map_inv[v], k)
-        offset_map_inv[len(text_no_errors)] = len(text)
-        for i in range(len(text_no_errors) + 1):
-            if i not in offset_map_inv:
-                offset_map_inv[i] = offset_map_inv[i + 1]
+        offset_map_inv = invert_offsets(offset_map, len(text_no_errors), len(text))
 
         # print(text_no_errors, '=>', text)
         # print(spacing_removed)
@@ -87,20 +79,7 @@ def process_sents(tokenizer, normalize_func, sents, max_tokens):
         for morph in morphs:
             morph_ends.add(morph['end'])
         
-        og_map = {}
-        text_norm = ''
-
-        for text_idx, text_char in enumerate(text):
-            og_map[len(text_norm)] = text_idx
-            text_norm += normalize_func(text_char)
-        og_map[len(text_norm)] = len(text)
-        
-        last_idx = 0
-        for i in range(len(text_norm) + 1):
-            if i in og_map:
-                last_idx = og_map[i]
-            else:
-                og_map[i] = last_idx
+        text_norm, og_map = normalize_with_map(text, normalize_mode)
         
         tokenized_result = tokenizer(text_norm, return_offsets_mapping=True)
         tokens = tokenizer.convert_ids_to_tokens(tokenized_result['input_ids'])
@@ -146,7 +125,7 @@ def process_sents(tokenizer, normalize_func, sents, max_tokens):
 
     return entries
 
-def process_lines(tokenizer, normalize_func, lines, max_tokens):
+def process_lines(tokenizer, normalize_mode, lines, max_tokens):
     multi_sents_txt = [
         unicodedata.normalize('NFC', line)
         for line in lines
@@ -157,7 +136,7 @@ def process_lines(tokenizer, normalize_func, lines, max_tokens):
     entries = []
     for kiwi_result in kiwi_results:
         entries.extend(
-            process_sents(tokenizer, normalize_func, kiwi_result, max_tokens)
+            process_sents(tokenizer, normalize_mode, kiwi_result, max_tokens)
         )
     return entries
 
@@ -199,11 +178,6 @@ def data(
 
     data = []
 
-    if normalize_mode is None:
-        normalize_func = lambda x: x
-    else:
-        normalize_func = lambda x: unicodedata.normalize(normalize_mode, x)
-
     for txt_file in txt_files_iter:
         total = 0
         with open(txt_file, 'r', encoding='utf-8') as f:
@@ -212,7 +186,7 @@ def data(
         with open(txt_file, 'r', encoding='utf-8') as f:
             for lines in chunked(tqdm(f, leave=False, desc=txt_file, total=total), 500):
                 data.extend(
-                    process_lines(tokenizer, normalize_func, lines, max_token_length)
+                    process_lines(tokenizer, normalize_mode, lines, max_token_length)
                 )
 
     print('Shuffling data...')
@@ -1,5 +1,13 @@
+import math
 import logging
 from transformers import pipeline, AutoTokenizer
+from ..batching import DEFAULT_MAX_BATCH_TOKENS, run_pipeline_batched
+from ..pipeline import classify_with_probabilities, pipeline_labels
+
+# Relative preference of the positions a missing space can be inserted at within a token flagged as SM,
+# missing spaces are more likely at the boundaries of the tokenizer's subwords than inside of them
+INSERT_WEIGHT_EDGE = 1.0
+INSERT_WEIGHT_INSIDE = 0.5
 
 
 def should_correct_token(token, min_error_score=0.4):
@@ -8,9 +16,8 @@ def should_correct_token(token, min_error_score=0.4):
         return token['score'] > min_error_score
     return False
 
-def avg_score_in_span(classification_pipeline, text, start_idx, end_idx):
+def avg_score_of_tokens(tokens, start_idx, end_idx):
     scores = []
-    tokens = classification_pipeline(text)
     for token in tokens:
         token_start = token['start']
         token_end = token['end']
@@ -30,12 +37,29 @@ def avg_score_in_span(classification_pipeline, text, start_idx, end_idx):
 
     return sum(scores) / len(scores)
 
+def avg_score_in_span(classification_pipeline, text, start_idx, end_idx):
+    tokens = classification_pipeline(text)
+    return avg_score_of_tokens(tokens, start_idx, end_idx)
+
+def avg_scores_in_span(classification_pipeline, texts, start_idx, end_idx, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS):
+    """
+    Same as avg_score_in_span for many variants of a text, all variants are classified in batches.
+    """
+    all_tokens = run_pipeline_batched(classification_pipeline, texts, max_batch_tokens)
+    return [
+        avg_score_of_tokens(tokens, start_idx, end_idx)
+        for tokens in all_tokens
+    ]
+
 def correct(
     classification_pipeline,
     text,
     text_start_idx=0,
+    tokens=None,
+    max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
 ):
-    tokens = classification_pipeline(text)
+    if tokens is None:
+        tokens = classification_pipeline(text)
 
     logging.debug(f'Tokens:')
     for token in tokens:
@@ -62,12 +86,13 @@ def correct(
         if entity == 'SM':
             logging.debug(f'Correcting SM: {text[i_start:i_end]}')
 
-            best_correction = None
-            # try to insert space in all possible positions
-            for j in range(i_start, i_end + 1):
-                text_with_space = text[:j] + ' ' + text[j:]
-                score = avg_score_in_span(classification_pipeline, text_with_space, i_start, i_end + 1)
+            # try to insert space in all possible positions, all variants are scored together
+            positions = list(range(i_start, i_end + 1))
+            texts_with_space = [text[:j] + ' ' + text[j:] for j in positions]
+            scores = avg_scores_in_span(classification_pipeline, texts_with_space, i_start, i_end + 1, max_batch_tokens)
 
+            best_correction = None
+            for j, text_with_space, score in zip(positions, texts_with_space, scores):
                 logging.debug(f'Correction: {text_with_space} ({score})')
                 
                 if not best_correction or score > best_correction['score']:
@@ -78,7 +103,7 @@ def correct(
                     }
             if best_correction and best_correction['score'] > 0.7:
                 text = best_correction['text']
-                return correct(classification_pipeline, text, text_start_idx=best_correction['next_start_idx'])
+                return correct(classification_pipeline, text, text_start_idx=best_correction['next_start_idx'], max_batch_tokens=max_batch_tokens)
 
         if entity == 'SE':
             # TODO
@@ -89,11 +114,181 @@ def correct(
     return text
 
 
+def correct_many(
+    classification_pipeline,
+    texts,
+    max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+):
+    """
+    Correct the spacing of many texts. The initial classification of all texts is done in batches,
+    only texts with spacing errors need further passes.
+    """
+    all_tokens = run_pipeline_batched(classification_pipeline, texts, max_batch_tokens)
+    return [
+        correct(classification_pipeline, text, tokens=tokens, max_batch_tokens=max_batch_tokens)
+        for text, tokens in zip(texts, all_tokens)
+    ]
+
+
+#
+# Global decoding, fixes all missing and extra spaces of a text from a single classification pass
+#
+
+def insertion_weight(idx, token_start, token_end):
+    if idx in (token_start, token_end):
+        return INSERT_WEIGHT_EDGE
+    return INSERT_WEIGHT_INSIDE
+
+def decode_spacing(text, tokens, labels, eps=1e-9):
+    """
+    Pick the most probable spacing of the whole text from the label probabilities of its tokens.
+    Each run of spaces in front of a token is removed if the token is more likely SE than not.
+    For every token at most one space is inserted, the positions of all tokens are chosen together with dynamic programming:
+    a space inserted at the end of a token must not be inserted again at the start of the next token.
+    Returns a sorted list of edits (start, end, replacement), text[start:end] is replaced.
+    """
+    sm_idx = labels.index('SM')
+    se_idx = labels.index('SE')
+
+    edits = []
+
+    # extra spaces
+    for token in tokens:
+        start = token['start']
+        run_start = start
+        while run_start > 0 and text[run_start - 1] == ' ':
+            run_start -= 1
+        if run_start == start or run_start == 0:
+            continue
+        p_extra = float(token['probs'][se_idx])
+        if p_extra > 1.0 - p_extra:
+            edits.append((run_start, start, ''))
+
+    # missing spaces
+    # states map the insert position of the previous token (only if it could collide with the current token) to (score, path)
+    states = {None: (0.0, None)}
+    for token in tokens:
+        token_start = token['start']
+        token_end = token['end']
+        p_missing = min(max(float(token['probs'][sm_idx]), eps), 1.0 - eps)
+
+        options = [(math.log(1.0 - p_missing), None)]
+        for idx in range(token_start, token_end + 1):
+            if idx <= 0 or idx >= len(text) or text[idx - 1].isspace() or text[idx].isspace():
+                continue
+            weight = insertion_weight(idx, token_start, token_end)
+            options.append((math.log(p_missing) + math.log(weight), idx))
+
+        new_states = {}
+        for prev_idx, (prev_score, prev_path) in states.items():
+            for score, idx in options:
+                if idx is not None and idx == prev_idx:
+                    continue
+                state = idx if idx == token_end else None
+                total = prev_score + score
+                if state not in new_states or total > new_states[state][0]:
+                    new_states[state] = (total, (idx, prev_path) if idx is not None else prev_path)
+        states = new_states
+
+    _score, path = max(states.values(), key=lambda x: x[0])
+    while path:
+        idx, path = path
+        edits.append((idx, idx, ' '))
+
+    return sorted(edits)
+
+def apply_spacing_edits(text, edits):
+    """
+    Apply edits from decode_spacing. Returns the new text and the position of each edit in the new text.
+    """
+    parts = []
+    positions = []
+    last = 0
+    offset = 0
+    for start, end, replacement in edits:
+        parts.append(text[last:start])
+        parts.append(replacement)
+        positions.append(start + offset)
+        offset += len(replacement) - (end - start)
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts), positions
+
+def is_edit_rejected(tokens, edit, position):
+    """
+    Whether the classification of the edited text still flags the edit, ie the inserted space as SE or the removed space as SM.
+    """
+    start, end, replacement = edit
+    for token in tokens:
+        if not should_correct_token(token):
+            continue
+        if replacement and token['entity'] == 'SE' and token['start'] == position + len(replacement):
+            return True
+        if not replacement and token['entity'] == 'SM' and token['start'] < position + 1 and token['end'] > position - 1:
+            return True
+    return False
+
+def correct_global_many(
+    classification_pipeline,
+    texts,
+    verify=True,
+    max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+):
+    """
+    Correct missing and extra spaces of many texts with a fixed number of batched classification passes:
+    one to decide on all edits, and if verify is set, a second one to revert edits that are still flagged.
+    """
+    labels = pipeline_labels(classification_pipeline)
+    all_tokens = classify_with_probabilities(classification_pipeline, texts, max_batch_tokens)
+
+    all_edits = [
+        decode_spacing(text, tokens, labels)
+        for text, tokens in zip(texts, all_tokens)
+    ]
+    results = [
+        apply_spacing_edits(text, edits)
+        for text, edits in zip(texts, all_edits)
+    ]
+
+    corrected = [new_text for new_text, _positions in results]
+
+    if not verify:
+        return corrected
+
+    changed = [i for i, edits in enumerate(all_edits) if edits]
+    all_verify_tokens = run_pipeline_batched(classification_pipeline, [corrected[i] for i in changed], max_batch_tokens)
+
+    for i, verify_tokens in zip(changed, all_verify_tokens):
+        _new_text, positions = results[i]
+        edits = [
+            edit
+            for edit, position in zip(all_edits[i], positions)
+            if not is_edit_rejected(verify_tokens, edit, position)
+        ]
+        logging.debug(f'Spacing edits of "{texts[i]}": {all_edits[i]}, kept: {edits}')
+        if len(edits) != len(all_edits[i]):
+            corrected[i], _positions = apply_spacing_edits(texts[i], edits)
+
+    return corrected
+
+def correct_global(
+    classification_pipeline,
+    text,
+    verify=True,
+):
+    return correct_global_many(classification_pipeline, [text], verify=verify)[0]
+
+
 def create_pipeline(
     model,
     classification_model,
     cache,
+    backend = 'torch',
 ):
+    if backend != 'torch':
+        from ..onnx_backend import create_onnx_pipeline
+        return create_onnx_pipeline(model, classification_model, cache, backend)
+
     tokenizer = AutoTokenizer.from_pretrained(model, cache_dir=cache)
 
     return pipeline(
@@ -109,6 +304,7 @@ def inference(
     classification_model,
     cache,
     format = 'pretty',
+    decoder = 'search',
     **kwargs,
 ):
     classification_pipeline = create_pipeline(
@@ -123,6 +319,8 @@ def inference(
             if format == 'raw':
                 for token in classification_pipeline(text):
                     print(token)
+            elif decoder == 'global':
+                print(correct_global(classification_pipeline, text))
             else:
                 print(correct(classification_pipeline, text))
         except KeyboardInterrupt:
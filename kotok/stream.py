@@ -0,0 +1,106 @@
+import sys
+import json
+import itertools
+import contextlib
+from tqdm import tqdm
+
+DEFAULT_STREAM_BATCH_SIZE = 256
+
+
+def detect_input_format(input):
+    if input != '-' and input.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'txt'
+
+
+def read_records(f, input_format, text_field):
+    """
+    Records of an input stream, one per line: {text_field: line} for txt, the parsed objects for jsonl.
+    Lines are read lazily, so the whole input is never held in memory.
+    """
+    for line_number, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if input_format == 'txt':
+            yield {text_field: line}
+            continue
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict) or not isinstance(record.get(text_field), str):
+            raise ValueError(f'Line {line_number} has no "{text_field}" string field')
+        yield record
+
+
+def correction_records(corrections):
+    # scores may be numpy floats, which json cannot write
+    return [{**correction, 'score': float(correction['score'])} for correction in corrections]
+
+
+def result_record(record, result):
+    """
+    The input record with the corrected text, the tokens with lemmas and offsets, and the applied spelling corrections.
+    """
+    return {
+        **record,
+        'corrected_text': result.text,
+        'tokens': [
+            {'surface': token.surface, 'lemma': token.lemma, 'tag': token.tag, 'start': token.start, 'end': token.end}
+            for token in result.tokens
+        ],
+        'corrections': correction_records(result.corrections),
+    }
+
+
+@contextlib.contextmanager
+def open_stream(path, mode):
+    if path == '-':
+        yield sys.stdin if 'r' in mode else sys.stdout
+    else:
+        with open(path, mode, encoding='utf-8') as f:
+            yield f
+
+
+def stream(
+    analyzer,
+    input,
+    output = '-',
+    input_format = None,
+    text_field = 'text',
+    batch_size = DEFAULT_STREAM_BATCH_SIZE,
+    document = False,
+):
+    """
+    Analyze a txt (one text per line) or jsonl file, or stdin with '-', and write one JSON object per input record to the output.
+    Records are read and analyzed batch_size at a time, only a single batch is held in memory. With document set,
+    each record is analyzed with run_document, for texts longer than the input length of the models.
+    """
+    input_format = input_format or detect_input_format(input)
+    if input_format not in ('txt', 'jsonl'):
+        raise ValueError(f'Invalid input format: {input_format}')
+
+    with open_stream(input, 'r') as f_in, open_stream(output, 'w') as f_out:
+        records = read_records(f_in, input_format, text_field)
+        progress = tqdm(unit=' texts', file=sys.stderr)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+
+            texts = [record[text_field] for record in batch]
+            # empty texts are written without analyzing them
+            indices = [i for i, text in enumerate(texts) if text.strip()]
+            if document:
+                results = [analyzer.run_document(texts[i]) for i in indices]
+            else:
+                results = analyzer.run_many([texts[i] for i in indices], format='full')
+            results_by_index = dict(zip(indices, results))
+
+            for i, record in enumerate(batch):
+                if i in results_by_index:
+                    out = result_record(record, results_by_index[i])
+                else:
+                    out = {**record, 'corrected_text': texts[i], 'tokens': [], 'corrections': []}
+                f_out.write(json.dumps(out, ensure_ascii=False) + '\n')
+            f_out.flush()
+            progress.update(len(batch))
+        progress.close()
@@ -0,0 +1,602 @@
+import os
+import sys
+import json
+import mmap
+import array
+import bisect
+import struct
+import hashlib
+import dataclasses
+import collections
+import numpy as np
+
+USER_DICT_MAGIC = b'KUDA'
+USER_DICT_VERSION = 1
+USER_DICT_EXTENSION = '.kud'
+# magic, version, content hash, nodes, edges, entry ids of the nodes, entries, size of the string pool
+HEADER = struct.Struct('<4sI64sIIIII')
+# the transitions from the root are cached for this many characters, enough for the syllables of most texts
+MAX_CACHED_TRANSITIONS = 4096
+
+@dataclasses.dataclass
+class UserDictEntry:
+    morph: str
+    suffix_wildcard: bool
+    pos: str
+    pos_match: set[str] | None
+
+
+#
+# User dictionary loading
+#
+
+def load_user_dict_file(file_path: str, _no_sort: bool=False):
+    '''
+    file_path: str -- 
+    '''
+
+    user_dict = []
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line_idx, line in enumerate(file):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            line = line.replace('\t', ' ')
+            space_idx = line.rfind(' ')
+            if space_idx == -1:
+                raise ValueError(f'Invalid user dictionary entry at {file_path}:{line_idx + 1}')
+            
+            suffix_wildcard = False
+            pos_match = None
+            morph = line[:space_idx].strip()
+            pos_raw = line[space_idx + 1:].strip()
+
+            if morph.endswith('*'):
+                morph = morph[:-1].strip()
+                suffix_wildcard = True
+
+            exclamation_idx = pos_raw.rfind('!')
+            if exclamation_idx != -1:
+                pos = pos_raw[:exclamation_idx].strip()
+                pos_parts = [part.strip() for part in pos_raw[exclamation_idx + 1:].split(',') if part.strip()]
+                if pos_parts:
+                    pos_match = set(pos_parts)
+                else:
+                    pos_match = set([pos])
+            else:
+                pos = pos_raw
+
+            user_dict.append(UserDictEntry(
+                morph = morph,
+                suffix_wildcard = suffix_wildcard,
+                pos = pos,
+                pos_match = pos_match,
+            ))
+
+    if not _no_sort:
+        user_dict.sort(key=lambda x: len(x.morph), reverse=True)
+
+    return user_dict
+
+def load_user_dict_dir(dir_path: str, _no_sort: bool=True) -> list[UserDictEntry]:
+    user_dict = []
+    for root, dirs, files in os.walk(dir_path):
+        # sorted, so that the order of the entries (and the hash of the dictionary) does not depend on the file system
+        dirs.sort()
+        for file in sorted(files):
+            if os.path.splitext(file)[1] in ('.tsv'):
+                file_path = os.path.join(root, file)
+                user_dict.extend(load_user_dict_file(file_path, _no_sort=True))
+    if not _no_sort:
+        user_dict = dict(sorted(user_dict.items(), key=lambda x: len(x[0]), reverse=True))
+    return user_dict
+
+def load_user_dict(path: str) -> list[UserDictEntry]:
+    if os.path.isfile(path):
+        return load_user_dict_file(path)
+    elif os.path.isdir(path):
+        return load_user_dict_dir(path)
+    else:
+        raise ValueError(f'Invalid user dictionary: {path}')
+
+def user_dict_hash(user_dict):
+    """
+    Hash of the content of a user dictionary, the same for a dictionary and its compiled artifact.
+    """
+    h = hashlib.sha256()
+    for entry in user_dict:
+        pos_match = sorted(entry.pos_match) if entry.pos_match is not None else None
+        h.update(json.dumps([entry.morph, entry.suffix_wildcard, entry.pos, pos_match], ensure_ascii=False).encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+def is_user_dict_artifact(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(USER_DICT_MAGIC)) == USER_DICT_MAGIC
+
+def source_signature(path):
+    """
+    Sizes and modification times of the files of a user dictionary (a file or a directory), changes when a file is edited.
+    """
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = []
+        for root, _, files in os.walk(path):
+            paths.extend(os.path.join(root, file) for file in files if os.path.splitext(file)[1] == '.tsv')
+    signature = []
+    for file_path in sorted(paths):
+        stat = os.stat(file_path)
+        signature.append((file_path, stat.st_size, stat.st_mtime_ns))
+    return signature
+
+def load_user_dict_matcher(path: str):
+    """
+    Matcher of a user dictionary file, directory or compiled artifact (.kud, memory-mapped).
+    """
+    if is_user_dict_artifact(path):
+        return UserDictMatcher.load(path)
+    return UserDictMatcher(load_user_dict(path))
+
+
+def compile_user_dict(
+    input,
+    output = None,
+    **_kwargs,
+):
+    """
+    Compile a user dictionary file or directory into an artifact (automaton and entries) that is memory-mapped when loaded.
+    """
+    output = output or os.path.splitext(input.rstrip(os.sep))[0] + USER_DICT_EXTENSION
+
+    print(f'Reading user dictionary from {input}...')
+    user_dict = load_user_dict(input)
+
+    print(f'Compiling {len(user_dict)} entries...')
+    matcher = UserDictMatcher(user_dict)
+
+    print(f'Writing {output}...')
+    matcher.save(output)
+
+def to_little_endian(values):
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+def from_little_endian(view, typecode, start, count):
+    """
+    Array of count values at start of a memory-mapped file, without copying on little endian machines.
+    """
+    size = array.array(typecode).itemsize
+    part = view[start:start + size * count]
+    if sys.byteorder == 'little':
+        return part.cast(typecode)
+    values = array.array(typecode, part.tobytes())
+    values.byteswap()
+    return values
+
+
+class CompiledUserDict:
+    """
+    Read-only sequence of the entries of a compiled user dictionary, entries are decoded from the string pool when accessed.
+    """
+
+    def __init__(self, pool, string_start, flags):
+        self.pool = pool
+        self.string_start = string_start
+        self.flags = flags
+
+    def string(self, i):
+        return self.pool[self.string_start[i]:self.string_start[i + 1]].tobytes().decode('utf-8')
+
+    def __getitem__(self, entry_idx):
+        if not 0 <= entry_idx < len(self.flags):
+            raise IndexError(entry_idx)
+        flags = self.flags[entry_idx]
+        pos_match = self.string(3 * entry_idx + 2)
+        return UserDictEntry(
+            morph = self.string(3 * entry_idx),
+            suffix_wildcard = bool(flags & 1),
+            pos = self.string(3 * entry_idx + 1),
+            pos_match = set(pos_match.split(',')) if flags & 2 else None,
+        )
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __iter__(self):
+        for entry_idx in range(len(self)):
+            yield self[entry_idx]
+
+
+class UserDictMatcher:
+    """
+    Aho-Corasick automaton over the morphs of a user dictionary, finds all entries in a text in one pass over the text.
+    Longer entries take precedence over shorter ones, entries of the same length are taken in dictionary order.
+    The automaton is stored in flat arrays, which can be saved as an artifact and memory-mapped.
+    """
+
+    def __init__(self, user_dict, arrays = None, content_hash = None):
+        self.user_dict = user_dict
+        self.hash = content_hash or user_dict_hash(user_dict)
+        self.mmap = None
+        # character: next node from the root, where every failure ends
+        self.root_transitions = {}
+
+        if arrays is None:
+            arrays = self.build(user_dict)
+        # edges of node n: edge_chars/edge_targets[edge_start[n]:edge_start[n + 1]], sorted by character,
+        # fail: longest proper suffix node, output: next node on the fail chain that ends an entry,
+        # entries ending at node n: entry_ids[entry_start[n]:entry_start[n + 1]]
+        (
+            self.edge_start,
+            self.edge_chars,
+            self.edge_targets,
+            self.fail,
+            self.output,
+            self.depth,
+            self.entry_start,
+            self.entry_ids,
+        ) = arrays
+
+    @staticmethod
+    def build(user_dict):
+        # node 0 is the root
+        children = [{}]
+        fail = [0]
+        output = [0]
+        depth = [0]
+        entries = [[]]
+
+        for entry_idx, entry in enumerate(user_dict):
+            if not entry.morph:
+                continue
+            node = 0
+            for char in entry.morph:
+                next_node = children[node].get(char)
+                if next_node is None:
+                    next_node = len(children)
+                    children[node][char] = next_node
+                    children.append({})
+                    fail.append(0)
+                    output.append(0)
+                    depth.append(depth[node] + 1)
+                    entries.append([])
+                node = next_node
+            entries[node].append(entry_idx)
+
+        # breadth first, the fail node of a node is always closer to the root
+        queue = collections.deque(children[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in children[node].items():
+                fail_node = fail[node]
+                while fail_node and char not in children[fail_node]:
+                    fail_node = fail[fail_node]
+                fail[child] = children[fail_node].get(char, 0)
+                output[child] = fail[child] if entries[fail[child]] else output[fail[child]]
+                queue.append(child)
+
+        edge_start = array.array('I', [0])
+        edge_chars = array.array('I')
+        edge_targets = array.array('I')
+        entry_start = array.array('I', [0])
+        entry_ids = array.array('I')
+        for node in range(len(children)):
+            for char, child in sorted(children[node].items()):
+                edge_chars.append(ord(char))
+                edge_targets.append(child)
+            edge_start.append(len(edge_chars))
+            entry_ids.extend(entries[node])
+            entry_start.append(len(entry_ids))
+
+        return (
+            edge_start,
+            edge_chars,
+            edge_targets,
+            array.array('I', fail),
+            array.array('I', output),
+            array.array('I', depth),
+            entry_start,
+            entry_ids,
+        )
+
+    def save(self, path):
+        """
+        Write the automaton and the entries as a compiled user dictionary artifact.
+        """
+        pool = bytearray()
+        string_start = array.array('I', [0])
+        flags = bytearray()
+        for entry in self.user_dict:
+            pos_match = ','.join(sorted(entry.pos_match)) if entry.pos_match is not None else ''
+            for string in (entry.morph, entry.pos, pos_match):
+                pool += string.encode('utf-8')
+                string_start.append(len(pool))
+            flags.append(int(entry.suffix_wildcard) | (2 if entry.pos_match is not None else 0))
+
+        arrays = [
+            self.edge_start,
+            self.edge_chars,
+            self.edge_targets,
+            self.fail,
+            self.output,
+            self.depth,
+            self.entry_start,
+            self.entry_ids,
+            string_start,
+        ]
+
+        # written to a temporary file first, a process reloading the artifact never sees a partial file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(
+                USER_DICT_MAGIC,
+                USER_DICT_VERSION,
+                self.hash.encode('ascii'),
+                len(self.fail),
+                len(self.edge_chars),
+                len(self.entry_ids),
+                len(self.user_dict),
+                len(pool),
+            ))
+            for values in arrays:
+                f.write(to_little_endian(array.array('I', values)).tobytes())
+            f.write(flags)
+            f.write(pool)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map a compiled user dictionary artifact, nothing is parsed or built.
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, content_hash, n_nodes, n_edges, n_entry_ids, n_entries, pool_size = HEADER.unpack_from(mapped, 0)
+        if magic != USER_DICT_MAGIC or version != USER_DICT_VERSION:
+            raise ValueError(f'Not a user dictionary artifact of version {USER_DICT_VERSION}: {path}')
+
+        view = memoryview(mapped)
+        position = HEADER.size
+        arrays = []
+        for count in (n_nodes + 1, n_edges, n_edges, n_nodes, n_nodes, n_nodes, n_nodes + 1, n_entry_ids, 3 * n_entries + 1):
+            arrays.append(from_little_endian(view, 'I', position, count))
+            position += 4 * count
+        string_start = arrays.pop()
+        flags = view[position:position + n_entries]
+        pool = view[position + n_entries:position + n_entries + pool_size]
+        if len(pool) != pool_size:
+            raise ValueError(f'Truncated user dictionary artifact: {path}')
+
+        matcher = cls(CompiledUserDict(pool, string_start, flags), arrays, content_hash.decode('ascii'))
+        matcher.mmap = mapped
+        return matcher
+
+    def goto(self, node, char):
+        """
+        Child of the node for the character, -1 if there is none.
+        """
+        lo = self.edge_start[node]
+        hi = self.edge_start[node + 1]
+        if lo == hi:
+            return -1
+        i = bisect.bisect_left(self.edge_chars, ord(char), lo, hi)
+        if i < hi and self.edge_chars[i] == ord(char):
+            return self.edge_targets[i]
+        return -1
+
+    def step(self, node, char):
+        """
+        Next state of the automaton after reading the character, transitions from the root are cached.
+        """
+        while node:
+            next_node = self.goto(node, char)
+            if next_node >= 0:
+                return next_node
+            node = self.fail[node]
+        next_node = self.root_transitions.get(char)
+        if next_node is None:
+            next_node = max(self.goto(0, char), 0)
+            if len(self.root_transitions) < MAX_CACHED_TRANSITIONS:
+                self.root_transitions[char] = next_node
+        return next_node
+
+    def find_all(self, text):
+        """
+        All occurrences of entries in the text, [(start, end, entry index)].
+        """
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            node = self.step(node, char)
+
+            match_node = node if self.entry_start[node] < self.entry_start[node + 1] else self.output[node]
+            while match_node:
+                start = i + 1 - self.depth[match_node]
+                for entry_idx in self.entry_ids[self.entry_start[match_node]:self.entry_start[match_node + 1]]:
+                    matches.append((start, i + 1, entry_idx))
+                match_node = self.output[match_node]
+        return matches
+
+    def match(self, text, tokens = None, ignore = ()):
+        """
+        Non-overlapping entries in the text, [(start, end, entry index)] sorted by start.
+        A wildcard entry is extended to the end of the token of tokens (pipeline output) that contains it.
+        ignore: (start, end, entry index) matches to skip, the text they cover can be matched by other entries
+        """
+        ignore = set(ignore)
+
+        # end of the token containing each character, to extend wildcard entries
+        token_ends = None
+        if tokens:
+            token_ends = [-1] * len(text)
+            for token in tokens:
+                for i in range(token['start'], min(token['end'], len(text))):
+                    token_ends[i] = token['end']
+
+        candidates = self.find_all(text)
+        candidates.sort(key=lambda m: (-(m[1] - m[0]), m[2], m[0]))
+
+        taken = bytearray(len(text))
+        matches = []
+        for start, end, entry_idx in candidates:
+            if any(taken[start:end]):
+                continue
+
+            # the extension is not applied if it would overlap a longer entry
+            if self.user_dict[entry_idx].suffix_wildcard and token_ends is not None and token_ends[start] >= end:
+                extended_end = token_ends[start]
+                if not any(taken[end:extended_end]):
+                    end = extended_end
+
+            if (start, end, entry_idx) in ignore:
+                continue
+
+            taken[start:end] = b'\x01' * (end - start)
+            matches.append((start, end, entry_idx))
+
+        matches.sort()
+        return matches
+
+
+def bio_transitions(labels):
+    """
+    Allowed label transitions, [previous label, label] is True if I-POS only follows B-POS or I-POS of the same POS.
+    Returns the transitions and the labels allowed at the start.
+    """
+    transitions = np.ones((len(labels), len(labels)), dtype=bool)
+    start = np.ones(len(labels), dtype=bool)
+    for label_idx, label in enumerate(labels):
+        if label.startswith('I-'):
+            pos = label[2:]
+            transitions[:, label_idx] = [prev in (f'B-{pos}', f'I-{pos}') for prev in labels]
+            start[label_idx] = False
+    return transitions, start
+
+def viterbi(emissions, transitions, start):
+    """
+    Most probable label sequence of the tokens, emissions are the label log probabilities of each token
+    (-inf for forbidden labels), transitions and start are the allowed transitions of bio_transitions.
+    """
+    transition_scores = np.where(transitions, 0.0, -np.inf)
+    scores = emissions[0] + np.where(start, 0.0, -np.inf)
+    backpointers = []
+    for token_emissions in emissions[1:]:
+        candidates = scores[:, None] + transition_scores
+        best_prev = candidates.argmax(axis=0)
+        scores = candidates[best_prev, np.arange(len(best_prev))] + token_emissions
+        backpointers.append(best_prev)
+
+    path = [int(scores.argmax())]
+    for best_prev in reversed(backpointers):
+        path.append(int(best_prev[path[-1]]))
+    return path[::-1]
+
+def split_tokens_at(tokens, text, offsets):
+    """
+    Split tokens (pipeline output) at the character offsets, the parts keep the label probabilities of the token.
+    """
+    offsets = sorted(set(offsets))
+    r = []
+    for token in tokens:
+        cuts = [offset for offset in offsets if token['start'] < offset < token['end']]
+        if not cuts:
+            r.append(token)
+            continue
+        bounds = [token['start']] + cuts + [token['end']]
+        for start, end in zip(bounds, bounds[1:]):
+            r.append({**token, 'word': text[start:end], 'start': start, 'end': end})
+    return r
+
+def span_tokens(tokens, start, end):
+    return [i for i, token in enumerate(tokens) if start <= token['start'] and token['end'] <= end and token['start'] < token['end']]
+
+def span_pos(tokens, labels, token_indices, eps=1e-9):
+    """
+    Most probable POS of a span of tokens: B-POS on its first token and I-POS on the others.
+    """
+    best_pos, best_score = None, -np.inf
+    for label_idx, label in enumerate(labels):
+        if not label.startswith('B-'):
+            continue
+        pos = label[2:]
+        inside_idx = labels.index(f'I-{pos}') if f'I-{pos}' in labels else None
+        score = np.log(float(tokens[token_indices[0]]['probs'][label_idx]) + eps)
+        for i in token_indices[1:]:
+            score += np.log(float(tokens[i]['probs'][inside_idx]) + eps) if inside_idx is not None else -np.inf
+        if score > best_score:
+            best_pos, best_score = pos, score
+    return best_pos
+
+def decode_with_user_dict(text, tokens, labels, user_dict, matcher, weight = None, eps=1e-9):
+    """
+    Label the tokens (pipeline output with label probabilities) of a single classification pass with the user dictionary entries in the text.
+    A span of an entry has to be labeled B-POS I-POS ... of the entry, and the token after it must start a new morpheme.
+    Entries with POS checks (pos_match) are dropped if the most probable POS of their span is not one of them,
+    the text they cover can be matched by other entries.
+    weight: None for hard constraints, otherwise the constrained labels get this bonus to their log probability
+    Returns the tokens with the decoded labels, split at the boundaries of the entries.
+    """
+    ignore = set()
+    while True:
+        matches = matcher.match(text, tokens, ignore)
+        rejected = set()
+        for start, end, entry_idx in matches:
+            entry = user_dict[entry_idx]
+            if not entry.pos_match:
+                continue
+            # an entry may start or end within a token, its span is checked on the parts of the tokens it covers
+            span_token_list = split_tokens_at(tokens, text, [start, end])
+            token_indices = span_tokens(span_token_list, start, end)
+            if token_indices and span_pos(span_token_list, labels, token_indices, eps) not in entry.pos_match:
+                rejected.add((start, end, entry_idx))
+        if not rejected:
+            break
+        ignore |= rejected
+
+    tokens = split_tokens_at(tokens, text, [offset for start, end, _ in matches for offset in (start, end)])
+    if not tokens:
+        return tokens
+
+    emissions = np.log(np.stack([np.asarray(token['probs'], dtype=np.float64) for token in tokens]) + eps)
+    begin_labels = np.array([label.startswith('B-') for label in labels])
+    inside_labels = np.array([label.startswith('I-') for label in labels])
+
+    def constrain(token_idx, allowed):
+        if weight is None:
+            emissions[token_idx, ~allowed] = -np.inf
+        else:
+            emissions[token_idx, allowed] += weight
+
+    for start, end, entry_idx in matches:
+        token_indices = span_tokens(tokens, start, end)
+        if not token_indices:
+            continue
+        pos = user_dict[entry_idx].pos
+
+        if f'B-{pos}' in labels:
+            constrain(token_indices[0], np.array([label == f'B-{pos}' for label in labels]))
+        else:
+            constrain(token_indices[0], begin_labels)
+        for i in token_indices[1:]:
+            if f'I-{pos}' in labels:
+                constrain(i, np.array([label == f'I-{pos}' for label in labels]))
+            else:
+                constrain(i, inside_labels)
+
+        next_idx = token_indices[-1] + 1
+        if next_idx < len(tokens):
+            constrain(next_idx, ~inside_labels)
+
+    path = viterbi(emissions, *bio_transitions(labels))
+    return [
+        {**token, 'entity': labels[label_idx], 'score': np.float32(token['probs'][label_idx])}
+        for token, label_idx in zip(tokens, path)
+    ]
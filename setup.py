@@ -9,6 +9,10 @@ setup(
     version='1.0.0',
     packages=['kotok'],
     install_requires=read_requirements(),
+    extras_require={
+        # onnx backend of the Analyzer, see `python -m kotok onnx`
+        'onnx': ['onnx>=1.16.0', 'onnxruntime>=1.18.0'],
+    },
     author='Daeun Jung',
     author_email='Daeun.Jung@ruhr-uni-bochum.de',
     description='Korean morphological analyzer based on the BERT architecture',